@@ -2,12 +2,20 @@
 # 🤖 agente_ecomarket.py — Devoluciones EcoMarket (sin dirección)
 # ============================================================
 
-from langchain.agents import initialize_agent, Tool, AgentType
-from langchain_openai import ChatOpenAI
 from langchain.memory import ConversationBufferMemory
-from typing import Optional
-import unicodedata
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, get_buffer_string
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import os
 import re
+import threading
+import time
+
+from utilidades_texto import normalize_text
+from rag_context import count_tokens
+from faq_index import get_faq_index
+from consultas_catalogo import get_catalog_engine
+from streaming_ecomarket import stream_agent_events
+from telemetria import REGISTRY, debug, error, span, traced
 
 # Herramientas de negocio
 from herramientas_ecomarket import (
@@ -17,7 +25,20 @@ from herramientas_ecomarket import (
 )
 
 # RAG
-from rag_system import build_or_load_chroma, consultar_conocimiento_rag
+from rag_system import (
+    RAG_FAILED,
+    RAG_READY,
+    get_shared_rag_resources,
+    get_answer_cache,
+    consultar_conocimiento_rag,
+    aconsultar_conocimiento_rag,
+    rag_status,
+    start_rag_warmup,
+)
+
+# Con "background" el índice RAG se carga en un hilo: el agente queda listo de inmediato y la
+# herramienta RAG responde "calentando" hasta que termine. "blocking" carga todo antes de retornar.
+RAG_WARMUP_MODE = os.getenv("ECOMARKET_RAG_WARMUP", "background")
 
 
 # -------- Utilidades de tono --------
@@ -32,11 +53,8 @@ def respuesta_amable(texto: str) -> str:
     return f"{saludo}{texto}"
 
 
-def _normalize_text(txt: str) -> str:
-    txt = txt.strip().lower()
-    txt = ''.join(c for c in unicodedata.normalize('NFD', txt) if unicodedata.category(c) != 'Mn')
-    txt = re.sub(r'[^a-z0-9\s]', ' ', txt)
-    return re.sub(r'\s+', ' ', txt).strip()
+# La normalización vive en utilidades_texto para que RAG y herramientas la compartan
+_normalize_text = normalize_text
 
 
 YES = {"si", "sí", "ok", "confirmo", "claro", "vale", "si confirmo", "si por favor", "afirmativo"}
@@ -52,6 +70,112 @@ def _parse_yes_no(txt: str) -> Optional[str]:
     return None
 
 
+# -------- Atajo de FAQ (sin LLM) --------
+# Referencias de pedido/cliente: esos mensajes son del flujo de devolución, nunca de FAQ
+_REF_PATTERN = re.compile(r'\bP-\d+\b|\b\d{8}\b', re.IGNORECASE)
+# FAQs que el agente atiende con su propio flujo (p. ej. "¿cómo hago una devolución?" -> pedir referencia)
+FAQ_FAST_PATH_EXCLUDE = {"faq_016"}
+
+
+def _respuesta_faq(texto: str) -> Optional[str]:
+    """Respuesta directa desde la FAQ si hay una coincidencia de alta confianza; si no, None."""
+    if _REF_PATTERN.search(texto):
+        return None
+    index = get_faq_index()
+    if index is None:
+        return None
+    match = index.best_match(texto)
+    if match is None or match.entry.id in FAQ_FAST_PATH_EXCLUDE:
+        return None
+    return respuesta_amable(match.entry.respuesta)
+
+
+# -------- Enrutador determinista (antes del agente ReAct) --------
+_ORDER_ID_PATTERN = re.compile(r'\bP-\d+\b', re.IGNORECASE)
+_NRO_ID_PATTERN = re.compile(r'(?<!\d)\d{8}(?!\d)')
+# Con una referencia presente, estas raíces indican intención de devolución
+_RETURN_INTENT_PATTERN = re.compile(r'devol|devuel|reembols|retorn')
+
+# Rutas de un turno y llamadas al LLM que cada una evita frente al agente ReAct
+# (elegir herramienta = 1 llamada; FAQ por RAG = elegir herramienta + completar la respuesta)
+ROUTE_CONFIRMACION = "router_confirmacion"
+ROUTE_VERIFICAR = "router_verificar"
+ROUTE_FAQ = "faq"
+ROUTE_CATALOGO = "catalogo"
+ROUTE_AGENTE = "agente"
+LLM_CALLS_SAVED = {ROUTE_CONFIRMACION: 1, ROUTE_VERIFICAR: 1, ROUTE_FAQ: 2, ROUTE_CATALOGO: 1, ROUTE_AGENTE: 0}
+
+
+def _extract_references(texto: str) -> List[str]:
+    """Referencias distintas (P-XXXX en mayúscula o nro_id de 8 dígitos) presentes en el texto."""
+    refs = [m.upper() for m in _ORDER_ID_PATTERN.findall(texto)] + _NRO_ID_PATTERN.findall(texto)
+    return list(dict.fromkeys(refs))
+
+
+def _respuesta_catalogo(texto: str) -> Optional[str]:
+    """Stock, precios o seguimiento de un pedido desde las tablas de inventario y envíos; si no aplica, None."""
+    # Una devolución ("quiero devolver el pedido 1005") sigue el flujo de devolución, no el seguimiento
+    if _NRO_ID_PATTERN.search(texto) or _RETURN_INTENT_PATTERN.search(_normalize_text(texto)):
+        return None
+    engine = get_catalog_engine()
+    if engine is None:
+        return None
+    respuesta = engine.answer(texto)
+    return respuesta_amable(respuesta) if respuesta is not None else None
+
+
+def route_turn(texto: str, esperando_confirmacion: bool) -> Optional[tuple]:
+    """
+    Decide si un turno se puede atender sin el agente. Retorna (ruta, argumento) o None.
+    - sí/no reconocido por _parse_yes_no mientras se espera confirmación -> manejar_confirmacion;
+    - exactamente una referencia, sola o con intención de devolución -> verificar_elegibilidad_devolucion.
+    """
+    if esperando_confirmacion and _parse_yes_no(texto) is not None:
+        return ROUTE_CONFIRMACION, texto
+
+    refs = _extract_references(texto)
+    if len(refs) == 1:
+        resto = _normalize_text(_NRO_ID_PATTERN.sub(" ", _ORDER_ID_PATTERN.sub(" ", texto)))
+        if not resto or _RETURN_INTENT_PATTERN.search(resto):
+            return ROUTE_VERIFICAR, refs[0]
+    return None
+
+
+class TurnStats:
+    """Contadores y tiempos por ruta, compartidos por todas las sesiones del proceso."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict[str, float]] = {}
+
+    def record(self, route: str, seconds: float) -> None:
+        with self._lock:
+            d = self._data.setdefault(route, {"turns": 0, "total_s": 0.0, "max_s": 0.0, "llm_calls_saved": 0})
+            d["turns"] += 1
+            d["total_s"] += seconds
+            d["max_s"] = max(d["max_s"], seconds)
+            d["llm_calls_saved"] += LLM_CALLS_SAVED.get(route, 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = {r: dict(d, avg_ms=round(1000 * d["total_s"] / d["turns"], 2)) for r, d in self._data.items()}
+        total = sum(d["turns"] for d in routes.values())
+        return {
+            "turns": total,
+            "llm_calls_saved": sum(d["llm_calls_saved"] for d in routes.values()),
+            "routed_ratio": (1 - routes.get(ROUTE_AGENTE, {}).get("turns", 0) / total) if total else 0.0,
+            "routes": routes,
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+TURN_STATS = TurnStats()
+TURN_SECONDS = REGISTRY.histogram("ecomarket_turn_seconds", "Duración de cada turno del agente, por ruta.", ("route",))
+
+
 # -------- Memoria de flujo --------
 class EcomarketMemory(ConversationBufferMemory):
     id_devolucion: Optional[str] = None
@@ -66,21 +190,254 @@ class EcomarketMemory(ConversationBufferMemory):
         self.esperando_confirmacion = False
 
 
+MEMORY_MAX_TURNS = int(os.getenv("ECOMARKET_MEMORY_TURNS", "6")) # Turnos recientes que se conservan textuales
+MEMORY_MAX_TOKENS = int(os.getenv("ECOMARKET_MEMORY_TOKENS", "1500")) # Tope duro del historial entregado al agente
+SUMMARY_LINE_CHARS = 160 # Largo máximo de cada intervención dentro del resumen extractivo
+
+
+def _recortar(texto: str, limite: int = SUMMARY_LINE_CHARS) -> str:
+    texto = " ".join(str(texto).split())
+    return texto if len(texto) <= limite else texto[:limite - 1] + "…"
+
+
+def resumen_extractivo(resumen: str, mensajes: List[BaseMessage]) -> str:
+    """Agrega al resumen una línea corta por turno (sin LLM: costo constante por turno)."""
+    lineas = [resumen] if resumen else []
+    for msg in mensajes:
+        rol = "Cliente" if isinstance(msg, HumanMessage) else "EcoBot"
+        lineas.append(f"- {rol}: {_recortar(msg.content)}")
+    return "\n".join(lineas)
+
+
+def _recortar_resumen(resumen: str, max_tokens: int) -> str:
+    """Conserva las líneas más recientes del resumen que entran en max_tokens."""
+    if not resumen or count_tokens(resumen) <= max_tokens:
+        return resumen
+    lineas = resumen.split("\n")
+    costos = [count_tokens(l) + 1 for l in lineas]
+    total = sum(costos)
+    inicio = 0
+    while inicio < len(lineas) and total > max_tokens:
+        total -= costos[inicio]
+        inicio += 1
+    return "\n".join(lineas[inicio:])
+
+
+class EcomarketWindowMemory(EcomarketMemory):
+    """
+    Memoria acotada: los últimos max_turns turnos textuales + un resumen de los anteriores,
+    con un tope duro de max_tokens para todo lo que se entrega al agente.
+    - Los turnos que salen de la ventana se pliegan al resumen de a fold_batch, así el costo
+      de resumir (summarizer, que puede ser un LLM) se paga una vez cada fold_batch turnos.
+    - El estado del flujo de devolución (id_devolucion, esperando_confirmacion) vive en los
+      campos heredados y nunca se pliega ni se recorta; además se informa al agente en cada turno.
+    """
+
+    max_turns: int = MEMORY_MAX_TURNS
+    max_tokens: int = MEMORY_MAX_TOKENS
+    fold_batch: int = 4
+    summary: str = ""
+    summarizer: Optional[Callable[[str, List[BaseMessage]], str]] = None
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        super().save_context(inputs, outputs)
+        mensajes = self.chat_memory.messages
+        excedente = len(mensajes) - 2 * self.max_turns
+        if excedente >= 2 * self.fold_batch:
+            plegar, conservar = list(mensajes[:excedente]), list(mensajes[excedente:])
+            resumir = self.summarizer or resumen_extractivo
+            try:
+                self.summary = resumir(self.summary, plegar)
+            except Exception as e:
+                error(f"Falló el resumen de la memoria; se usa el extractivo: {e}")
+                self.summary = resumen_extractivo(self.summary, plegar)
+            self.summary = _recortar_resumen(self.summary, self.max_tokens // 2)
+            self.chat_memory.clear()
+            self.chat_memory.add_messages(conservar)
+
+    def _nota_de_flujo(self) -> Optional[str]:
+        if self.esperando_confirmacion:
+            return (f"Estado: la devolución {self.id_devolucion} está esperando la confirmación "
+                    f"(sí/no) del cliente.")
+        return None
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        mensajes = list(self.chat_memory.messages)
+        presupuesto = self.max_tokens
+        nota = self._nota_de_flujo()
+        if nota:
+            presupuesto -= count_tokens(nota)
+
+        # Turnos recientes primero: se descartan los más antiguos hasta entrar en el tope
+        costos = [count_tokens(str(m.content)) for m in mensajes]
+        while mensajes and sum(costos) > presupuesto:
+            mensajes, costos = mensajes[1:], costos[1:]
+        restante = presupuesto - sum(costos)
+
+        resumen = _recortar_resumen(self.summary, restante)
+
+        prefijo: List[BaseMessage] = []
+        if resumen:
+            prefijo.append(SystemMessage(content=f"Resumen de la conversación anterior:\n{resumen}"))
+        if nota:
+            prefijo.append(SystemMessage(content=nota))
+        historial = prefijo + mensajes
+
+        if self.return_messages:
+            return {self.memory_key: historial}
+        return {self.memory_key: get_buffer_string(historial, human_prefix=self.human_prefix,
+                                                   ai_prefix=self.ai_prefix)}
+
+    def clear(self) -> None:
+        super().clear()
+        self.summary = ""
+
+
+# -------- Envoltura por sesión --------
+class EcomarketAgent:
+    """
+    Envoltura del agente ReAct con la misma interfaz invoke({"input": ...}) -> {"output": ...}.
+    Antes de llamar al agente:
+    1. el enrutador manda referencias y sí/no directamente a las herramientas;
+    2. stock, precios y seguimiento de pedidos se responden desde las tablas de consultas_catalogo;
+    3. el atajo de FAQ responde preguntas frecuentes claras sin LLM.
+    Solo el texto libre restante llega al agente. Cada turno queda medido en TURN_STATS.
+    """
+
+    def __init__(self, executor, memory: EcomarketMemory,
+                 verificar: Optional[Callable[[str], str]] = None,
+                 confirmar: Optional[Callable[[str], str]] = None):
+        self.executor = executor
+        self.memory = memory
+        self._handlers = {ROUTE_VERIFICAR: verificar, ROUTE_CONFIRMACION: confirmar}
+
+    def _answer_without_agent(self, text: str) -> Optional[tuple]:
+        routed = route_turn(text, self.memory.esperando_confirmacion)
+        if routed is not None:
+            route, arg = routed
+            handler = self._handlers.get(route)
+            if handler is not None:
+                output = handler(arg)
+                if output is not None:
+                    return route, output
+
+        # Mientras se espera confirmación, el turno siempre pertenece al flujo de devolución
+        if not self.memory.esperando_confirmacion:
+            catalogo = _respuesta_catalogo(text)
+            if catalogo is not None:
+                return ROUTE_CATALOGO, catalogo
+            faq = _respuesta_faq(text)
+            if faq is not None:
+                return ROUTE_FAQ, faq
+        return None
+
+    def invoke(self, inputs: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        text = inputs.get("input", "") if isinstance(inputs, dict) else str(inputs)
+        start = time.perf_counter()
+
+        shortcut = self._answer_without_agent(text)
+        if shortcut is not None:
+            route, output = shortcut
+            # Se registra el turno para que el agente conserve el historial completo
+            self.memory.save_context({"input": text}, {"output": output})
+            result = {"input": text, "output": output}
+        else:
+            route = ROUTE_AGENTE
+            with span("agent.executor"):
+                result = self.executor.invoke(inputs, **kwargs)
+
+        elapsed = time.perf_counter() - start
+        TURN_STATS.record(route, elapsed)
+        TURN_SECONDS.observe(elapsed, route=route)
+        debug(f"Turno atendido por '{route}' en {elapsed * 1000:.1f} ms.", route=route,
+              duration_ms=round(elapsed * 1000, 3))
+        return dict(result, route=route)
+
+    async def ainvoke(self, inputs: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        """
+        Versión async de invoke: el agente y el RAG usan ainvoke, de modo que la espera al LLM
+        no bloquea un hilo y un solo event loop atiende muchas conversaciones a la vez.
+        Los atajos (enrutador y FAQ) son cómputo local y se resuelven en el mismo loop.
+        """
+        text = inputs.get("input", "") if isinstance(inputs, dict) else str(inputs)
+        start = time.perf_counter()
+
+        shortcut = self._answer_without_agent(text)
+        if shortcut is not None:
+            route, output = shortcut
+            self.memory.save_context({"input": text}, {"output": output})
+            result = {"input": text, "output": output}
+        else:
+            route = ROUTE_AGENTE
+            with span("agent.executor"):
+                result = await self.executor.ainvoke(inputs, **kwargs)
+
+        elapsed = time.perf_counter() - start
+        TURN_STATS.record(route, elapsed)
+        TURN_SECONDS.observe(elapsed, route=route)
+        debug(f"Turno (async) atendido por '{route}' en {elapsed * 1000:.1f} ms.", route=route,
+              duration_ms=round(elapsed * 1000, 3))
+        return dict(result, route=route)
+
+    def stream(self, inputs: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Igual que invoke, pero genera eventos a medida que ocurren: tokens de la respuesta
+        ({"type": "token"}), pasos de herramientas ({"type": "tool"} / {"type": "tool_end"})
+        y al final {"type": "final", "output": ...}.
+        """
+        return stream_agent_events(self.invoke, inputs)
+
+
 # -------- Inicialización del agente --------
-def initialize_ecomarket_agent(openai_api_key: str, persist_dir: str = "./chroma_db"):
-    llm = ChatOpenAI(
-        temperature=0.1,
-        model="gpt-4o-mini",
-        openai_api_key=openai_api_key,
+def _rag_no_listo(persist_dir: str) -> Optional[str]:
+    """Mensaje para el usuario mientras el índice RAG se está cargando (None si ya está listo)."""
+    status = rag_status(persist_directory=persist_dir)
+    if status == RAG_READY:
+        return None
+    if status == RAG_FAILED:
+        # Se reintenta la carga para la próxima consulta
+        start_rag_warmup(persist_directory=persist_dir)
+        return "RAG no disponible: la base de conocimiento no pudo cargarse. Intenta de nuevo en unos minutos."
+    return respuesta_amable(
+        "⏳ Estoy terminando de cargar la base de conocimiento (warming up). "
+        "Mientras tanto puedo ayudarte con tus devoluciones; intenta tu consulta de nuevo en unos segundos."
     )
 
-    chroma_result = build_or_load_chroma(persist_directory=persist_dir)
-    retriever = chroma_result.get("retriever")
-    doc_count = chroma_result.get("doc_count", 0)
 
-    memory = EcomarketMemory(memory_key="chat_history", return_messages=True)
+def create_llm(openai_api_key: str):
+    """
+    LLM del agente (ChatOpenAI) a través del gateway del proceso: todas las sesiones reciben la
+    misma instancia, con un solo pool de conexiones y límites de tasa y concurrencia compartidos.
+    """
+    from llm_gateway import get_llm_gateway
+    return get_llm_gateway().chat_model(openai_api_key, temperature=0.1, streaming=True)
+
+
+def initialize_ecomarket_agent(openai_api_key: str, persist_dir: str = "./chroma_db", llm=None,
+                               warmup: Optional[str] = None):
+    """
+    Crea el agente de una sesión. Con warmup="background" (por defecto, ECOMARKET_RAG_WARMUP) retorna
+    de inmediato: las herramientas de devolución funcionan desde el primer turno y el índice RAG se
+    carga en segundo plano. Con warmup="blocking" el índice se carga antes de retornar.
+    """
+    from langchain.agents import initialize_agent, Tool, AgentType
+
+    llm = llm or create_llm(openai_api_key)
+    background = (warmup or RAG_WARMUP_MODE) == "background"
+
+    # Recursos pesados (embeddings, Chroma, retriever) compartidos por todo el proceso
+    if background:
+        start_rag_warmup(persist_directory=persist_dir)
+        rag_enabled = True # La herramienta existe desde el inicio e informa si aún no está lista
+    else:
+        chroma_result = get_shared_rag_resources(persist_directory=persist_dir)
+        rag_enabled = bool(chroma_result.get("retriever")) and chroma_result.get("doc_count", 0) > 0
+
+    # Estado por sesión: solo la memoria y el agente
+    memory = EcomarketWindowMemory(memory_key="chat_history", return_messages=True)
 
     # ---- Tool 1: Verificar pedido / elegibilidad ----
+    @traced("tool.verificar_elegibilidad_devolucion")
     def verificar_wrap(ref: str):
         result = verificar_elegibilidad_devolucion(ref)
 
@@ -106,6 +463,7 @@ def initialize_ecomarket_agent(openai_api_key: str, persist_dir: str = "./chroma
         )
 
     # ---- Tool 2: Manejar confirmación (sin dirección) ----
+    @traced("tool.manejar_confirmacion")
     def manejar_confirmacion(user_text: str):
         if not memory.esperando_confirmacion:
             # Si no estamos esperando confirmación, no actúa
@@ -136,34 +494,98 @@ def initialize_ecomarket_agent(openai_api_key: str, persist_dir: str = "./chroma
         # Si no entendí la confirmación, la repito
         return respuesta_amable("Solo para confirmar 😊 ¿Deseas continuar con la devolución? (sí/no)")
 
+    # ---- Tool 3: Stock, precios y seguimiento de pedidos (tablas en memoria, sin LLM) ----
+    @traced("tool.consultar_catalogo_pedidos")
+    def catalogo_wrap(consulta: str):
+        respuesta = _respuesta_catalogo(consulta)
+        if respuesta is not None:
+            return respuesta
+        return respuesta_amable(
+            "No encontré ese producto o pedido 😊 Indícame el nombre del producto "
+            "o el número de pedido (por ejemplo, **pedido 1005** o **TRK1005**)."
+        )
+
+    # Las herramientas de devolución son cómputo local (índices en memoria): sus versiones async
+    # se ejecutan directamente en el event loop, sin pasar por un hilo
+    async def averificar_wrap(ref: str):
+        return verificar_wrap(ref)
+
+    async def amanejar_confirmacion(user_text: str):
+        return manejar_confirmacion(user_text)
+
+    async def acatalogo_wrap(consulta: str):
+        return catalogo_wrap(consulta)
+
     tools = [
         Tool(
             name="verificar_elegibilidad_devolucion",
             func=verificar_wrap,
+            coroutine=averificar_wrap,
             description="Verifica si un pedido es elegible para devolución, dado un ID de pedido (P-XXXX) o un nro_id (8 dígitos).",
             return_direct=True,
         ),
         Tool(
             name="manejar_confirmacion",
             func=manejar_confirmacion,
+            coroutine=amanejar_confirmacion,
             description="Procesa la confirmación (sí/no) del cliente para continuar o cancelar la devolución.",
             return_direct=True,
         ),
+        Tool(
+            name="consultar_catalogo_pedidos",
+            func=catalogo_wrap,
+            coroutine=acatalogo_wrap,
+            description="Responde stock, precios y categorías de productos, y el estado/seguimiento de envío de un pedido (p. ej. 'pedido 1005', 'TRK1005', 'pedidos retrasados en Bogotá').",
+            return_direct=True,
+        ),
     ]
 
     # RAG disponible SOLO cuando NO estamos esperando confirmación
-    if retriever and doc_count > 0:
-        def rag_guard(query: str):
+    if rag_enabled:
+        def _rag_sin_llm(query: str) -> Optional[str]:
+            """Respuestas del RAG que no necesitan LLM (confirmación pendiente, FAQ clara o índice cargando)."""
             if memory.esperando_confirmacion:
                 return respuesta_amable(
                     "Primero confirmemos la devolución 😊 (Responde **sí** o **no**)."
                 )
-            return consultar_conocimiento_rag(query, retriever, llm)
+            # Atajo: preguntas frecuentes claras se responden sin llamar al LLM del RAG
+            faq = _respuesta_faq(query)
+            if faq is not None:
+                return faq
+            return _rag_no_listo(persist_dir)
+
+        @traced("tool.consultar_conocimiento_rag")
+        def rag_guard(query: str, callbacks=None):
+            directa = _rag_sin_llm(query)
+            if directa is not None:
+                return directa
+            # Se consulta el registro en cada llamada para tomar el índice vigente si fue recargado
+            shared = get_shared_rag_resources(persist_directory=persist_dir)
+            return consultar_conocimiento_rag(
+                query, shared.get("retriever"), llm,
+                answer_cache=get_answer_cache(),
+                index_version=shared.get("index_version") or str(shared.get("generation")),
+                callbacks=callbacks, # LangChain inyecta los callbacks del agente (streaming)
+            )
+
+        @traced("tool.consultar_conocimiento_rag")
+        async def arag_guard(query: str, callbacks=None):
+            directa = _rag_sin_llm(query)
+            if directa is not None:
+                return directa
+            shared = get_shared_rag_resources(persist_directory=persist_dir)
+            return await aconsultar_conocimiento_rag(
+                query, shared.get("retriever"), llm,
+                answer_cache=get_answer_cache(),
+                index_version=shared.get("index_version") or str(shared.get("generation")),
+                callbacks=callbacks,
+            )
 
         tools.append(
             Tool(
                 name="consultar_conocimiento_rag",
                 func=rag_guard,
+                coroutine=arag_guard,
                 description="Consulta la base de conocimiento de EcoMarket (políticas, términos, FAQ).",
                 return_direct=True,
             )
@@ -182,12 +604,14 @@ REGLAS:
 4) Si usuario responde sí/no:
    -> Llama a manejar_confirmacion.
 5) Evita mezclar RAG durante confirmación.
+6) Preguntas de stock, precios o de dónde está un pedido:
+   -> Llama a consultar_catalogo_pedidos.
 
 Nunca hables en inglés.
 Responde SIEMPRE con un único saludo (no dupliques saludos en cadena).
 """
 
-    agent = initialize_agent(
+    executor = initialize_agent(
         tools,
         llm,
         agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
@@ -196,4 +620,6 @@ Responde SIEMPRE con un único saludo (no dupliques saludos en cadena).
         agent_kwargs={"system_message": SYSTEM_PROMPT, "memory_prompts": []},
     )
 
+    agent = EcomarketAgent(executor, memory, verificar=verificar_wrap, confirmar=manejar_confirmacion)
     return agent  # <- importante para que app lo reciba
+
@@ -2,7 +2,8 @@ import os
 from dotenv import load_dotenv
 import streamlit as st
 
-from agente_ecomarket import initialize_ecomarket_agent
+from agente_ecomarket import initialize_ecomarket_agent, TURN_STATS
+from rag_system import RAG_READY, rag_status
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -12,6 +13,7 @@ st.set_page_config(page_title="EcoMarket - Asistente", page_icon="♻️", layou
 st.title("🤖 EcoMarket — Asistente de Consultas y Devoluciones")
 
 # ---- Inicialización de estado ----
+# El agente se crea al instante: el índice RAG se carga en segundo plano (ECOMARKET_RAG_WARMUP)
 if "agent" not in st.session_state:
     st.session_state.agent = initialize_ecomarket_agent(OPENAI_API_KEY)
 
@@ -21,6 +23,13 @@ if "messages" not in st.session_state:
 
 agent = st.session_state.agent
 
+if rag_status() != RAG_READY:
+    st.sidebar.caption("⏳ Cargando la base de conocimiento… Las devoluciones ya están disponibles.")
+
+# ---- Métricas del enrutador (turnos atendidos sin LLM, tiempos por ruta) ----
+with st.sidebar.expander("📊 Métricas de turnos"):
+    st.json(TURN_STATS.snapshot())
+
 # ---- Render historial (arriba lo antiguo, abajo lo nuevo) ----
 for role, text in st.session_state.messages:
     if role == "user":
@@ -38,14 +47,29 @@ if prompt:
     with st.chat_message("user"):
         st.markdown(prompt)
 
-    # Ejecutar agente
-    try:
-        result = agent.invoke({"input": prompt})
-        output = result.get("output", str(result))
-    except Exception as e:
-        output = f"Ups, ocurrió un error al procesar tu solicitud: {e}"
+    # Ejecutar agente mostrando los tokens a medida que llegan
+    # (el agente ya devuelve tono amable con saludo único)
+    with st.chat_message("assistant"):
+        status = st.empty()       # Indicador de herramienta en ejecución
+        placeholder = st.empty()  # Texto de la respuesta en construcción
+        streamed = ""
+        output = None
+        try:
+            for event in agent.stream({"input": prompt}):
+                if event["type"] == "token":
+                    streamed += event["text"]
+                    placeholder.markdown(streamed + "▌")
+                elif event["type"] == "tool":
+                    status.caption(f"🔧 Ejecutando **{event['name']}**…")
+                elif event["type"] == "tool_end":
+                    status.empty()
+                elif event["type"] == "final":
+                    output = event["output"]
+        except Exception as e:
+            output = f"Ups, ocurrió un error al procesar tu solicitud: {e}"
+
+        status.empty()
+        output = output if output is not None else streamed
+        placeholder.markdown(output)
 
-    # Mostrar bot (el agente ya devuelve tono amable con saludo único)
     st.session_state.messages.append(("assistant", output))
-    with st.chat_message("assistant"):
-        st.markdown(output)
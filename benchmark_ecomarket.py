@@ -0,0 +1,455 @@
+# ============================================================
+# ⏱️ benchmark_ecomarket.py — Benchmarks sin conexión (LLM y embeddings simulados)
+# ============================================================
+# Mide el rendimiento sin OpenAI ni descarga de bge-m3:
+#   - embeddings locales deterministas (hashing de términos) y un chat model simulado;
+#   - corpus sintético (de cientos a 100k páginas "PDF") y pedidos sintéticos.
+# Métricas: ingesta (páginas/s, chunks/s), carga de build_or_load_chroma, latencia de
+# recuperación p50/p99, throughput de verificar_elegibilidad_devolucion (individual y en
+# lote) y latencia de turno del agente de punta a punta. El resultado es un JSON que se
+# puede comparar entre commits.
+#
+# Uso: python benchmark_ecomarket.py --pages 300,3000 --output resultados.json
+
+import os
+import io
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import asyncio
+import functools
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain.schema import Document
+
+from utilidades_texto import tokenize
+
+
+# --- MODELOS SIMULADOS ---
+class HashingEmbeddings(Embeddings):
+    """
+    Embeddings deterministas sin modelo: cada término (normalizado, ver utilidades_texto.tokenize)
+    suma ±1 en una dimensión elegida por hash. Textos con términos en común quedan cerca,
+    lo suficiente para que la recuperación se comporte como con un modelo real.
+    'cost' > 0 agrega pasadas de cómputo por texto (hash de n-gramas de caracteres) para simular
+    el costo de CPU de un modelo real, p. ej. al medir la ingesta en varios procesos.
+    """
+
+    def __init__(self, dim: int = 384, cost: int = 0):
+        self.dim = dim
+        self.cost = cost
+
+    def _embed(self, text: str) -> List[float]:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for term in tokenize(text):
+            h = zlib.crc32(term.encode("utf-8"))
+            vec[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        data = text.encode("utf-8")
+        for seed in range(self.cost):
+            for i in range(0, len(data) - 3, 2):
+                h = zlib.crc32(data[i:i + 4], seed)
+                vec[h % self.dim] += 0.01 if h & 1 else -0.01
+        norm = float(np.linalg.norm(vec))
+        return (vec / norm).tolist() if norm else vec.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def respuesta_simulada(texto: str) -> str:
+    """
+    Respuesta determinista según el tipo de prompt:
+    - prompt del RAG: resume el inicio del contexto;
+    - prompt ReAct del agente: llama a consultar_conocimiento_rag o cierra con la última observación.
+    """
+    if "Contexto:" in texto and "Pregunta:" in texto:
+        contexto = texto.split("Contexto:", 1)[1].split("Pregunta:", 1)[0]
+        return "Según la información de EcoMarket: " + " ".join(contexto.split()[:40])
+    if "Action Input" in texto:
+        scratchpad = texto.rsplit("Question:", 1)[-1]
+        if "Observation:" in scratchpad:
+            observacion = scratchpad.rsplit("Observation:", 1)[1].split("Thought:", 1)[0].strip()
+            return f"Thought: Ya tengo la respuesta.\nFinal Answer: {observacion}"
+        pregunta = scratchpad.strip().split("\n", 1)[0].strip()
+        return ("Thought: Debo consultar la base de conocimiento.\n"
+                f"Action: consultar_conocimiento_rag\nAction Input: {pregunta}")
+    return "Respuesta simulada de EcoMarket."
+
+
+class FakeEcoChatModel(BaseChatModel):
+    """Chat model determinista con latencia artificial configurable (en segundos)."""
+
+    latency: float = 0.0
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-ecomarket"
+
+    def _result(self, messages) -> ChatResult:
+        self.calls += 1
+        texto = "\n".join(str(m.content) for m in messages)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=respuesta_simulada(texto)))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._result(messages)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._result(messages)
+
+
+# --- DATOS SINTÉTICOS ---
+_PRODUCTOS = ["cepillo de bambú", "botella ecológica", "bolsas reutilizables", "jabón orgánico",
+              "shampoo sólido", "detergente natural", "esponja vegetal", "set de limpieza ecológica",
+              "crema hidratante natural", "paquete de pajillas reutilizables", "toalla orgánica"]
+_FRASES = [
+    "El cliente puede solicitar la devolución de {p} dentro de los {d} días posteriores a la entrega.",
+    "Los reembolsos de {p} se procesan en un plazo de {d} días hábiles tras recibir el producto.",
+    "Para el envío de {p} se utilizan empaques compostables y la entrega tarda entre {d} y {d2} días.",
+    "{P} debe almacenarse en un lugar seco y fresco, lejos de la luz solar directa.",
+    "Los productos de higiene personal como {p} no admiten devolución una vez abiertos.",
+    "La garantía de {p} cubre defectos de fabricación durante {d} meses desde la compra.",
+    "Si {p} llega dañado, el cliente debe reportarlo con fotografías en un máximo de {d} días.",
+    "EcoMarket compensa la huella de carbono de cada envío de {p} con proyectos de reforestación.",
+    "Las etiquetas de devolución de {p} se generan automáticamente y se envían por correo electrónico.",
+    "El uso de {p} reduce el consumo de plásticos de un solo uso en el hogar.",
+]
+
+
+def _frase(rng: random.Random) -> str:
+    p = rng.choice(_PRODUCTOS)
+    d = rng.randint(2, 30)
+    return rng.choice(_FRASES).format(p=p, P=p.capitalize(), d=d, d2=d + rng.randint(1, 5))
+
+
+def generar_corpus(paginas: int, paginas_por_pdf: int = 50, frases_por_pagina: int = 14,
+                   seed: int = 7) -> List[Document]:
+    """Páginas sintéticas con la forma de las de PyPDFLoader (source .pdf y número de página)."""
+    rng = random.Random(seed)
+    docs = []
+    for i in range(paginas):
+        texto = " ".join(_frase(rng) for _ in range(frases_por_pagina))
+        docs.append(Document(page_content=texto, metadata={
+            "source": f"documentos_rag/sintetico_{i // paginas_por_pdf:05d}.pdf",
+            "page": i % paginas_por_pdf,
+        }))
+    return docs
+
+
+def generar_consultas(n: int, seed: int = 11) -> List[str]:
+    rng = random.Random(seed)
+    plantillas = ["¿Cuántos días tengo para devolver {p}?", "¿Cómo se envía {p}?",
+                  "¿Cuánto tarda el reembolso de {p}?", "¿Qué garantía tiene {p}?",
+                  "¿Cómo debo guardar {p}?", "¿Qué hago si {p} llega dañado?"]
+    return [rng.choice(plantillas).format(p=rng.choice(_PRODUCTOS)) for _ in range(n)]
+
+
+def generar_pedidos(n: int, clientes: int, seed: int = 13) -> Dict[str, Dict[str, Any]]:
+    """Pedidos con el formato de PEDIDOS_DB, con fechas de entrega de los últimos 60 días."""
+    rng = random.Random(seed)
+    hoy = date.today()
+    estados = ["Entregado", "Entregado", "Enviado", "En preparación", "Cancelado"]
+    pedidos = {}
+    for i in range(n):
+        pedidos[f"P-{100000 + i}"] = {
+            "status": rng.choice(estados),
+            "date": (hoy - timedelta(days=rng.randint(0, 60))).isoformat(),
+            "productos": rng.sample(_PRODUCTOS, rng.randint(1, 4)),
+            "nro_id": f"{10000000 + rng.randrange(clientes):08d}",
+            "nombre_cliente": f"Cliente {i}",
+        }
+    return pedidos
+
+
+# --- MEDICIONES ---
+def _latencias(valores: List[float]) -> Dict[str, float]:
+    arr = np.asarray(valores, dtype=np.float64) * 1000
+    if not len(arr):
+        return {"count": 0}
+    return {
+        "count": int(len(arr)),
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p90_ms": round(float(np.percentile(arr, 90)), 3),
+        "p99_ms": round(float(np.percentile(arr, 99)), 3),
+        "mean_ms": round(float(arr.mean()), 3),
+        "max_ms": round(float(arr.max()), 3),
+    }
+
+
+def bench_ingesta(docs: List[Document], persist_dir: str) -> Dict[str, Any]:
+    import rag_system
+
+    inicio = time.perf_counter()
+    chunks = rag_system.split_documents(docs)
+    t_split = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    result = rag_system.build_or_load_chroma(docs, persist_directory=persist_dir, force_rebuild=True)
+    t_total = time.perf_counter() - inicio
+    return {
+        "pages": len(docs),
+        "chunks": result.get("doc_count", 0),
+        "split_seconds": round(t_split, 3),
+        "build_seconds": round(t_total, 3),
+        "pages_per_second": round(len(docs) / t_total, 1) if t_total else None,
+        "chunks_per_second": round(len(chunks) / t_total, 1) if t_total else None,
+    }
+
+
+def bench_ingesta_paralela(docs: List[Document], base_dir: str, workers: List[int],
+                           batch_size: int) -> Dict[str, Any]:
+    """
+    Ingesta completa con 1..N procesos de embeddings (rag_parallel_embed). La aceleración se
+    calcula contra el primer valor de 'workers' (normalmente 1 = un solo proceso).
+    """
+    import rag_system
+    from rag_parallel_embed import ParallelEmbedder
+
+    chunks = rag_system.split_documents(docs)
+    textos = [c.page_content for c in chunks]
+    corridas = []
+    base = None
+    for n in workers:
+        if n > 1:
+            # Solo embeddings (sin Chroma), con el modelo ya cargado en los workers
+            with ParallelEmbedder(rag_system.get_embedding_factory(), workers=n, batch_size=batch_size) as embedder:
+                embedder.warm_up()
+                inicio = time.perf_counter()
+                for _ in embedder.imap(textos):
+                    pass
+                t_embed = time.perf_counter() - inicio
+        else:
+            embeddings = rag_system.get_embedding_factory()()
+            inicio = time.perf_counter()
+            for i in range(0, len(textos), batch_size):
+                embeddings.embed_documents(textos[i:i + batch_size])
+            t_embed = time.perf_counter() - inicio
+
+        persist_dir = os.path.join(base_dir, f"chroma_workers_{n}")
+        inicio = time.perf_counter()
+        rag_system.build_or_load_chroma(docs, persist_directory=persist_dir, force_rebuild=True, embed_workers=n)
+        t_ingesta = time.perf_counter() - inicio
+        shutil.rmtree(persist_dir, ignore_errors=True)
+
+        corrida = {
+            "workers": n,
+            "embed_chunks_per_second": round(len(textos) / t_embed, 1) if t_embed else None,
+            "ingest_chunks_per_second": round(len(textos) / t_ingesta, 1) if t_ingesta else None,
+        }
+        if base is None:
+            base = corrida
+        corrida["embed_speedup"] = round(corrida["embed_chunks_per_second"] / base["embed_chunks_per_second"], 2)
+        corrida["ingest_speedup"] = round(corrida["ingest_chunks_per_second"] / base["ingest_chunks_per_second"], 2)
+        corridas.append(corrida)
+    return {"pages": len(docs), "chunks": len(textos), "batch_size": batch_size, "runs": corridas}
+
+
+def bench_carga(persist_dir: str, repeticiones: int = 3) -> Dict[str, Any]:
+    import rag_system
+
+    tiempos = []
+    result: Dict[str, Any] = {}
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        result = rag_system.build_or_load_chroma(persist_directory=persist_dir)
+        tiempos.append(time.perf_counter() - inicio)
+    return {"doc_count": result.get("doc_count", 0), **_latencias(tiempos), "retriever": result.get("retriever")}
+
+
+def bench_recuperacion(retriever, consultas: List[str], k: int = 5) -> Dict[str, Any]:
+    for q in consultas[:5]: # Calentamiento
+        retriever.invoke(q, k=k)
+    tiempos = []
+    for q in consultas:
+        inicio = time.perf_counter()
+        retriever.invoke(q, k=k)
+        tiempos.append(time.perf_counter() - inicio)
+    total = sum(tiempos)
+    return {**_latencias(tiempos), "queries_per_second": round(len(consultas) / total, 1) if total else None}
+
+
+def bench_verificar(n_pedidos: int, n_referencias: int, seed: int = 17) -> Dict[str, Any]:
+    import herramientas_ecomarket as h
+    from repositorio_pedidos import InMemoryOrderRepository, orders_from_dict
+
+    clientes = max(1, n_pedidos // 3)
+    pedidos = generar_pedidos(n_pedidos, clientes)
+    rng = random.Random(seed)
+    ids = list(pedidos)
+    refs = [rng.choice(ids) if rng.random() < 0.5 else f"{10000000 + rng.randrange(clientes):08d}"
+            for _ in range(n_referencias)]
+
+    anterior = h.get_order_repository()
+    inicio = time.perf_counter()
+    h.set_order_repository(InMemoryOrderRepository(orders_from_dict(pedidos)))
+    t_carga = time.perf_counter() - inicio
+    try:
+        h.get_product_resolver()
+        inicio = time.perf_counter()
+        elegibles = sum(1 for r in refs if h.verificar_elegibilidad_devolucion(r)["elegible"])
+        t_individual = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        h.verificar_elegibilidad_lote_jsonl(refs, io.StringIO())
+        t_lote = time.perf_counter() - inicio
+    finally:
+        h.set_order_repository(anterior)
+
+    return {
+        "orders": n_pedidos,
+        "references": n_referencias,
+        "eligible": elegibles,
+        "load_seconds": round(t_carga, 3),
+        "single_refs_per_second": round(n_referencias / t_individual, 1) if t_individual else None,
+        "batch_refs_per_second": round(n_referencias / t_lote, 1) if t_lote else None,
+    }
+
+
+def bench_agente(persist_dir: str, turnos: int, latencia: float) -> Dict[str, Any]:
+    from agente_ecomarket import TURN_STATS, initialize_ecomarket_agent
+
+    llm = FakeEcoChatModel(latency=latencia)
+    consultas = generar_consultas(turnos, seed=23)
+    mensajes = []
+    for i in range(turnos):
+        # Mezcla de turnos: enrutados (referencia y sí/no), FAQ y texto libre para el agente
+        tipo = i % 4
+        if tipo == 0:
+            mensajes.append("Quiero devolver el pedido P-1003")
+        elif tipo == 1:
+            mensajes.append("no")
+        elif tipo == 2:
+            mensajes.append("¿Cuáles son los métodos de pago aceptados?")
+        else:
+            mensajes.append(consultas[i])
+
+    agent = initialize_ecomarket_agent("sk-benchmark", persist_dir=persist_dir, llm=llm, warmup="blocking")
+    TURN_STATS.reset()
+    por_ruta: Dict[str, List[float]] = {}
+    tiempos = []
+    for mensaje in mensajes:
+        inicio = time.perf_counter()
+        result = agent.invoke({"input": mensaje})
+        dt = time.perf_counter() - inicio
+        tiempos.append(dt)
+        por_ruta.setdefault(result.get("route", "?"), []).append(dt)
+    return {
+        "turns": turnos,
+        "llm_latency_ms": latencia * 1000,
+        "llm_calls": llm.calls,
+        **_latencias(tiempos),
+        "routes": {ruta: _latencias(v) for ruta, v in por_ruta.items()},
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_benchmarks(paginas: List[int], pedidos: int, referencias: int, consultas: int, turnos: int,
+                   latencia_llm: float, embed_workers: Optional[List[int]] = None, embed_cost: int = 0,
+                   embed_batch: int = 64) -> Dict[str, Any]:
+    import rag_system
+
+    # Todo el proceso (y los workers de la ingesta paralela) usa los embeddings simulados
+    factory = functools.partial(HashingEmbeddings, cost=embed_cost)
+    rag_system.register_embeddings(factory(), factory=factory)
+    resultados: Dict[str, Any] = {"corpus": []}
+    base_dir = tempfile.mkdtemp(prefix="ecomarket_bench_")
+    try:
+        ultimo_dir = None
+        for n in paginas:
+            persist_dir = os.path.join(base_dir, f"chroma_{n}")
+            docs = generar_corpus(n)
+            ingesta = bench_ingesta(docs, persist_dir)
+            del docs
+            carga = bench_carga(persist_dir)
+            retriever = carga.pop("retriever")
+            recuperacion = bench_recuperacion(retriever, generar_consultas(consultas)) if retriever else {}
+            resultados["corpus"].append({"ingest": ingesta, "load": carga, "retrieval": recuperacion})
+            ultimo_dir = persist_dir
+
+        if embed_workers and paginas:
+            resultados["parallel_ingest"] = bench_ingesta_paralela(
+                generar_corpus(max(paginas)), base_dir, embed_workers, embed_batch)
+        resultados["verificar"] = bench_verificar(pedidos, referencias)
+        if ultimo_dir and turnos:
+            resultados["agent"] = bench_agente(ultimo_dir, turnos, latencia_llm)
+    finally:
+        rag_system.invalidate_shared_rag_resources(drop_embeddings=True)
+        shutil.rmtree(base_dir, ignore_errors=True)
+    return resultados
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks sin conexión de EcoMarket.")
+    parser.add_argument("--pages", default="300", help="Tamaños de corpus en páginas, separados por coma (hasta 100000).")
+    parser.add_argument("--orders", type=int, default=100_000)
+    parser.add_argument("--references", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=40)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0)
+    parser.add_argument("--embed-workers", default="",
+                        help="Procesos de embeddings a comparar en la ingesta paralela, p. ej. 1,2,4,8.")
+    parser.add_argument("--embed-cost", type=int, default=0,
+                        help="Costo de CPU simulado por texto en los embeddings falsos.")
+    parser.add_argument("--embed-batch", type=int, default=64)
+    parser.add_argument("--output", help="Archivo JSON de salida (por defecto, stdout).")
+    args = parser.parse_args()
+
+    paginas = [int(p) for p in args.pages.split(",") if p.strip()]
+    # Los mensajes DEBUG van a stderr: stdout queda solo con el JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        inicio = time.perf_counter()
+        resultados = run_benchmarks(paginas, args.orders, args.references, args.queries, args.turns,
+                                    args.llm_latency_ms / 1000,
+                                    embed_workers=[int(w) for w in args.embed_workers.split(",") if w.strip()],
+                                    embed_cost=args.embed_cost, embed_batch=args.embed_batch)
+        total = time.perf_counter() - inicio
+
+    reporte = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": vars(args),
+            "total_seconds": round(total, 2),
+        },
+        "results": resultados,
+    }
+    texto = json.dumps(reporte, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    print(texto)
+
+
+if __name__ == "__main__":
+    main()
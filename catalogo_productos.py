@@ -0,0 +1,214 @@
+# ============================================================
+# 🏷️ catalogo_productos.py — Resolución de nombres de producto
+# ============================================================
+# Reemplaza la búsqueda lineal por subcadena sobre PRODUCTOS_DB. El resolver se construye
+# una vez desde inventario_productos_ecomarket.csv con los nombres ya normalizados (sin
+# tildes ni mayúsculas) y sus alias:
+#   - búsqueda exacta O(1) por nombre normalizado o por sus términos (plural/orden);
+#   - índice de trigramas para coincidencias aproximadas ("Jabon organico", "balsamo labial").
+
+import os
+import csv
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+from telemetria import debug, error
+from utilidades_texto import normalize_text, tokenize
+
+
+DEFAULT_INVENTORY_PATH = os.path.join("documentos_rag", "inventario_productos_ecomarket.csv")
+DEFAULT_MIN_SCORE = 0.8 # Proporción mínima de trigramas compartidos para aceptar una coincidencia
+MAX_TRIGRAM_POSTINGS = 0.02 # Trigramas presentes en más de esta fracción del catálogo no generan candidatos
+FUZZY_CACHE_MAX = 10_000 # Nombres aproximados ya resueltos que se recuerdan
+RESOLVED_CACHE_MAX = 100_000 # Nombres (texto original) ya resueltos que se recuerdan
+
+_MISSING = object()
+
+
+@dataclass
+class Product:
+    sku: str
+    nombre: str
+    retornable: bool
+    categoria: str = ""
+    precio: Optional[float] = None
+    stock: Optional[int] = None
+    aliases: List[str] = field(default_factory=list)
+
+    @property
+    def names(self) -> List[str]:
+        return [self.nombre] + self.aliases
+
+
+def _parse_bool(value: Any) -> bool:
+    return str(value).strip().lower() in ("true", "1", "si", "sí", "yes")
+
+
+def _parse_number(value: Any, cast) -> Optional[Any]:
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def products_from_csv(path: str = DEFAULT_INVENTORY_PATH) -> Iterator[Product]:
+    """Productos de inventario_productos_ecomarket.csv (producto_id, nombre, categoria, retornable, precio, stock)."""
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            nombre = (row.get("nombre") or "").strip()
+            if not nombre:
+                continue
+            yield Product(
+                sku=(row.get("producto_id") or "").strip(),
+                nombre=nombre,
+                retornable=_parse_bool(row.get("retornable")),
+                categoria=(row.get("categoria") or "").strip(),
+                precio=_parse_number(row.get("precio"), float),
+                stock=_parse_number(row.get("stock"), int),
+            )
+
+
+def products_from_dict(db: Dict[str, Dict[str, Any]]) -> Iterator[Product]:
+    """Productos desde un diccionario con el formato de PRODUCTOS_DB (nombre -> {retornable, sku})."""
+    for nombre, info in db.items():
+        yield Product(sku=str(info.get("sku", "")), nombre=nombre, retornable=bool(info.get("retornable")))
+
+
+def merge_products(*sources: Iterable[Product]) -> List[Product]:
+    """
+    Une fuentes por nombre normalizado (los SKU de PRODUCTOS_DB y del CSV no coinciden):
+    una fuente posterior actualiza 'retornable' y los alias del producto con el mismo nombre.
+    """
+    by_name: Dict[str, Product] = {}
+    merged: List[Product] = []
+    for source in sources:
+        for product in source:
+            key = normalize_text(product.nombre)
+            existing = by_name.get(key)
+            if existing is None:
+                merged.append(product)
+                by_name[key] = product
+                continue
+            existing.retornable = product.retornable
+            known = {normalize_text(n) for n in existing.names}
+            for alias in product.aliases:
+                if normalize_text(alias) not in known:
+                    existing.aliases.append(alias)
+                    known.add(normalize_text(alias))
+    return merged
+
+
+def _trigrams(normalized: str) -> Set[str]:
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _terms_key(name: str) -> str:
+    return " ".join(sorted(tokenize(name)))
+
+
+class ProductResolver:
+    """
+    Resuelve un nombre de producto escrito libremente a un producto del catálogo.
+    Orden: nombre normalizado exacto -> mismos términos -> trigramas (coeficiente de solapamiento,
+    desempate por Dice), aceptando solo coincidencias con puntaje >= min_score.
+    """
+
+    def __init__(self, products: Iterable[Product], min_score: float = DEFAULT_MIN_SCORE):
+        self.min_score = min_score
+        self.products: List[Product] = []
+        self._exact: Dict[str, int] = {}
+        self._by_terms: Dict[str, int] = {}
+        self._name_trigrams: List[Set[str]] = [] # Un set por nombre/alias
+        self._name_owner: List[int] = [] # Nombre/alias -> índice del producto
+        self._postings: Dict[str, List[int]] = {}
+
+        for product in products:
+            idx = len(self.products)
+            self.products.append(product)
+            for name in product.names:
+                normalized = normalize_text(name)
+                if not normalized:
+                    continue
+                self._exact.setdefault(normalized, idx)
+                self._by_terms.setdefault(_terms_key(name), idx)
+                grams = _trigrams(normalized)
+                name_idx = len(self._name_trigrams)
+                self._name_trigrams.append(grams)
+                self._name_owner.append(idx)
+                for gram in grams:
+                    self._postings.setdefault(gram, []).append(name_idx)
+
+        self._max_postings = max(50, int(len(self._name_trigrams) * MAX_TRIGRAM_POSTINGS))
+        # Trigramas útiles por nombre (sin los demasiado comunes), para normalizar el puntaje
+        self._name_useful = [sum(1 for g in grams if len(self._postings[g]) <= self._max_postings)
+                             for grams in self._name_trigrams]
+        self._cache: Dict[str, Optional[int]] = {}
+        self._raw: Dict[str, Optional[int]] = {}
+
+    def resolve(self, name: str) -> Optional[Product]:
+        # Los pedidos repiten los mismos nombres: se recuerda el texto tal cual llega
+        idx = self._raw.get(name, _MISSING)
+        if idx is _MISSING:
+            if len(self._raw) >= RESOLVED_CACHE_MAX:
+                self._raw.clear()
+            idx = self._raw[name] = self._resolve_index(name)
+        return self.products[idx] if idx is not None else None
+
+    def _resolve_index(self, name: str) -> Optional[int]:
+        normalized = normalize_text(name)
+        if not normalized:
+            return None
+        idx = self._exact.get(normalized)
+        if idx is None:
+            idx = self._by_terms.get(_terms_key(name))
+        if idx is None:
+            if normalized not in self._cache:
+                if len(self._cache) >= FUZZY_CACHE_MAX:
+                    self._cache.clear()
+                self._cache[normalized] = self._fuzzy(normalized)
+            idx = self._cache[normalized]
+        return idx
+
+    def _fuzzy(self, normalized: str) -> Optional[int]:
+        shared: Dict[int, int] = {}
+        useful = 0
+        for gram in _trigrams(normalized):
+            postings = self._postings.get(gram)
+            if postings is not None and len(postings) > self._max_postings:
+                continue
+            useful += 1
+            for name_idx in postings or ():
+                shared[name_idx] = shared.get(name_idx, 0) + 1
+
+        best, best_score = None, (0.0, 0.0)
+        for name_idx, common in shared.items():
+            name_useful = self._name_useful[name_idx]
+            # Solapamiento: equivale a "uno contiene al otro"; Dice desempata por parecido total
+            score = (common / max(1, min(useful, name_useful)), 2 * common / (useful + name_useful))
+            if score > best_score:
+                best, best_score = name_idx, score
+        if best is None or best_score[0] < self.min_score:
+            return None
+        return self._name_owner[best]
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+
+def build_product_resolver(seed: Optional[Dict[str, Dict[str, Any]]] = None,
+                           csv_path: str = DEFAULT_INVENTORY_PATH) -> ProductResolver:
+    """
+    Resolver con los productos del CSV de inventario y, encima, los de 'seed' (formato PRODUCTOS_DB):
+    ante el mismo nombre prevalece la política de devolución de 'seed'.
+    """
+    sources: List[Iterable[Product]] = []
+    try:
+        sources.append(list(products_from_csv(csv_path)))
+    except OSError as e:
+        error(f"No se pudo leer el inventario {csv_path}: {e}")
+    if seed:
+        sources.append(products_from_dict(seed))
+    resolver = ProductResolver(merge_products(*sources))
+    debug(f"Resolver de productos construido con {len(resolver)} productos.")
+    return resolver
@@ -0,0 +1,409 @@
+# ============================================================
+# 🧮 consultas_catalogo.py — Stock, precios y seguimiento de pedidos sin LLM
+# ============================================================
+# inventario_productos_ecomarket.csv y pedidos_ecomarket.csv se cargan una vez en tablas
+# columnares (una columna numpy tipada por campo) con índices precomputados:
+#   - clave -> fila (producto_id, pedido_id, tracking) para búsquedas O(1);
+#   - valor normalizado -> filas para columnas categóricas (categoría, estado, ciudad);
+#   - término -> filas sobre los nombres de producto, para reconocerlos dentro de una pregunta.
+# Filtros y agregados (stock total, más barato, pedidos retrasados por ciudad) son máscaras
+# numpy sobre esas columnas. CatalogQueryEngine.answer() responde en texto, de forma
+# determinista, preguntas como "¿hay stock de shampoo sólido?" o "¿dónde está mi pedido 1005?".
+
+import os
+import re
+import csv
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
+
+import numpy as np
+
+from catalogo_productos import DEFAULT_INVENTORY_PATH
+from telemetria import debug, error
+from utilidades_texto import normalize_text, tokenize
+
+
+DEFAULT_ORDERS_PATH = os.path.join("documentos_rag", "pedidos_ecomarket.csv")
+INVENTORY_PATH = os.getenv("ECOMARKET_INVENTORY_CSV", DEFAULT_INVENTORY_PATH)
+ORDERS_PATH = os.getenv("ECOMARKET_TRACKING_CSV", DEFAULT_ORDERS_PATH)
+MAX_LISTED = 8 # Filas que se enumeran en una respuesta (el resto se resume con un conteo)
+GENERIC_TERM_RATIO = 0.2 # Términos presentes en más de esta fracción de productos no identifican uno solo
+
+
+# --- TABLA COLUMNAR ---
+def _to_bool(value: Any) -> bool:
+    return str(value).strip().lower() in ("true", "1", "si", "sí", "yes")
+
+
+def _to_date(value: Any) -> str:
+    value = str(value or "").strip()
+    return value if re.fullmatch(r"\d{4}-\d{2}-\d{2}", value) else "NaT"
+
+
+# Conversión por tipo de columna: valor del CSV -> valor de la columna numpy
+_PARSERS: Dict[str, Callable[[Any], Any]] = {
+    "str": lambda v: str(v or "").strip(),
+    "int": lambda v: int(float(v)) if str(v or "").strip() else 0,
+    "float": lambda v: float(v) if str(v or "").strip() else np.nan,
+    "bool": _to_bool,
+    "date": _to_date,
+}
+_DTYPES = {"str": object, "int": np.int64, "float": np.float64, "bool": np.bool_, "date": "datetime64[D]"}
+
+
+class ColumnTable:
+    """
+    Tabla en memoria con una columna numpy por campo.
+    - key: columna con valores únicos, indexada como valor normalizado -> fila;
+    - categorical: columnas indexadas como valor normalizado -> filas (np.ndarray ordenado).
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray], key: str, categorical: Sequence[str] = ()):
+        lengths = {len(c) for c in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Columnas de distinto largo: {lengths}")
+        self.columns = columns
+        self.key = key
+        self.n = lengths.pop() if lengths else 0
+        self._key_index: Dict[str, int] = {normalize_text(str(v)): i for i, v in enumerate(columns[key])}
+        self._categories: Dict[str, Dict[str, np.ndarray]] = {}
+        for name in categorical:
+            groups: Dict[str, List[int]] = {}
+            for i, value in enumerate(columns[name]):
+                groups.setdefault(normalize_text(str(value)), []).append(i)
+            self._categories[name] = {v: np.asarray(rows, dtype=np.int64) for v, rows in groups.items()}
+
+    @classmethod
+    def from_csv(cls, path: str, schema: Dict[str, str], key: str, categorical: Sequence[str] = (),
+                 transforms: Optional[Dict[str, Callable[[str], str]]] = None) -> "ColumnTable":
+        """Lee el CSV una vez y convierte cada columna del esquema (nombre -> tipo) a su dtype."""
+        raw: Dict[str, List[Any]] = {name: [] for name in schema}
+        transforms = transforms or {}
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                if not (row.get(key) or "").strip():
+                    continue
+                for name, kind in schema.items():
+                    value = row.get(name)
+                    if name in transforms:
+                        value = transforms[name](value or "")
+                    raw[name].append(_PARSERS[kind](value))
+        columns = {name: np.array(values, dtype=_DTYPES[schema[name]]) for name, values in raw.items()}
+        return cls(columns, key=key, categorical=categorical)
+
+    def __len__(self) -> int:
+        return self.n
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def lookup(self, value: str) -> Optional[int]:
+        return self._key_index.get(normalize_text(value))
+
+    def rows_where(self, column: str, value: str) -> np.ndarray:
+        return self._categories[column].get(normalize_text(value), np.empty(0, dtype=np.int64))
+
+    def mask_where(self, column: str, value: str) -> np.ndarray:
+        mask = np.zeros(self.n, dtype=bool)
+        mask[self.rows_where(column, value)] = True
+        return mask
+
+    def values(self, column: str) -> List[str]:
+        """Valores normalizados distintos de una columna categórica."""
+        return list(self._categories[column])
+
+    def row(self, i: int) -> Dict[str, Any]:
+        out = {}
+        for name, column in self.columns.items():
+            value = column[i]
+            if isinstance(value, np.datetime64):
+                value = None if np.isnat(value) else str(value)
+            elif isinstance(value, np.generic):
+                value = value.item()
+            out[name] = value
+        return out
+
+
+INVENTORY_SCHEMA = {"producto_id": "str", "nombre": "str", "categoria": "str", "retornable": "bool",
+                    "precio": "float", "stock": "int"}
+ORDERS_SCHEMA = {"pedido_id": "str", "cliente": "str", "productos": "str", "estado": "str",
+                 "fecha_pedido": "date", "fecha_estimada_entrega": "date", "retrasado": "bool",
+                 "tracking": "str", "ciudad": "str"}
+
+
+def _order_id(value: str) -> str:
+    value = value.strip().upper()
+    return value if value.startswith("P-") else f"P-{value}"
+
+
+def load_inventory_table(path: str = INVENTORY_PATH) -> ColumnTable:
+    return ColumnTable.from_csv(path, INVENTORY_SCHEMA, key="producto_id", categorical=("categoria",))
+
+
+def load_orders_table(path: str = ORDERS_PATH) -> ColumnTable:
+    return ColumnTable.from_csv(path, ORDERS_SCHEMA, key="pedido_id", categorical=("estado", "ciudad"),
+                                transforms={"pedido_id": _order_id})
+
+
+# --- CONSULTAS ---
+def _terms(text: str) -> Set[str]:
+    """Términos sin género ("ecologica"/"ecologico" -> "ecologic") para comparar nombres y preguntas."""
+    return {t[:-1] if len(t) > 4 and t[-1] in "ao" else t for t in tokenize(text)}
+
+
+def _value_in(table: ColumnTable, column: str, normalized: str) -> Optional[str]:
+    """Valor de una columna categórica mencionado en el texto ("enviados" -> "enviado", "Bogotá" -> "bogota")."""
+    terms = _terms(normalized)
+    for value in table.values(column):
+        value_terms = _terms(value)
+        if value_terms and value_terms <= terms:
+            return value
+    return None
+
+
+def _money(value: float) -> str:
+    return "sin precio" if np.isnan(value) else "$" + f"{value:,.0f}".replace(",", ".")
+
+
+_ORDER_REF_PATTERN = re.compile(r'\b(?:P-|pedido\s*(?:n(?:ro|umero)?\.?\s*)?#?\s*|orden\s*#?\s*)(\d{3,7})\b', re.IGNORECASE)
+_TRACKING_PATTERN = re.compile(r'\bTRK\d+\b', re.IGNORECASE)
+_STOCK_PATTERN = re.compile(r'\b(stock|disponib\w*|quedan?|existencias?|unidades|inventario|agotad\w*)\b')
+# "¿hay <producto>?" solo cuenta como pregunta de stock si no dice nada más ("¿hay envío gratis...?" no lo es)
+_BARE_HAY_PATTERN = re.compile(r'^(?:todavia |aun )?hay (.+)$')
+_FILLER_WORDS = {"de", "del", "el", "la", "los", "las", "un", "una", "unos", "unas", "en"}
+# Temas que las tablas no cubren: la pregunta pasa a las FAQ o al agente aunque nombre un producto
+_UNCOVERED_PATTERN = re.compile(r'\b(envio\w*|despacho\w*|garantia\w*|descuento\w*|promocion\w*|oferta\w*|'
+                                r'cupon\w*|devoluc\w*|devolver|reembols\w*|cambio\w*|pago\w*|factura\w*|'
+                                r'politica\w*|gratis|domicilio\w*|ingrediente\w*|alergi\w*)\b')
+_PRICE_PATTERN = re.compile(r'\b(precio\w*|cuesta\w*|cuanto vale|valor|costo\w*)\b')
+_CHEAPEST_PATTERN = re.compile(r'\b(mas barat\w*|mas economic\w*|menor precio)\b')
+_ORDERS_PATTERN = re.compile(r'\bpedidos?\b')
+_DELAYED_PATTERN = re.compile(r'\b(retrasad\w*|atrasad\w*|demorad\w*|con retraso)\b')
+
+
+class CatalogQueryEngine:
+    """Filtros, búsquedas y agregados sobre inventario y pedidos, sin LLM."""
+
+    def __init__(self, inventory: ColumnTable, orders: Optional[ColumnTable] = None):
+        self.inventory = inventory
+        self.orders = orders
+        self._name_terms: List[Set[str]] = [_terms(n) for n in inventory["nombre"]]
+        self._term_rows: Dict[str, List[int]] = {}
+        for i, terms in enumerate(self._name_terms):
+            for term in terms:
+                self._term_rows.setdefault(term, []).append(i)
+        # "ecologico", "natural", "organico"...: aparecen en muchos nombres y no identifican un producto
+        limit = max(2, int(len(inventory) * GENERIC_TERM_RATIO))
+        self._generic_terms = {t for t, rows in self._term_rows.items() if len(rows) > limit}
+        self._known_terms = set(self._term_rows)
+        for categoria in inventory.values("categoria"):
+            self._known_terms |= _terms(categoria)
+
+    # -------- Inventario --------
+    def find_products(self, text: str) -> List[int]:
+        """
+        Filas de los productos mencionados en el texto: los que comparten más términos con él,
+        siempre que al menos uno sea distintivo. Varias filas = mención ambigua ("toalla").
+        """
+        terms = _terms(text)
+        scores: Dict[int, int] = {}
+        for term in terms - self._generic_terms:
+            for i in self._term_rows.get(term, ()):
+                scores[i] = 0
+        if not scores:
+            return []
+        for i in scores:
+            scores[i] = len(self._name_terms[i] & terms)
+        best = max(scores.values())
+        return sorted(i for i, s in scores.items() if s == best)
+
+    def products_in_category(self, categoria: str, in_stock: bool = False) -> np.ndarray:
+        mask = self.inventory.mask_where("categoria", categoria)
+        if in_stock:
+            mask &= self.inventory["stock"] > 0
+        return np.flatnonzero(mask)
+
+    def category_summary(self, categoria: str) -> Optional[Dict[str, Any]]:
+        rows = self.products_in_category(categoria)
+        if rows.size == 0:
+            return None
+        precios = self.inventory["precio"][rows]
+        cheapest = rows[np.nanargmin(precios)] if not np.all(np.isnan(precios)) else rows[0]
+        return {
+            "categoria": self.inventory["categoria"][rows[0]],
+            "productos": int(rows.size),
+            "stock_total": int(self.inventory["stock"][rows].sum()),
+            "agotados": int((self.inventory["stock"][rows] <= 0).sum()),
+            "precio_min": float(np.nanmin(precios)) if not np.all(np.isnan(precios)) else None,
+            "precio_max": float(np.nanmax(precios)) if not np.all(np.isnan(precios)) else None,
+            "mas_barato": self.inventory.row(int(cheapest)),
+        }
+
+    def _category_in(self, normalized: str) -> Optional[str]:
+        return _value_in(self.inventory, "categoria", normalized)
+
+    def _is_bare_availability(self, normalized: str) -> bool:
+        """True para "¿hay <producto o categoría>?" sin otras palabras ("hay jabon organico")."""
+        match = _BARE_HAY_PATTERN.match(normalized)
+        if match is None:
+            return False
+        words = [w for w in match.group(1).split() if w not in _FILLER_WORDS]
+        return bool(words) and all(_terms(w) <= self._known_terms for w in words)
+
+    # -------- Pedidos --------
+    def order(self, reference: str) -> Optional[Dict[str, Any]]:
+        """Pedido por ID (1005, P-1005) o por guía de seguimiento (TRK1005)."""
+        if self.orders is None:
+            return None
+        ref = reference.strip().upper()
+        i = self.orders.lookup(_order_id(ref) if not ref.startswith("TRK") else ref)
+        if i is None and ref.startswith("TRK"):
+            rows = np.flatnonzero(self.orders["tracking"] == ref)
+            i = int(rows[0]) if rows.size else None
+        return self.orders.row(i) if i is not None else None
+
+    def orders_where(self, ciudad: Optional[str] = None, estado: Optional[str] = None,
+                     retrasado: Optional[bool] = None) -> List[Dict[str, Any]]:
+        if self.orders is None:
+            return []
+        mask = np.ones(len(self.orders), dtype=bool)
+        if ciudad:
+            mask &= self.orders.mask_where("ciudad", ciudad)
+        if estado:
+            mask &= self.orders.mask_where("estado", estado)
+        if retrasado is not None:
+            mask &= self.orders["retrasado"] == retrasado
+        return [self.orders.row(int(i)) for i in np.flatnonzero(mask)]
+
+    # -------- Respuestas en texto --------
+    def answer(self, query: str) -> Optional[str]:
+        """
+        Respuesta determinista a una pregunta de stock, precio, categoría o seguimiento de pedidos.
+        None si la pregunta no es de ese tipo, no menciona un producto/pedido reconocible o trata
+        temas que las tablas no cubren (envíos, garantía, descuentos, devoluciones...).
+        """
+        normalized = normalize_text(query)
+        if not normalized:
+            return None
+
+        reference = _TRACKING_PATTERN.search(query) or _ORDER_REF_PATTERN.search(query)
+        if reference is not None and self.orders is not None:
+            ref = reference.group(0) if reference.re is _TRACKING_PATTERN else reference.group(1)
+            order = self.order(ref)
+            if order is None:
+                shown = ref.upper() if reference.re is _TRACKING_PATTERN else _order_id(ref)
+                return f"No encontré el pedido **{shown}** en el registro de envíos."
+            return self._format_order(order)
+
+        if _UNCOVERED_PATTERN.search(normalized):
+            return None
+
+        if _ORDERS_PATTERN.search(normalized) and self.orders is not None:
+            summary = self._answer_orders(normalized)
+            if summary is not None:
+                return summary
+
+        wants_stock = _STOCK_PATTERN.search(normalized) is not None or self._is_bare_availability(normalized)
+        wants_price = _PRICE_PATTERN.search(normalized) is not None
+        categoria = self._category_in(normalized)
+        if _CHEAPEST_PATTERN.search(normalized) and categoria:
+            summary = self.category_summary(categoria)
+            return (f"El producto más económico de **{summary['categoria']}** es "
+                    f"{self._format_product(summary['mas_barato'])}.")
+
+        if not (wants_stock or wants_price):
+            return None
+        # La categoría ("limpieza") no cuenta como mención de un producto que la lleve en el nombre
+        rows = self.find_products(" ".join(w for w in normalized.split()
+                                           if not categoria or _terms(w) - _terms(categoria)))
+        if rows:
+            lines = [self._format_product(self.inventory.row(i), wants_stock, wants_price) for i in rows[:MAX_LISTED]]
+            if len(lines) == 1:
+                return f"{lines[0][0].upper()}{lines[0][1:]}."
+            return "Encontré estos productos:\n" + "\n".join(f"- {line}" for line in lines)
+        if categoria:
+            summary = self.category_summary(categoria)
+            return (f"En **{summary['categoria']}** tenemos {summary['productos']} productos con "
+                    f"{summary['stock_total']} unidades en total ({summary['agotados']} agotados); "
+                    f"precios entre {_money(summary['precio_min'])} y {_money(summary['precio_max'])}.")
+        return None
+
+    def _answer_orders(self, normalized: str) -> Optional[str]:
+        ciudad = _value_in(self.orders, "ciudad", normalized)
+        estado = _value_in(self.orders, "estado", normalized)
+        retrasado = True if _DELAYED_PATTERN.search(normalized) else None
+        if ciudad is None and estado is None and retrasado is None:
+            return None
+        orders = self.orders_where(ciudad=ciudad, estado=estado, retrasado=retrasado)
+        filtro = " ".join(f for f in (
+            "retrasados" if retrasado else "",
+            f"en estado '{self.orders['estado'][self.orders.rows_where('estado', estado)[0]]}'" if estado else "",
+            f"con destino a {self.orders['ciudad'][self.orders.rows_where('ciudad', ciudad)[0]]}" if ciudad else "",
+        ) if f)
+        if not orders:
+            return f"No hay pedidos {filtro}."
+        ids = ", ".join(o["pedido_id"] for o in orders[:MAX_LISTED])
+        resto = f" y {len(orders) - MAX_LISTED} más" if len(orders) > MAX_LISTED else ""
+        return f"Pedidos {filtro}: {len(orders)} ({ids}{resto})."
+
+    @staticmethod
+    def _format_product(p: Dict[str, Any], stock: bool = True, price: bool = True) -> str:
+        parts = []
+        if stock:
+            parts.append(f"{p['stock']} unidades disponibles" if p["stock"] > 0 else "agotado")
+        if price:
+            parts.append(_money(p["precio"] if p["precio"] is not None else np.nan))
+        return f"**{p['nombre']}**: {', '.join(parts)}"
+
+    @staticmethod
+    def _format_order(o: Dict[str, Any]) -> str:
+        text = f"📦 El pedido **{o['pedido_id']}** de {o['cliente']} está **{o['estado']}**"
+        if o.get("ciudad"):
+            text += f", con destino a {o['ciudad']}"
+        text += "."
+        if o.get("tracking"):
+            text += f" Guía de seguimiento: **{o['tracking']}**."
+        if o.get("fecha_estimada_entrega"):
+            verbo = "Fue entregado" if normalize_text(o["estado"]) == "entregado" else "Entrega estimada"
+            text += f" {verbo}: {o['fecha_estimada_entrega']}"
+            text += " ⚠️ (presenta retraso)." if o.get("retrasado") else "."
+        return text
+
+
+# --- INSTANCIA DEL PROCESO ---
+_CATALOG_LOCK = threading.Lock()
+_CATALOG_ENGINE: Optional[CatalogQueryEngine] = None
+
+
+def build_catalog_engine(inventory_path: str = INVENTORY_PATH,
+                         orders_path: Optional[str] = ORDERS_PATH) -> CatalogQueryEngine:
+    inventory = load_inventory_table(inventory_path)
+    orders = None
+    if orders_path:
+        try:
+            orders = load_orders_table(orders_path)
+        except OSError as e:
+            error(f"No se pudieron cargar los envíos desde {orders_path}: {e}")
+    debug(f"Tablas de consulta construidas: {len(inventory)} productos, "
+          f"{len(orders) if orders is not None else 0} pedidos.")
+    return CatalogQueryEngine(inventory, orders)
+
+
+def get_catalog_engine() -> Optional[CatalogQueryEngine]:
+    """Motor de consultas del proceso (se construye una vez). None si el inventario no está disponible."""
+    global _CATALOG_ENGINE
+    with _CATALOG_LOCK:
+        if _CATALOG_ENGINE is None:
+            try:
+                _CATALOG_ENGINE = build_catalog_engine()
+            except Exception as e:
+                error(f"No se pudo construir el motor de consultas de catálogo: {e}")
+                return None
+        return _CATALOG_ENGINE
+
+
+def set_catalog_engine(engine: Optional[CatalogQueryEngine]) -> None:
+    """Reemplaza el motor del proceso (None fuerza reconstruirlo desde los CSV en el próximo uso)."""
+    global _CATALOG_ENGINE
+    with _CATALOG_LOCK:
+        _CATALOG_ENGINE = engine
@@ -0,0 +1,187 @@
+# ============================================================
+# ⚡ faq_index.py — Respuestas directas de FAQ sin LLM
+# ============================================================
+# Índice invertido en memoria sobre las keywords y las palabras de cada pregunta de
+# faq_ecomarket.json. Una coincidencia de alta confianza se responde directamente con
+# la 'respuesta' guardada, antes de que corran el agente o el LLM del RAG.
+
+import os
+import json
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set
+
+from telemetria import debug, error
+from utilidades_texto import normalize_text, tokenize
+
+
+DEFAULT_FAQ_PATH = os.path.join("documentos_rag", "faq_ecomarket.json")
+DEFAULT_MIN_SCORE = 0.75 # Confianza mínima para responder sin LLM
+DEFAULT_MIN_MARGIN = 0.15 # Ventaja mínima sobre la segunda FAQ (evita respuestas ambiguas)
+
+def read_faq_items(file_path: str) -> List[Dict[str, Any]]:
+    """Lee las FAQ como lista de dicts; acepta un array JSON completo, JSON Lines o un array por línea."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        f_content = f.read().strip()
+    if not f_content:
+        return []
+
+    # 1. Carga completa del archivo (formato de faq_ecomarket.json: un array de objetos).
+    try:
+        data_full = json.loads(f_content)
+        if isinstance(data_full, list):
+            return [item for item in data_full if isinstance(item, dict)]
+        if isinstance(data_full, dict):
+            return [data_full]
+    except json.JSONDecodeError:
+        pass
+
+    # 2. Si falla (p. ej. error "Extra data"), leemos línea por línea (JSON Lines).
+    all_faq_items: List[Dict[str, Any]] = []
+    for line in f_content.splitlines():
+        # Toleramos la coma final de los objetos escritos uno por línea dentro de un array
+        stripped_line = line.strip().rstrip(',')
+        if not stripped_line:
+            continue
+        try:
+            item = json.loads(stripped_line)
+            # Si el archivo tiene un array de objetos FAQ por línea, extendemos la lista
+            if isinstance(item, list):
+                all_faq_items.extend(i for i in item if isinstance(i, dict))
+            # Si es un objeto individual FAQ (JSON Lines), lo añadimos
+            elif isinstance(item, dict):
+                all_faq_items.append(item)
+        except json.JSONDecodeError:
+            # Si falla, la línea no es JSON válido, la ignoramos.
+            pass
+    return all_faq_items
+
+
+@dataclass
+class FaqEntry:
+    id: str
+    category: str
+    pregunta: str
+    respuesta: str
+    keywords: List[str]
+    question_terms: Set[str] = field(default_factory=set)
+    keyword_terms: Set[str] = field(default_factory=set)
+    keyword_phrases: List[str] = field(default_factory=list)
+
+
+@dataclass
+class FaqMatch:
+    entry: FaqEntry
+    score: float
+    margin: float
+
+
+class FaqIndex:
+    """
+    Índice invertido término -> FAQs. El puntaje de una FAQ combina:
+    - cobertura de la consulta (qué parte de los términos de la consulta aparece en la FAQ), y
+    - cobertura de la pregunta (qué parte de los términos de la pregunta aparece en la consulta),
+    como media armónica, con un bono por keywords de varias palabras encontradas textualmente.
+    """
+
+    def __init__(self, items: List[Dict[str, Any]], min_score: float = DEFAULT_MIN_SCORE,
+                 min_margin: float = DEFAULT_MIN_MARGIN):
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self.entries: List[FaqEntry] = []
+        self._postings: Dict[str, Set[int]] = {}
+
+        for item in items:
+            pregunta = item.get("pregunta", "")
+            respuesta = item.get("respuesta", "")
+            if not pregunta or not respuesta:
+                continue
+            keywords = [k for k in item.get("keywords", []) if isinstance(k, str)]
+            entry = FaqEntry(
+                id=str(item.get("id", len(self.entries))),
+                category=item.get("category", ""),
+                pregunta=pregunta,
+                respuesta=respuesta,
+                keywords=keywords,
+                question_terms=set(tokenize(pregunta)),
+                keyword_terms={t for k in keywords for t in tokenize(k)},
+                keyword_phrases=[normalize_text(k) for k in keywords if " " in k.strip()],
+            )
+            idx = len(self.entries)
+            self.entries.append(entry)
+            for term in entry.question_terms | entry.keyword_terms:
+                self._postings.setdefault(term, set()).add(idx)
+
+    @classmethod
+    def from_file(cls, file_path: str = DEFAULT_FAQ_PATH, **kwargs) -> "FaqIndex":
+        return cls(read_faq_items(file_path), **kwargs)
+
+    def _score(self, entry: FaqEntry, terms: Set[str], normalized_query: str) -> float:
+        faq_terms = entry.question_terms | entry.keyword_terms
+        query_coverage = len(terms & faq_terms) / len(terms)
+        question_coverage = (len(terms & entry.question_terms) / len(entry.question_terms)
+                             if entry.question_terms else 0.0)
+        if query_coverage == 0 or question_coverage == 0:
+            return 0.0
+        score = 2 * query_coverage * question_coverage / (query_coverage + question_coverage)
+        if any(phrase in normalized_query for phrase in entry.keyword_phrases):
+            score = min(1.0, score + 0.1)
+        return score
+
+    def search(self, query: str, limit: int = 3) -> List[FaqMatch]:
+        """Retorna las mejores FAQs candidatas (solo las que comparten algún término con la consulta)."""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        candidates: Set[int] = set()
+        for term in terms:
+            candidates |= self._postings.get(term, set())
+        normalized_query = normalize_text(query)
+        scored = sorted(((self._score(self.entries[i], terms, normalized_query), i) for i in candidates),
+                        reverse=True)[:limit]
+        matches = []
+        for pos, (score, i) in enumerate(scored):
+            next_score = scored[pos + 1][0] if pos + 1 < len(scored) else 0.0
+            matches.append(FaqMatch(self.entries[i], score, score - next_score))
+        return matches
+
+    def best_match(self, query: str) -> Optional[FaqMatch]:
+        """Retorna la FAQ solo si la coincidencia es de alta confianza y sin ambigüedad; si no, None."""
+        matches = self.search(query, limit=2)
+        if not matches:
+            return None
+        best = matches[0]
+        if best.score >= self.min_score and best.margin >= self.min_margin:
+            return best
+        return None
+
+    def answer(self, query: str) -> Optional[str]:
+        match = self.best_match(query)
+        return match.entry.respuesta if match else None
+
+
+# --- ÍNDICE COMPARTIDO POR EL PROCESO ---
+_FAQ_LOCK = threading.Lock()
+_FAQ_INDEX: Optional[FaqIndex] = None
+
+
+def get_faq_index(file_path: str = DEFAULT_FAQ_PATH) -> Optional[FaqIndex]:
+    """Carga (una vez) el índice de FAQ del proceso. Retorna None si el archivo no está disponible."""
+    global _FAQ_INDEX
+    with _FAQ_LOCK:
+        if _FAQ_INDEX is None:
+            try:
+                _FAQ_INDEX = FaqIndex.from_file(file_path)
+                debug(f"Índice de FAQ construido con {len(_FAQ_INDEX.entries)} preguntas.")
+            except Exception as e:
+                error(f"No se pudo construir el índice de FAQ desde {file_path}: {e}")
+                return None
+        return _FAQ_INDEX
+
+
+def reload_faq_index(file_path: str = DEFAULT_FAQ_PATH) -> Optional[FaqIndex]:
+    """Descarta el índice actual y lo reconstruye (por ejemplo, tras descargar una FAQ nueva)."""
+    global _FAQ_INDEX
+    with _FAQ_LOCK:
+        _FAQ_INDEX = None
+    return get_faq_index(file_path)
@@ -1,9 +1,16 @@
 # herramientas_ecomarket.py (MODIFICADO para usar strings)
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterable, Iterator, List, Optional, TextIO, Tuple
+import csv
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
 import json
 import re
+import threading
+
+import numpy as np
+
+from catalogo_productos import ProductResolver, build_product_resolver
+from repositorio_pedidos import Order, OrderRepository, build_order_repository
 
 # --- BASES DE DATOS DE ECOMARKET (FIJAS) ---
 # ... (PRODUCTOS_DB y PEDIDOS_DB se mantienen iguales)
@@ -41,107 +48,275 @@ PEDIDOS_DB = {
 }
 # ---------------------------------------------
 
-def verificar_elegibilidad_devolucion(id_referencia: str) -> Dict[str, Any]:
-    """
-    Verifica (simulado) la elegibilidad de un pedido completo. Recibe el ID del pedido 
-    O el nro_id del cliente como string.
-    """
-    # ... (El cuerpo de esta función se mantiene igual)
-    id_referencia = str(id_referencia).strip()
-    
-    if not id_referencia:
-        return {"success": False, "elegible": False, "razon": "Falta el ID del pedido (P-XXXX) o el número de identificación del cliente (8 dígitos).", "productos_retornables": [], "id_devolucion": None}
+# --- REPOSITORIO DE PEDIDOS (índices por cliente y estado) ---
+_ORDER_REPO_LOCK = threading.Lock()
+_ORDER_REPO: Optional[OrderRepository] = None
 
-    # 1. Búsqueda y Filtrado de Pedidos Entregados
-    pedidos_entregados_candidatos = {}
-    
+
+def get_order_repository() -> OrderRepository:
+    """Repositorio de pedidos del proceso, construido una vez a partir de PEDIDOS_DB (y del CSV si se configura)."""
+    global _ORDER_REPO
+    with _ORDER_REPO_LOCK:
+        if _ORDER_REPO is None:
+            _ORDER_REPO = build_order_repository(seed=PEDIDOS_DB)
+        return _ORDER_REPO
+
+
+def set_order_repository(repo: Optional[OrderRepository]) -> None:
+    """Reemplaza el repositorio del proceso (None fuerza reconstruirlo en el próximo uso)."""
+    global _ORDER_REPO
+    with _ORDER_REPO_LOCK:
+        _ORDER_REPO = repo
+
+
+# --- RESOLVER DE PRODUCTOS (nombres normalizados + trigramas) ---
+_PRODUCT_RESOLVER: Optional[ProductResolver] = None
+
+
+def get_product_resolver() -> ProductResolver:
+    """Resolver del proceso: inventario CSV + PRODUCTOS_DB (cuya política de devolución prevalece)."""
+    global _PRODUCT_RESOLVER
+    with _ORDER_REPO_LOCK:
+        if _PRODUCT_RESOLVER is None:
+            _PRODUCT_RESOLVER = build_product_resolver(seed=PRODUCTOS_DB)
+        return _PRODUCT_RESOLVER
+
+
+_NRO_ID_PATTERN = re.compile(r'^\d{8}$')
+_REF_VACIA = "vacia"
+_REF_INVALIDA = "invalida"
+_REF_PEDIDO = "pedido"
+_REF_CLIENTE = "cliente"
+
+
+def _tipo_referencia(id_referencia: str) -> str:
+    if not id_referencia:
+        return _REF_VACIA
     if id_referencia.upper().startswith('P-'):
-        # Búsqueda por ID de Pedido (solo un pedido)
-        pedido_info = PEDIDOS_DB.get(id_referencia.upper())
-        if pedido_info:
-            pedidos_entregados_candidatos[id_referencia.upper()] = pedido_info
-    elif re.match(r'^\d{8}$', id_referencia):
-        # Búsqueda por nro_id y filtrado inicial (solo 'Entregado')
-        for id_pedido, info in PEDIDOS_DB.items():
-            if info.get('nro_id') == id_referencia and "entregado" in info.get('status', '').lower():
-                pedidos_entregados_candidatos[id_pedido] = info
-    else:
-        return {"success": False, "elegible": False, "razon": "Formato de referencia inválido. Debe ser ID de pedido (P-XXXX) o nro_id (8 dígitos).", "productos_retornables": [], "id_devolucion": None}
+        return _REF_PEDIDO
+    if _NRO_ID_PATTERN.match(id_referencia):
+        return _REF_CLIENTE
+    return _REF_INVALIDA
 
-    if not pedidos_entregados_candidatos:
-        return {"success": True, "elegible": False, "razon": f"No se encontró un pedido 'Entregado' asociado a la referencia '{id_referencia}'.", "productos_retornables": [], "id_devolucion": None}
 
-    # 2. Selección del Último Pedido Entregado
-    pedido_seleccionado = None
-    id_pedido_seleccionado = None
-    fecha_mas_reciente = datetime.min
-    
-    for id_pedido, info in pedidos_entregados_candidatos.items():
-        try:
-            fecha_entrega = datetime.strptime(info["date"], '%Y-%m-%d')
-            
-            fecha_limite = fecha_entrega + timedelta(days=30)
-            hoy = datetime.now()
-
-            if hoy <= fecha_limite:
-                if fecha_entrega > fecha_mas_reciente:
-                    fecha_mas_reciente = fecha_entrega
-                    pedido_seleccionado = info
-                    id_pedido_seleccionado = id_pedido
-            
-        except ValueError:
-            continue 
-
-    if not pedido_seleccionado:
-        return {"success": True, "elegible": False, "razon": "Se encontraron pedidos entregados, pero todos han excedido el plazo de 30 días para devolución.", "productos_retornables": [], "id_devolucion": None}
+def _min_ordinal_en_plazo(hoy: datetime) -> int:
+    """
+    Menor fecha de entrega (ordinal) todavía dentro del plazo: hoy <= entrega 00:00 + 30 días.
+    Comparar ordinales enteros permite evaluar el plazo de muchos pedidos de una vez.
+    """
+    return hoy.toordinal() - 30 + (0 if hoy.time() == time.min else 1)
+
 
+def _resultado_sin_pedido(id_referencia: str, tipo: str) -> Dict[str, Any]:
+    if tipo == _REF_VACIA:
+        return {"success": False, "elegible": False, "razon": "Falta el ID del pedido (P-XXXX) o el número de identificación del cliente (8 dígitos).", "productos_retornables": [], "id_devolucion": None}
+    if tipo == _REF_INVALIDA:
+        return {"success": False, "elegible": False, "razon": "Formato de referencia inválido. Debe ser ID de pedido (P-XXXX) o nro_id (8 dígitos).", "productos_retornables": [], "id_devolucion": None}
+    return {"success": True, "elegible": False, "razon": f"No se encontró un pedido 'Entregado' asociado a la referencia '{id_referencia}'.", "productos_retornables": [], "id_devolucion": None}
 
-    # 3. Validación de Plazo
-    fecha_entrega_str = pedido_seleccionado["date"]
-    try:
-        fecha_entrega = datetime.strptime(fecha_entrega_str, '%Y-%m-%d')
-        fecha_limite = fecha_entrega + timedelta(days=30)
-        hoy = datetime.now()
-        
-        if hoy > fecha_limite:
-            return {"success": True, "elegible": False, "razon": f"El pedido {id_pedido_seleccionado} fue el último entregado, pero el plazo de 30 días ha expirado (límite: {fecha_limite.strftime('%Y-%m-%d')}).", "productos_retornables": [], "id_devolucion": None}
-    except:
-        return {"success": True, "elegible": False, "razon": "Error al procesar la fecha de entrega del pedido seleccionado.", "productos_retornables": [], "id_devolucion": None}
 
+def _resultado_pedido(pedido: Order, en_plazo: bool, resolver: ProductResolver) -> Dict[str, Any]:
+    """Resultado para un pedido encontrado; si es elegible, el llamador asigna id_devolucion."""
+    if not en_plazo:
+        return {"success": True, "elegible": False, "razon": "Se encontraron pedidos entregados, pero todos han excedido el plazo de 30 días para devolución.", "productos_retornables": [], "id_devolucion": None}
 
-    # 4. Determinar Productos Retornables
+    # Búsqueda exacta O(1) sin tildes ni mayúsculas; si falla, índice de trigramas
     productos_retornables = []
-    
-    for producto_nombre_raw in pedido_seleccionado["productos"]:
-        nombre_producto_norm = producto_nombre_raw.lower().strip()
-        
-        producto_info = PRODUCTOS_DB.get(nombre_producto_norm)
-        if not producto_info:
-            producto_info = next((info for name, info in PRODUCTOS_DB.items() 
-                                 if nombre_producto_norm in name or name in nombre_producto_norm), None)
-        
-        if producto_info and producto_info["retornable"]:
+    for producto_nombre_raw in pedido.productos:
+        producto = resolver.resolve(producto_nombre_raw)
+        if producto and producto.retornable:
             productos_retornables.append(producto_nombre_raw)
-    
-    # 5. Elegible Final
+
     if not productos_retornables:
-        return {"success": True, "elegible": False, "razon": f"El pedido {id_pedido_seleccionado} es válido, pero ninguno de los productos contenidos es retornable según nuestra política.", "productos_retornables": [], "id_devolucion": None}
-    
-    id_dev = f"DEV-{uuid.uuid4()}"[:20]
-    razon_final = f"El pedido {id_pedido_seleccionado} de {pedido_seleccionado['nombre_cliente']} es elegible. Los siguientes productos son aptos para devolución: {', '.join(productos_retornables)}."
-    
+        return {"success": True, "elegible": False, "razon": f"El pedido {pedido.id_pedido} es válido, pero ninguno de los productos contenidos es retornable según nuestra política.", "productos_retornables": [], "id_devolucion": None}
+
+    razon_final = f"El pedido {pedido.id_pedido} de {pedido.nombre_cliente} es elegible. Los siguientes productos son aptos para devolución: {', '.join(productos_retornables)}."
     return {
-        "success": True, 
-        "elegible": True, 
-        "razon": razon_final, 
+        "success": True,
+        "elegible": True,
+        "razon": razon_final,
         "productos_retornables": productos_retornables,
-        "id_pedido": id_pedido_seleccionado,
-        "nro_id": pedido_seleccionado["nro_id"],
-        "nombre_cliente": pedido_seleccionado["nombre_cliente"],
-        "id_devolucion": id_dev
+        "id_pedido": pedido.id_pedido,
+        "nro_id": pedido.nro_id,
+        "nombre_cliente": pedido.nombre_cliente,
+        "id_devolucion": None
     }
 
 
+def _nuevo_id_devolucion() -> str:
+    return f"DEV-{uuid.uuid4()}"[:20]
+
+
+def verificar_elegibilidad_devolucion(id_referencia: str) -> Dict[str, Any]:
+    """
+    Verifica (simulado) la elegibilidad de un pedido completo. Recibe el ID del pedido 
+    O el nro_id del cliente como string.
+    """
+    id_referencia = str(id_referencia).strip()
+    tipo = _tipo_referencia(id_referencia)
+    if tipo in (_REF_VACIA, _REF_INVALIDA):
+        return _resultado_sin_pedido(id_referencia, tipo)
+
+    # 1. Búsqueda indexada: el pedido indicado o el último 'Entregado' del cliente (índice por nro_id)
+    repo = get_order_repository()
+    pedido = repo.get(id_referencia) if tipo == _REF_PEDIDO else repo.latest_delivered(id_referencia)
+    if not pedido:
+        return _resultado_sin_pedido(id_referencia, tipo)
+
+    # 2. Plazo (fecha ya parseada en el repositorio) y productos retornables.
+    # Si el último entregado excedió los 30 días, los anteriores también.
+    en_plazo = pedido.delivery_date is not None and pedido.delivery_date.toordinal() >= _min_ordinal_en_plazo(datetime.now())
+    resultado = _resultado_pedido(pedido, en_plazo, get_product_resolver())
+    if resultado["elegible"]:
+        resultado["id_devolucion"] = _nuevo_id_devolucion()
+    return resultado
+
+
+# --- VERIFICACIÓN MASIVA (back-office) ---
+BATCH_CHUNK_SIZE = 50_000 # Referencias procesadas por bloque (acota la memoria con entradas enormes)
+BATCH_RESULT_CACHE_MAX = 1_000_000 # Resultados por pedido que se reutilizan entre bloques
+
+
+def leer_referencias_csv(path: str, columna: str = "referencia") -> Iterator[str]:
+    """
+    Referencias desde un CSV: la columna 'columna' si el encabezado la tiene; si no, la primera
+    columna de cada fila (el archivo puede no tener encabezado).
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        first = next(reader, None)
+        if first is None:
+            return
+        header = [c.strip().lower() for c in first]
+        col = header.index(columna) if columna in header else 0
+        if columna not in header:
+            yield first[0]
+        for row in reader:
+            if len(row) > col:
+                yield row[col]
+
+
+def _chunks(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    chunk: List[str] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _evaluar_bloque(refs: Iterable[str], min_ordinal: int, repo: OrderRepository, resolver: ProductResolver,
+                    por_pedido: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Resultado por referencia distinta. Las referencias al mismo pedido comparten el mismo dict de
+    resultado (no debe modificarse sin copiarlo). 'por_pedido' guarda los resultados ya calculados
+    en bloques anteriores (con la misma hora de referencia no cambian).
+    """
+    tipos = {ref: _tipo_referencia(ref) for ref in refs}
+
+    # 1. Búsquedas agrupadas por pedido y por cliente
+    pedidos = repo.get_many([r.upper() for r, t in tipos.items() if t == _REF_PEDIDO])
+    ultimos = repo.latest_delivered_many([r for r, t in tipos.items() if t == _REF_CLIENTE])
+    encontrados = {ref: (pedidos.get(ref.upper()) if t == _REF_PEDIDO else ultimos.get(ref))
+                   for ref, t in tipos.items() if t in (_REF_PEDIDO, _REF_CLIENTE)}
+
+    # 2. Plazo vectorizado sobre los pedidos distintos aún no evaluados
+    unicos = {o.id_pedido: o for o in encontrados.values() if o is not None and o.id_pedido not in por_pedido}
+    ordinales = np.fromiter((o.delivery_date.toordinal() if o.delivery_date else -1 for o in unicos.values()),
+                            dtype=np.int64, count=len(unicos))
+    en_plazo = dict(zip(unicos, (ordinales >= min_ordinal).tolist()))
+
+    # 3. Un resultado por pedido distinto
+    for id_pedido, o in unicos.items():
+        por_pedido[id_pedido] = _resultado_pedido(o, en_plazo[id_pedido], resolver)
+    resultados = {}
+    for ref, tipo in tipos.items():
+        pedido = encontrados.get(ref)
+        resultados[ref] = por_pedido[pedido.id_pedido] if pedido is not None else _resultado_sin_pedido(ref, tipo)
+    return resultados
+
+
+def _bloques_evaluados(referencias: Iterable[str], hoy: Optional[datetime],
+                       chunk_size: int) -> Iterator[Tuple[List[str], Dict[str, Dict[str, Any]]]]:
+    """
+    Genera (referencias del bloque, resultados por referencia). Los resultados de referencias y
+    pedidos ya vistos se reutilizan entre bloques (hasta BATCH_RESULT_CACHE_MAX).
+    """
+    min_ordinal = _min_ordinal_en_plazo(hoy or datetime.now())
+    repo = get_order_repository()
+    resolver = get_product_resolver()
+    por_pedido: Dict[str, Dict[str, Any]] = {}
+    por_referencia: Dict[str, Dict[str, Any]] = {}
+    for chunk in _chunks(referencias, chunk_size):
+        if len(por_referencia) + len(por_pedido) >= BATCH_RESULT_CACHE_MAX:
+            por_pedido, por_referencia = {}, {}
+        refs = [str(r).strip() for r in chunk]
+        nuevas = {r for r in refs if r not in por_referencia}
+        if nuevas:
+            por_referencia.update(_evaluar_bloque(nuevas, min_ordinal, repo, resolver, por_pedido))
+        yield refs, por_referencia
+
+
+def verificar_elegibilidad_lote(referencias: Iterable[str], hoy: Optional[datetime] = None,
+                                con_id_devolucion: bool = False,
+                                chunk_size: int = BATCH_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Verifica muchas referencias (P-XXXX o nro_id) con la misma regla que verificar_elegibilidad_devolucion.
+    - Todas se evalúan contra una única hora de referencia 'hoy'.
+    - Las búsquedas se agrupan: una consulta por pedido/cliente distinto de cada bloque.
+    - El plazo de 30 días se evalúa para todo el bloque con aritmética vectorizada de ordinales.
+    Genera un dict por referencia, en el mismo orden, con la clave extra "referencia".
+    Por defecto no se generan id_devolucion (una consulta masiva no abre devoluciones).
+    """
+    for refs, resultados in _bloques_evaluados(referencias, hoy, chunk_size):
+        for ref in refs:
+            resultado = dict(resultados[ref], referencia=ref)
+            if con_id_devolucion and resultado["elegible"]:
+                resultado["id_devolucion"] = _nuevo_id_devolucion()
+            yield resultado
+
+
+def _linea_jsonl(ref: str, cuerpo: str) -> str:
+    # Las referencias válidas (P-XXXX o 8 dígitos) no necesitan escape JSON
+    ref_json = f'"{ref}"' if ref.isascii() and ref.replace("-", "").isalnum() else json.dumps(ref, ensure_ascii=False)
+    return '{"referencia": ' + ref_json + ", " + cuerpo + "\n"
+
+
+def verificar_elegibilidad_lote_jsonl(referencias: Iterable[str], salida: TextIO, hoy: Optional[datetime] = None,
+                                      con_id_devolucion: bool = False, chunk_size: int = BATCH_CHUNK_SIZE) -> int:
+    """
+    Igual que verificar_elegibilidad_lote, escribiendo cada resultado como una línea JSON en 'salida'
+    (un write por bloque de referencias). Retorna la cantidad de líneas escritas.
+    """
+    n = 0
+    # Cada resultado distinto se serializa una vez (se conserva el dict para que su id() no se reutilice)
+    cuerpos: Dict[int, Tuple[Dict[str, Any], str]] = {}
+    lineas: Dict[str, str] = {}
+    for refs, resultados in _bloques_evaluados(referencias, hoy, chunk_size):
+        if len(lineas) + len(cuerpos) >= BATCH_RESULT_CACHE_MAX:
+            cuerpos, lineas = {}, {}
+        salida_bloque = []
+        for ref in refs:
+            linea = lineas.get(ref)
+            if linea is None:
+                resultado = resultados[ref]
+                if con_id_devolucion and resultado["elegible"]:
+                    # Cada referencia elegible recibe su propio id_devolucion: no se reutiliza la línea
+                    cuerpo = json.dumps(dict(resultado, id_devolucion=_nuevo_id_devolucion()), ensure_ascii=False)[1:]
+                    salida_bloque.append(_linea_jsonl(ref, cuerpo))
+                    continue
+                cached = cuerpos.get(id(resultado))
+                if cached is None:
+                    cached = cuerpos[id(resultado)] = (resultado, json.dumps(resultado, ensure_ascii=False)[1:])
+                linea = lineas[ref] = _linea_jsonl(ref, cached[1])
+            salida_bloque.append(linea)
+        salida.write("".join(salida_bloque))
+        n += len(refs)
+    return n
+
+
 def generar_etiqueta_devolucion(id_devolucion: str, direccion_origen: str) -> Dict[str, Any]:
     """
     Genera una etiqueta de devolución. Recibe el id_devolucion y la direccion_origen como strings.
@@ -0,0 +1,559 @@
+# ============================================================
+# 🚦 llm_gateway.py — Puerta de acceso única al LLM para todo el proceso
+# ============================================================
+# Todas las sesiones (agente y herramienta RAG) usan el mismo LLMGateway:
+#   - un pool de conexiones HTTP compartido (httpx) en lugar de un cliente por sesión;
+#   - token bucket de solicitudes y de tokens por minuto (ECOMARKET_LLM_RPM / ECOMARKET_LLM_TPM);
+#   - límite de completions simultáneas con cola acotada y deadline por llamada: una llamada
+#     que no alcanza a empezar a tiempo falla rápido en lugar de acumular espera;
+#   - reintentos de 429/5xx y errores de conexión con backoff exponencial con jitter
+#     (respetando Retry-After).
+# ECOMARKET_LLM_BASE_URL apunta el cliente a cualquier servidor compatible con OpenAI, por
+# ejemplo servidor_openai_simulado.py para probar límites y fallos sin gastar cuota.
+
+import os
+import time
+import asyncio
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, AsyncIterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import get_buffer_string
+
+from rag_context import count_tokens
+from rag_fetch import RETRYABLE_STATUS, backoff_delay
+from telemetria import REGISTRY, debug, error, span
+
+
+LLM_MODEL = os.getenv("ECOMARKET_LLM_MODEL", "gpt-4o-mini")
+LLM_BASE_URL = os.getenv("ECOMARKET_LLM_BASE_URL") or None # None = API de OpenAI
+LLM_RPM = float(os.getenv("ECOMARKET_LLM_RPM", "500")) # Solicitudes por minuto (0 = sin límite)
+LLM_TPM = float(os.getenv("ECOMARKET_LLM_TPM", "200000")) # Tokens por minuto (0 = sin límite)
+LLM_MAX_CONCURRENCY = int(os.getenv("ECOMARKET_LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_QUEUE = int(os.getenv("ECOMARKET_LLM_MAX_QUEUE", "256")) # Llamadas esperando un lugar
+LLM_DEADLINE = float(os.getenv("ECOMARKET_LLM_DEADLINE", "60")) # Segundos por llamada, incluida la espera
+LLM_MAX_RETRIES = int(os.getenv("ECOMARKET_LLM_MAX_RETRIES", "4"))
+LLM_REQUEST_TIMEOUT = float(os.getenv("ECOMARKET_LLM_TIMEOUT", "30")) # Segundos por intento HTTP
+LLM_POOL_SIZE = int(os.getenv("ECOMARKET_LLM_POOL", "32")) # Conexiones HTTP keep-alive compartidas
+LLM_COMPLETION_TOKENS = int(os.getenv("ECOMARKET_LLM_COMPLETION_TOKENS", "400")) # Estimación para el TPM
+
+_RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError", "ConnectError", "ReadTimeout", "ConnectionError"}
+
+LLM_CALLS = REGISTRY.counter("ecomarket_llm_calls_total",
+                             "Llamadas al LLM por resultado (ok, error, rejected, deadline).", ("outcome",))
+LLM_RETRIES = REGISTRY.counter("ecomarket_llm_retries_total", "Reintentos al LLM por código de estado.", ("status",))
+LLM_WAIT_SECONDS = REGISTRY.histogram("ecomarket_llm_wait_seconds",
+                                      "Espera antes de enviar una llamada al LLM (límite de tasa + cola).")
+
+
+class LLMGatewayError(Exception):
+    """La llamada no se envió al LLM por los límites del gateway."""
+
+
+class LLMGatewayBusy(LLMGatewayError):
+    """La cola de espera está llena: se rechaza de inmediato."""
+
+
+class LLMDeadlineExceeded(LLMGatewayError):
+    """La llamada no pudo empezar (o reintentarse) antes de su deadline."""
+
+
+# --- TOKEN BUCKET ---
+class TokenBucket:
+    """Capacidad de un minuto de 'rate_per_minute' unidades que se recarga de forma continua."""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Segundos hasta poder tomar 'amount' (0 si ya se puede). Una solicitud mayor a la capacidad espera a llenarla."""
+        self._refill(now)
+        needed = min(amount, self.capacity) - self.tokens
+        return needed / self.rate if needed > 0 else 0.0
+
+    def take(self, amount: float) -> None:
+        # Puede quedar negativo (al corregir con el uso real): las siguientes llamadas esperan más
+        self.tokens -= amount
+
+
+class RateLimiter:
+    """Solicitudes y tokens por minuto. rpm o tpm en 0 desactivan ese límite."""
+
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM):
+        self._lock = threading.Lock()
+        self.requests = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+
+    def _try_take(self, tokens: int) -> float:
+        """Toma una solicitud y 'tokens' si hay capacidad en ambos buckets; si no, retorna la espera."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.requests.wait_time(1, now) if self.requests else 0.0,
+                       self.tokens.wait_time(tokens, now) if self.tokens else 0.0)
+            if wait == 0.0:
+                if self.requests:
+                    self.requests.take(1)
+                if self.tokens:
+                    self.tokens.take(tokens)
+            return wait
+
+    def acquire(self, tokens: int, deadline: float) -> None:
+        while True:
+            wait = self._try_take(tokens)
+            if wait == 0.0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise LLMDeadlineExceeded(f"Límite de tasa del LLM: se necesitan {wait:.1f} s más de lo permitido.")
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int, deadline: float) -> None:
+        while True:
+            wait = self._try_take(tokens)
+            if wait == 0.0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise LLMDeadlineExceeded(f"Límite de tasa del LLM: se necesitan {wait:.1f} s más de lo permitido.")
+            await asyncio.sleep(wait)
+
+    def adjust(self, estimated: int, actual: int) -> None:
+        """Corrige el bucket de tokens con el uso real informado por el proveedor."""
+        if self.tokens is not None and actual != estimated:
+            with self._lock:
+                self.tokens.take(actual - estimated)
+
+
+# --- LÍMITE DE CONCURRENCIA ---
+class _Waiter:
+    __slots__ = ("granted", "event", "loop", "future")
+
+    def __init__(self, event=None, loop=None, future=None):
+        self.granted = False
+        self.event = event
+        self.loop = loop
+        self.future = future
+
+
+class ConcurrencyLimiter:
+    """
+    Semáforo FIFO compartido por hilos y corrutinas: como máximo 'limit' llamadas activas y
+    'max_queue' esperando. Al liberar, el lugar pasa directamente al primero de la cola.
+    """
+
+    def __init__(self, limit: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE):
+        self.limit = max(1, limit)
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters: Deque[_Waiter] = deque()
+
+    def _enqueue_locked(self, waiter: _Waiter) -> bool:
+        """True si se obtuvo el lugar de inmediato; si no, encola o rechaza (cola llena)."""
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            raise LLMGatewayBusy(f"Cola del LLM llena ({self.max_queue} llamadas esperando).")
+        self._waiters.append(waiter)
+        return False
+
+    def _leave_queue(self, waiter: _Waiter) -> bool:
+        """Saca al waiter de la cola. False si el lugar ya le fue otorgado (ahora es suyo)."""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._waiters.remove(waiter)
+            return True
+
+    def acquire(self, deadline: float) -> None:
+        waiter = _Waiter(event=threading.Event())
+        with self._lock:
+            if self._enqueue_locked(waiter):
+                return
+        if not waiter.event.wait(max(0.0, deadline - time.monotonic())) and self._leave_queue(waiter):
+            raise LLMDeadlineExceeded("Se agotó el tiempo esperando un lugar para llamar al LLM.")
+
+    async def aacquire(self, deadline: float) -> None:
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(loop=loop, future=loop.create_future())
+        with self._lock:
+            if self._enqueue_locked(waiter):
+                return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            if self._leave_queue(waiter):
+                raise LLMDeadlineExceeded("Se agotó el tiempo esperando un lugar para llamar al LLM.") from None
+        except asyncio.CancelledError:
+            # Si el lugar se otorgó justo al cancelar, se devuelve para no perderlo
+            if not self._leave_queue(waiter):
+                self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            if not self._waiters:
+                self._active -= 1
+                return
+            waiter = self._waiters.popleft()
+            waiter.granted = True # El lugar pasa al siguiente sin decrementar _active
+        if waiter.event is not None:
+            waiter.event.set()
+        else:
+            waiter.loop.call_soon_threadsafe(_grant, waiter.future)
+
+    def stats(self) -> Dict[str, int]:
+        return {"active": self._active, "queued": len(self._waiters), "limit": self.limit}
+
+
+def _grant(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(True)
+
+
+# --- REINTENTOS ---
+def _status_code(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def _retry_after(exc: BaseException) -> float:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return type(exc).__name__ in _RETRYABLE_ERRORS
+
+
+def _usage_tokens(result: Any) -> Optional[int]:
+    """Tokens totales informados por el proveedor en un ChatResult (None si no vienen)."""
+    usage = (getattr(result, "llm_output", None) or {}).get("token_usage") or {}
+    total = usage.get("total_tokens")
+    return int(total) if total else None
+
+
+class LLMGateway:
+    """
+    Ejecuta llamadas al LLM respetando los límites del proceso. call()/acall() reciben la función
+    que hace la solicitud; chat_model() crea (una vez por configuración) el modelo LangChain
+    que todas las sesiones comparten.
+    """
+
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, max_queue: int = LLM_MAX_QUEUE,
+                 deadline: float = LLM_DEADLINE, max_retries: int = LLM_MAX_RETRIES,
+                 base_url: Optional[str] = LLM_BASE_URL, pool_size: int = LLM_POOL_SIZE,
+                 request_timeout: float = LLM_REQUEST_TIMEOUT):
+        self.limiter = RateLimiter(rpm, tpm)
+        self.slots = ConcurrencyLimiter(max_concurrency, max_queue)
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.base_url = base_url
+        self.pool_size = pool_size
+        self.request_timeout = request_timeout
+        self._lock = threading.Lock()
+        self._http_client = None
+        self._async_http_client = None
+        self._models: Dict[tuple, BaseChatModel] = {}
+
+    # -------- Llamadas --------
+    def _retry_delay(self, exc: BaseException, attempt: int, deadline: float) -> Optional[float]:
+        """Espera antes del próximo intento, o None si no corresponde reintentar."""
+        if attempt >= self.max_retries or not _is_retryable(exc):
+            return None
+        delay = max(_retry_after(exc), backoff_delay(attempt))
+        if time.monotonic() + delay > deadline:
+            return None
+        LLM_RETRIES.inc(status=str(_status_code(exc) or type(exc).__name__))
+        debug(f"LLM respondió {_status_code(exc) or type(exc).__name__}; reintento {attempt + 1} en {delay:.2f} s.")
+        return delay
+
+    def _admit(self, tokens: int, deadline: float) -> None:
+        start = time.monotonic()
+        try:
+            self.limiter.acquire(tokens, deadline)
+            self.slots.acquire(deadline)
+        except LLMGatewayBusy:
+            LLM_CALLS.inc(outcome="rejected")
+            raise
+        except LLMDeadlineExceeded:
+            LLM_CALLS.inc(outcome="deadline")
+            raise
+        LLM_WAIT_SECONDS.observe(time.monotonic() - start)
+
+    async def _aadmit(self, tokens: int, deadline: float) -> None:
+        start = time.monotonic()
+        try:
+            await self.limiter.aacquire(tokens, deadline)
+            await self.slots.aacquire(deadline)
+        except LLMGatewayBusy:
+            LLM_CALLS.inc(outcome="rejected")
+            raise
+        except LLMDeadlineExceeded:
+            LLM_CALLS.inc(outcome="deadline")
+            raise
+        LLM_WAIT_SECONDS.observe(time.monotonic() - start)
+
+    def call(self, fn: Callable[[], Any], tokens: int = 0, deadline: Optional[float] = None,
+             usage: Callable[[Any], Optional[int]] = _usage_tokens,
+             can_retry: Optional[Callable[[], bool]] = None) -> Any:
+        """
+        Ejecuta fn() (una solicitud al LLM) dentro de los límites, con reintentos.
+        can_retry() en False impide reintentar (p. ej. fn ya entregó tokens a los callbacks).
+        """
+        deadline = deadline or time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            self._admit(tokens, deadline)
+            try:
+                with span("llm.request", attempt=attempt):
+                    result = fn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, deadline) if can_retry is None or can_retry() else None
+                if delay is None:
+                    LLM_CALLS.inc(outcome="error")
+                    raise
+            else:
+                LLM_CALLS.inc(outcome="ok")
+                actual = usage(result) if usage is not None else None
+                if actual is not None:
+                    self.limiter.adjust(tokens, actual)
+                return result
+            finally:
+                self.slots.release()
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, afn: Callable[[], Awaitable[Any]], tokens: int = 0, deadline: Optional[float] = None,
+                    usage: Callable[[Any], Optional[int]] = _usage_tokens,
+                    can_retry: Optional[Callable[[], bool]] = None) -> Any:
+        deadline = deadline or time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            await self._aadmit(tokens, deadline)
+            try:
+                with span("llm.request", attempt=attempt):
+                    result = await afn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, deadline) if can_retry is None or can_retry() else None
+                if delay is None:
+                    LLM_CALLS.inc(outcome="error")
+                    raise
+            else:
+                LLM_CALLS.inc(outcome="ok")
+                actual = usage(result) if usage is not None else None
+                if actual is not None:
+                    self.limiter.adjust(tokens, actual)
+                return result
+            finally:
+                self.slots.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stream(self, gen_fn: Callable[[], Iterator[Any]], tokens: int = 0,
+               deadline: Optional[float] = None) -> Iterator[Any]:
+        """
+        Como call() para respuestas en streaming: el lugar se ocupa hasta el último fragmento.
+        Solo se reintenta si el error ocurre antes del primer fragmento (no se repite texto ya entregado).
+        """
+        deadline = deadline or time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            self._admit(tokens, deadline)
+            started = False
+            try:
+                for chunk in gen_fn():
+                    started = True
+                    yield chunk
+            except Exception as e:
+                delay = None if started else self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    LLM_CALLS.inc(outcome="error")
+                    raise
+            else:
+                LLM_CALLS.inc(outcome="ok")
+                return
+            finally:
+                self.slots.release()
+            time.sleep(delay)
+            attempt += 1
+
+    async def astream(self, agen_fn: Callable[[], AsyncIterator[Any]], tokens: int = 0,
+                      deadline: Optional[float] = None) -> AsyncIterator[Any]:
+        deadline = deadline or time.monotonic() + self.deadline
+        attempt = 0
+        while True:
+            await self._aadmit(tokens, deadline)
+            started = False
+            try:
+                async for chunk in agen_fn():
+                    started = True
+                    yield chunk
+            except Exception as e:
+                delay = None if started else self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    LLM_CALLS.inc(outcome="error")
+                    raise
+            else:
+                LLM_CALLS.inc(outcome="ok")
+                return
+            finally:
+                self.slots.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    # -------- Clientes compartidos --------
+    def http_clients(self):
+        """Clientes httpx (sync y async) con un pool de conexiones keep-alive para todo el proceso."""
+        import httpx
+        with self._lock:
+            if self._http_client is None:
+                limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+                self._http_client = httpx.Client(limits=limits, timeout=self.request_timeout)
+                self._async_http_client = httpx.AsyncClient(limits=limits, timeout=self.request_timeout)
+            return self._http_client, self._async_http_client
+
+    def chat_model(self, openai_api_key: Optional[str], model: str = LLM_MODEL, temperature: float = 0.1,
+                   streaming: bool = True) -> BaseChatModel:
+        """ChatOpenAI compartido (uno por configuración) envuelto para pasar por este gateway."""
+        key = (openai_api_key, model, temperature, streaming)
+        with self._lock:
+            cached = self._models.get(key)
+        if cached is not None:
+            return cached
+
+        from langchain_openai import ChatOpenAI
+        http_client, async_http_client = self.http_clients()
+        inner = ChatOpenAI(
+            temperature=temperature,
+            model=model,
+            openai_api_key=openai_api_key,
+            base_url=self.base_url,
+            streaming=streaming, # Emite tokens a los callbacks para mostrarlos en la UI a medida que llegan
+            max_retries=0, # Los reintentos los hace el gateway, con backoff compartido
+            timeout=self.request_timeout,
+            http_client=http_client,
+            http_async_client=async_http_client,
+        )
+        with self._lock:
+            model_obj = self._models.setdefault(key, GatewayChatModel(inner=inner, gateway=self))
+        debug(f"Modelo {model} creado sobre el gateway del LLM (pool de {self.pool_size} conexiones).")
+        return model_obj
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.slots.stats(), models=len(self._models))
+
+    def close(self) -> None:
+        with self._lock:
+            if self._http_client is not None:
+                self._http_client.close()
+                self._http_client = None
+            self._async_http_client = None # Se cierra con el event loop que lo usó
+            self._models.clear()
+
+
+def estimate_tokens(messages: List[Any], completion_tokens: int = LLM_COMPLETION_TOKENS) -> int:
+    """Tokens que se descuentan del TPM antes de enviar (prompt + completion estimada)."""
+    return count_tokens(get_buffer_string(messages)) + completion_tokens
+
+
+class _TokenWatch:
+    """Proxy del run_manager que registra si ya se entregó algún token a los callbacks."""
+
+    def __init__(self, run_manager: Any):
+        self._run_manager = run_manager
+        self.emitted = False
+
+    def on_llm_new_token(self, *args, **kwargs):
+        self.emitted = True
+        return self._run_manager.on_llm_new_token(*args, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._run_manager, name)
+
+
+class GatewayChatModel(BaseChatModel):
+    """
+    Envuelve un chat model (ChatOpenAI) para que cada generación pase por el LLMGateway.
+    Los callbacks (tokens en streaming) se entregan igual que con el modelo original; si un
+    intento ya entregó tokens, un error no se reintenta (la UI mostraría el texto dos veces).
+    """
+
+    inner: Any
+    gateway: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "ecomarket-gateway"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        watch = _TokenWatch(run_manager) if run_manager is not None else None
+        return self.gateway.call(
+            lambda: self.inner._generate(messages, stop=stop, run_manager=watch, **kwargs),
+            tokens=estimate_tokens(messages),
+            can_retry=(lambda: not watch.emitted) if watch is not None else None,
+        )
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        watch = _TokenWatch(run_manager) if run_manager is not None else None
+        return await self.gateway.acall(
+            lambda: self.inner._agenerate(messages, stop=stop, run_manager=watch, **kwargs),
+            tokens=estimate_tokens(messages),
+            can_retry=(lambda: not watch.emitted) if watch is not None else None,
+        )
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        return self.gateway.stream(
+            lambda: self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs),
+            tokens=estimate_tokens(messages),
+        )
+
+    def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        return self.gateway.astream(
+            lambda: self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs),
+            tokens=estimate_tokens(messages),
+        )
+
+
+# --- INSTANCIA DEL PROCESO ---
+_GATEWAY_LOCK = threading.Lock()
+_GATEWAY: Optional[LLMGateway] = None
+
+
+def get_llm_gateway() -> LLMGateway:
+    """Gateway del proceso, configurado con las variables ECOMARKET_LLM_*."""
+    global _GATEWAY
+    with _GATEWAY_LOCK:
+        if _GATEWAY is None:
+            _GATEWAY = LLMGateway()
+            debug(f"Gateway del LLM: {LLM_MAX_CONCURRENCY} llamadas simultáneas, {LLM_RPM:.0f} RPM, "
+                  f"{LLM_TPM:.0f} TPM, cola de {LLM_MAX_QUEUE}.")
+        return _GATEWAY
+
+
+def set_llm_gateway(gateway: Optional[LLMGateway]) -> None:
+    """Reemplaza el gateway del proceso (None lo recrea con la configuración del entorno en el próximo uso)."""
+    global _GATEWAY
+    with _GATEWAY_LOCK:
+        old, _GATEWAY = _GATEWAY, gateway
+    if old is not None and old is not gateway:
+        try:
+            old.close()
+        except Exception as e:
+            error(f"No se pudo cerrar el gateway anterior del LLM: {e}")
@@ -0,0 +1,226 @@
+# ============================================================
+# 🧠 rag_answer_cache.py — Caché semántica de respuestas RAG
+# ============================================================
+# La mayoría de preguntas de clientes son paráfrasis de unas pocas decenas de preguntas
+# de política. Si el embedding de una consulta nueva es suficientemente parecido
+# (similitud coseno >= umbral) al de una consulta ya respondida, se devuelve la
+# respuesta guardada sin llamar al retriever ni al LLM.
+
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from telemetria import debug, error
+
+
+DEFAULT_THRESHOLD = 0.92
+DEFAULT_TTL_SECONDS = 6 * 3600
+DEFAULT_MAX_ENTRIES = 2000
+DEFAULT_PERSIST_INTERVAL = 30.0 # Segundos mínimos entre escrituras a disco
+
+
+class SemanticAnswerCache:
+    """
+    Caché de respuestas indexada por el embedding de la consulta.
+    - TTL: una entrada expira ttl_seconds después de guardarse.
+    - LRU: con max_entries alcanzado se expulsa la entrada menos usada.
+    - Versión de índice: si cambia la colección Chroma, la caché se vacía.
+    - Persistencia opcional en persist_path (.json con metadatos + .npy con vectores).
+    """
+
+    def __init__(self, embeddings, threshold: float = DEFAULT_THRESHOLD,
+                 ttl_seconds: float = DEFAULT_TTL_SECONDS, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 persist_path: Optional[str] = None, persist_interval: float = DEFAULT_PERSIST_INTERVAL):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.persist_interval = persist_interval
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._next_id = 0
+        self._index_version: Optional[str] = None
+        self._matrix: Optional[np.ndarray] = None # Vectores apilados (se recalcula si hay cambios)
+        self._matrix_ids: List[int] = []
+        self._last_persist = 0.0
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+        if persist_path:
+            self._load()
+
+    # -------- Utilidades --------
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(v))
+        return v / norm if norm > 0 else v
+
+    def embed(self, query: str) -> np.ndarray:
+        return self._unit(self.embeddings.embed_query(query))
+
+    def _check_version(self, index_version: Optional[str]) -> None:
+        if index_version is None:
+            return
+        if self._index_version is not None and self._index_version != index_version:
+            self._entries.clear()
+            self._matrix = None
+            self.invalidations += 1
+            debug("Índice RAG cambió; caché semántica de respuestas invalidada.")
+        self._index_version = index_version
+
+    def _purge_expired(self, now: float) -> None:
+        expired = [k for k, e in self._entries.items() if now - e["created_at"] > self.ttl_seconds]
+        for k in expired:
+            del self._entries[k]
+        if expired:
+            self._matrix = None
+
+    def _ensure_matrix(self) -> None:
+        if self._matrix is None:
+            self._matrix_ids = list(self._entries.keys())
+            self._matrix = (np.vstack([self._entries[k]["vector"] for k in self._matrix_ids])
+                            if self._matrix_ids else None)
+
+    # -------- API pública --------
+    def lookup(self, query: str, index_version: Optional[str] = None,
+               vector: Optional[np.ndarray] = None) -> Optional[str]:
+        """Retorna la respuesta guardada de la consulta más parecida si supera el umbral; si no, None."""
+        vector = self.embed(query) if vector is None else vector
+        with self._lock:
+            self._check_version(index_version)
+            self._purge_expired(time.time())
+            self._ensure_matrix()
+            if self._matrix is None:
+                self.misses += 1
+                return None
+
+            scores = self._matrix @ vector
+            best = int(np.argmax(scores))
+            if float(scores[best]) < self.threshold:
+                self.misses += 1
+                return None
+
+            entry_id = self._matrix_ids[best]
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            return self._entries[entry_id]["answer"]
+
+    def store(self, query: str, answer: str, index_version: Optional[str] = None,
+              vector: Optional[np.ndarray] = None) -> None:
+        vector = self.embed(query) if vector is None else vector
+        with self._lock:
+            self._check_version(index_version)
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+            self._entries[self._next_id] = {
+                "query": query,
+                "answer": answer,
+                "vector": vector,
+                "created_at": time.time(),
+            }
+            self._next_id += 1
+            self._matrix = None
+            if self.persist_path and time.time() - self._last_persist >= self.persist_interval:
+                self._persist_locked()
+
+    def get_or_compute(self, query: str, compute, index_version: Optional[str] = None,
+                       should_store=None) -> str:
+        """
+        Busca en la caché y, si no hay coincidencia, ejecuta compute() y guarda el resultado.
+        should_store(answer) permite no guardar respuestas de error.
+        """
+        vector = self.embed(query)
+        cached = self.lookup(query, index_version=index_version, vector=vector)
+        if cached is not None:
+            return cached
+        answer = compute()
+        if should_store is None or should_store(answer):
+            self.store(query, answer, index_version=index_version, vector=vector)
+        return answer
+
+    async def aget_or_compute(self, query: str, acompute, index_version: Optional[str] = None,
+                              should_store=None) -> str:
+        """
+        Versión async de get_or_compute: acompute() retorna un awaitable. El embedding de la
+        consulta (cómputo local) corre en un hilo para no bloquear el event loop.
+        """
+        vector = await asyncio.to_thread(self.embed, query)
+        cached = self.lookup(query, index_version=index_version, vector=vector)
+        if cached is not None:
+            return cached
+        answer = await acompute()
+        if should_store is None or should_store(answer):
+            self.store(query, answer, index_version=index_version, vector=vector)
+        return answer
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            "hit_ratio": (self.hits / total) if total else 0.0,
+        }
+
+    # -------- Persistencia --------
+    def persist(self) -> None:
+        if not self.persist_path:
+            return
+        with self._lock:
+            self._persist_locked()
+
+    def _persist_locked(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.persist_path))
+        os.makedirs(directory, exist_ok=True)
+        ids = list(self._entries.keys())
+        meta = {
+            "index_version": self._index_version,
+            "entries": [{k: v for k, v in self._entries[i].items() if k != "vector"} for i in ids],
+        }
+        vectors = (np.vstack([self._entries[i]["vector"] for i in ids]) if ids
+                   else np.zeros((0, 0), dtype=np.float32))
+        with open(self.persist_path + ".npy.tmp", "wb") as f:
+            np.save(f, vectors)
+        with open(self.persist_path + ".json.tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(self.persist_path + ".npy.tmp", self.persist_path + ".npy")
+        os.replace(self.persist_path + ".json.tmp", self.persist_path + ".json")
+        self._last_persist = time.time()
+
+    def _load(self) -> None:
+        meta_path, vectors_path = self.persist_path + ".json", self.persist_path + ".npy"
+        if not (os.path.exists(meta_path) and os.path.exists(vectors_path)):
+            return
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            vectors = np.load(vectors_path)
+            now = time.time()
+            for entry, vector in zip(meta["entries"], vectors):
+                if now - entry["created_at"] <= self.ttl_seconds:
+                    self._entries[self._next_id] = dict(entry, vector=vector.astype(np.float32))
+                    self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._index_version = meta.get("index_version")
+            debug(f"Caché semántica de respuestas cargada con {len(self._entries)} entradas.")
+        except Exception as e:
+            error(f"Caché semántica ilegible ({e}). Se inicia vacía.")
+            self._entries.clear()
@@ -0,0 +1,142 @@
+# ============================================================
+# 📦 rag_context.py — Armado del contexto RAG con presupuesto de tokens
+# ============================================================
+# Los PDFs se dividen con chunk_overlap=200, así que chunks vecinos recuperados juntos
+# repiten hasta 200 caracteres. Antes de armar el prompt:
+#   1. se fusionan chunks adyacentes de la misma fuente y página, sin el texto solapado;
+#   2. se eliminan chunks casi duplicados;
+#   3. se empaquetan por relevancia hasta un presupuesto de tokens (tokenizador local).
+
+import os
+from typing import Callable, List, Optional, Set, Tuple
+
+from langchain_core.documents import Document
+
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("ECOMARKET_CONTEXT_TOKENS", "1500"))
+MIN_OVERLAP_CHARS = 20 # Solapamientos más cortos se consideran coincidencia casual
+MAX_OVERLAP_CHARS = 400 # Mayor que chunk_overlap=200 para tolerar cortes en espacios
+NEAR_DUPLICATE_JACCARD = 0.85
+
+_token_counter: Optional[Callable[[str], int]] = None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Cuenta tokens con tiktoken (o200k_base, el de gpt-4o-mini) si está instalado;
+    si no, aproxima con 4 caracteres por token.
+    """
+    global _token_counter
+    if _token_counter is None:
+        try:
+            import tiktoken
+            encoding = tiktoken.get_encoding("o200k_base")
+            _token_counter = lambda t: len(encoding.encode(t, disallowed_special=()))
+        except Exception:
+            _token_counter = lambda t: (len(t) + 3) // 4
+    return _token_counter(text)
+
+
+def _overlap(a: str, b: str) -> int:
+    """Largo del sufijo más largo de a que es prefijo de b (0 si es menor a MIN_OVERLAP_CHARS)."""
+    max_len = min(len(a), len(b), MAX_OVERLAP_CHARS)
+    for size in range(max_len, MIN_OVERLAP_CHARS - 1, -1):
+        if a.endswith(b[:size]):
+            return size
+    return 0
+
+
+def _group_key(metadata: dict) -> Tuple[str, str]:
+    return (str(metadata.get("source", "")), str(metadata.get("page", "")))
+
+
+def merge_adjacent_chunks(docs: List[Document]) -> List[Document]:
+    """
+    Fusiona chunks contiguos de la misma (source, página) quitando el texto solapado.
+    El bloque fusionado ocupa la posición del chunk más relevante que contiene.
+    """
+    # Cada item: [mejor_rango, texto, metadata, start_index]
+    items = [[rank, d.page_content, dict(d.metadata), d.metadata.get("start_index")] for rank, d in enumerate(docs)]
+
+    merged_any = True
+    while merged_any:
+        merged_any = False
+        for i in range(len(items)):
+            for j in range(len(items)):
+                if i == j or _group_key(items[i][2]) != _group_key(items[j][2]):
+                    continue
+                first, second = items[i], items[j]
+                # Con start_index se exige el orden real del documento
+                if first[3] is not None and second[3] is not None and first[3] > second[3]:
+                    continue
+                size = _overlap(first[1], second[1])
+                if not size:
+                    continue
+                first[1] = first[1] + second[1][size:]
+                first[0] = min(first[0], second[0])
+                items.pop(j)
+                merged_any = True
+                break
+            if merged_any:
+                break
+
+    items.sort(key=lambda item: item[0])
+    return [Document(page_content=text, metadata=metadata) for _, text, metadata, _ in items]
+
+
+def _shingles(text: str, n: int = 3) -> Set[Tuple[str, ...]]:
+    words = text.lower().split()
+    if len(words) < n:
+        return {tuple(words)}
+    return {tuple(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def drop_near_duplicates(docs: List[Document], threshold: float = NEAR_DUPLICATE_JACCARD) -> List[Document]:
+    """Elimina documentos cuyo Jaccard de 3-gramas de palabras con uno más relevante supera el umbral."""
+    kept: List[Document] = []
+    kept_shingles: List[Set[Tuple[str, ...]]] = []
+    for doc in docs:
+        sh = _shingles(doc.page_content)
+        duplicate = False
+        for other in kept_shingles:
+            union = len(sh | other)
+            if union and len(sh & other) / union >= threshold:
+                duplicate = True
+                break
+        if not duplicate:
+            kept.append(doc)
+            kept_shingles.append(sh)
+    return kept
+
+
+def _format(doc: Document) -> str:
+    return f"Source: {doc.metadata.get('source', 'unknown')}\n{doc.page_content}"
+
+
+def pack_context(docs: List[Document], token_budget: int = DEFAULT_TOKEN_BUDGET) -> List[Document]:
+    """
+    Fusiona, deduplica y empaqueta por relevancia hasta token_budget tokens.
+    Un bloque que no cabe se omite y se prueba con los siguientes; si ni el primero cabe,
+    se incluye recortado para no dejar el prompt sin contexto.
+    """
+    candidates = drop_near_duplicates(merge_adjacent_chunks(docs))
+    packed: List[Document] = []
+    used = 0
+    for doc in candidates:
+        tokens = count_tokens(_format(doc)) + 2 # +2 por el separador entre bloques
+        if used + tokens <= token_budget:
+            packed.append(doc)
+            used += tokens
+
+    if not packed and candidates:
+        first = candidates[0]
+        # Recorte proporcional (aprox.) al presupuesto disponible
+        ratio = token_budget / max(1, count_tokens(_format(first)))
+        packed.append(Document(page_content=first.page_content[:int(len(first.page_content) * ratio)],
+                               metadata=first.metadata))
+    return packed
+
+
+def build_context(docs: List[Document], token_budget: int = DEFAULT_TOKEN_BUDGET) -> str:
+    """Texto de contexto listo para el prompt."""
+    return "\n\n".join(_format(d) for d in pack_context(docs, token_budget))
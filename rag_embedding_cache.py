@@ -0,0 +1,343 @@
+# ============================================================
+# 💾 rag_embedding_cache.py — Caché persistente de embeddings
+# ============================================================
+# Envuelve cualquier objeto Embeddings de LangChain y guarda los vectores en disco,
+# indexados por (modelo, normalización, hash del texto). Los textos ya vistos no
+# vuelven a pasar por el modelo: en CPU re-embeber es el paso más lento de un despliegue.
+#
+# Solo se persisten los vectores de documentos. Los de consultas quedan en una LRU en memoria
+# del proceso: son efímeros y escribirlos en disco pondría E/S en el camino de cada pregunta.
+#
+# El directorio se comparte entre procesos (workers de servicio_chat, pool de embeddings):
+# toda asignación de filas, escritura de vectores y guardado del índice se hace con un
+# bloqueo de archivo (fcntl.flock sobre ".lock"). Sin fcntl (Windows) no hay bloqueo entre
+# procesos: en ese caso cada proceso debe usar su propio ECOMARKET_EMBED_CACHE_DIR.
+
+import os
+import json
+import time
+import atexit
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from telemetria import debug, error
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+
+DEFAULT_CACHE_DIR = "./embedding_cache"
+DEFAULT_MAX_ENTRIES = 200_000
+_INITIAL_CAPACITY = 1024 # Filas reservadas al crear el archivo; crece al doble cuando se llena
+_FORMAT_VERSION = 2 # 2 = vectors.f32 + keys.bin (hash de cada fila) + index.json
+
+# Escritura por lotes: los vectores nuevos esperan en memoria hasta juntar FLUSH_ENTRIES o
+# hasta que pasen FLUSH_SECONDS desde la última escritura (y siempre al salir del proceso)
+FLUSH_ENTRIES = int(os.getenv("ECOMARKET_EMBED_CACHE_FLUSH_ENTRIES", "256"))
+FLUSH_SECONDS = float(os.getenv("ECOMARKET_EMBED_CACHE_FLUSH_SECONDS", "30"))
+QUERY_CACHE_MAX = int(os.getenv("ECOMARKET_QUERY_EMBED_CACHE_MAX", "10000")) # Consultas en memoria
+
+_KEY_BYTES = 32 # sha256
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Caché de embeddings en disco:
+    - vectors.f32: arreglo float32 (capacidad x dimensión) abierto con np.memmap.
+    - keys.bin: hash sha256 del texto guardado en cada fila; la lectura lo comprueba antes y
+      después de copiar el vector, así un índice desactualizado (otro proceso reutilizó la
+      fila) o una escritura a medias nunca devuelven un vector equivocado.
+    - index.json: mapa hash_texto -> fila, en orden LRU (del menos al más usado).
+    Con max_entries alcanzado se reutilizan las filas de las entradas menos usadas.
+    """
+
+    def __init__(self, underlying: Embeddings, model_name: str, normalize: bool = True,
+                 cache_dir: str = DEFAULT_CACHE_DIR, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 flush_entries: int = FLUSH_ENTRIES, flush_seconds: float = FLUSH_SECONDS,
+                 query_cache_max: int = QUERY_CACHE_MAX):
+        self.underlying = underlying
+        self.model_name = model_name
+        self.normalize = normalize
+        self.max_entries = max_entries
+        self.flush_entries = flush_entries
+        self.flush_seconds = flush_seconds
+        self.query_cache_max = query_cache_max
+
+        # Un subdirectorio por (modelo, normalización): la dimensión es fija dentro de cada uno
+        namespace = hashlib.sha256(f"{model_name}|{normalize}".encode("utf-8")).hexdigest()[:16]
+        self.cache_dir = os.path.join(cache_dir, namespace)
+        self._vectors_path = os.path.join(self.cache_dir, "vectors.f32")
+        self._keys_path = os.path.join(self.cache_dir, "keys.bin")
+        self._index_path = os.path.join(self.cache_dir, "index.json")
+        self._lock_path = os.path.join(self.cache_dir, ".lock")
+
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._free_slots: List[int] = []
+        self._dim: Optional[int] = None
+        self._capacity = 0
+        self._vectors: Optional[np.memmap] = None
+        self._keys: Optional[np.memmap] = None
+        self._index_stamp: Optional[Tuple[int, int, int]] = None # index.json leído/escrito por última vez
+
+        self._pending: "OrderedDict[str, np.ndarray]" = OrderedDict() # Documentos aún sin escribir
+        self._last_flush = time.monotonic()
+        self._queries: "OrderedDict[str, List[float]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+        with self._lock, self._file_lock():
+            self._load()
+        atexit.register(self.flush)
+
+    # -------- Persistencia --------
+    @contextmanager
+    def _file_lock(self):
+        """Bloqueo exclusivo entre procesos sobre el directorio de la caché."""
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self._index_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _reset(self) -> None:
+        self._index = OrderedDict()
+        self._free_slots = []
+        self._dim = None
+        self._capacity = 0
+        self._vectors = None
+        self._keys = None
+
+    def _open_arrays(self) -> None:
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r+',
+                                  shape=(self._capacity, self._dim))
+        self._keys = np.memmap(self._keys_path, dtype=np.uint8, mode='r+',
+                               shape=(self._capacity, _KEY_BYTES))
+
+    def _load(self) -> None:
+        """Lee index.json y abre los arreglos. Se llama con el bloqueo de archivo tomado."""
+        self._index_stamp = self._stamp()
+        if self._index_stamp is None or not os.path.exists(self._vectors_path):
+            return
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get("format") != _FORMAT_VERSION:
+                raise ValueError(f"formato {meta.get('format')} distinto de {_FORMAT_VERSION}")
+            self._dim = int(meta["dim"])
+            self._capacity = int(meta["capacity"])
+            self._index = OrderedDict((k, int(slot)) for k, slot in meta["entries"])
+            self._free_slots = [int(s) for s in meta.get("free_slots", [])]
+            self._open_arrays()
+            debug(f"Caché de embeddings cargada con {len(self._index)} vectores ({self.cache_dir}).")
+        except Exception as e:
+            error(f"Caché de embeddings corrupta ({e}). Se reinicia vacía.")
+            self._reset()
+            self._index_stamp = None
+
+    def _refresh(self) -> None:
+        """Relee el índice si otro proceso lo reescribió. Se llama con ambos bloqueos tomados."""
+        if self._stamp() != self._index_stamp:
+            self._reset()
+            self._load()
+
+    def _save_index(self) -> None:
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._keys.flush()
+        tmp_path = f"{self._index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "format": _FORMAT_VERSION,
+                "model_name": self.model_name,
+                "normalize": self.normalize,
+                "dim": self._dim,
+                "capacity": self._capacity,
+                "entries": list(self._index.items()),
+                "free_slots": self._free_slots,
+            }, f)
+        os.replace(tmp_path, self._index_path)
+        self._index_stamp = self._stamp()
+
+    def _ensure_capacity(self, needed_rows: int) -> None:
+        """Crea o agranda los archivos de vectores y hashes para que quepan needed_rows filas."""
+        if needed_rows <= self._capacity:
+            return
+        new_capacity = max(_INITIAL_CAPACITY, self._capacity)
+        while new_capacity < needed_rows:
+            new_capacity *= 2
+        new_capacity = min(new_capacity, self.max_entries)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._keys.flush()
+            self._vectors = self._keys = None
+        for path, row_bytes in ((self._vectors_path, self._dim * 4), (self._keys_path, _KEY_BYTES)):
+            with open(path, 'ab') as f:
+                f.truncate(new_capacity * row_bytes)
+        self._free_slots.extend(range(self._capacity, new_capacity))
+        self._capacity = new_capacity
+        self._open_arrays()
+
+    def _allocate_slot(self) -> int:
+        if not self._free_slots and self._capacity < self.max_entries:
+            self._ensure_capacity(len(self._index) + 1)
+        if self._free_slots:
+            return self._free_slots.pop()
+        # Caché llena: se expulsa la entrada menos usada y se reutiliza su fila
+        _, slot = self._index.popitem(last=False)
+        self.evictions += 1
+        return slot
+
+    def _read_slot(self, key: str, slot: int) -> Optional[List[float]]:
+        """Copia la fila si su hash sigue siendo el de key (antes y después de leerla)."""
+        if slot >= self._capacity:
+            return None
+        digest = bytes.fromhex(key)
+        if self._keys[slot].tobytes() != digest:
+            return None
+        vector = self._vectors[slot].tolist()
+        if self._keys[slot].tobytes() != digest:
+            return None
+        return vector
+
+    def _write_pending(self) -> None:
+        """Escribe los vectores pendientes y guarda el índice. Se llama con self._lock tomado."""
+        if not self._pending:
+            return
+        with self._file_lock():
+            self._refresh()
+            if self._dim is None:
+                self._dim = len(next(iter(self._pending.values())))
+            for key, vector in self._pending.items():
+                if key in self._index:
+                    continue # Otro proceso ya lo guardó
+                slot = self._allocate_slot()
+                # Hash en cero mientras se escribe el vector: los lectores descartan la fila
+                self._keys[slot] = 0
+                self._vectors[slot] = vector
+                self._keys[slot] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+                self._index[key] = slot
+            self._save_index()
+        self._pending.clear()
+        self._last_flush = time.monotonic()
+
+    def flush(self) -> None:
+        """Persiste los vectores de documentos aún en memoria (al terminar una ingesta o al salir)."""
+        with self._lock:
+            try:
+                self._write_pending()
+            except Exception as e:
+                error(f"No se pudo guardar la caché de embeddings ({e}).")
+
+    # -------- Lógica de caché --------
+    @staticmethod
+    def _text_key(kind: str, text: str) -> str:
+        return hashlib.sha256(f"{kind}|{text}".encode("utf-8")).hexdigest()
+
+    def _embed_with_cache(self, texts: List[str], compute) -> List[List[float]]:
+        keys = [self._text_key("doc", t) for t in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        missing: Dict[str, List[int]] = {}
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                vector = None
+                pending = self._pending.get(key)
+                if pending is not None:
+                    vector = pending.tolist()
+                else:
+                    slot = self._index.get(key)
+                    if slot is not None:
+                        vector = self._read_slot(key, slot)
+                        if vector is None:
+                            # Otro proceso reutilizó la fila: el índice en memoria estaba viejo
+                            del self._index[key]
+                            self.stale += 1
+                        else:
+                            self._index.move_to_end(key)
+                if vector is not None:
+                    results[i] = vector
+                    self.hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+                    self.misses += 1
+
+        if not missing:
+            return results
+
+        # Solo los textos únicos que faltan pasan por el modelo
+        missing_keys = list(missing.keys())
+        vectors = compute([texts[missing[k][0]] for k in missing_keys])
+
+        with self._lock:
+            for key, vector in zip(missing_keys, vectors):
+                for i in missing[key]:
+                    results[i] = list(vector)
+                if key not in self._index:
+                    self._pending[key] = np.asarray(vector, dtype=np.float32)
+            if (len(self._pending) >= self.flush_entries
+                    or time.monotonic() - self._last_flush >= self.flush_seconds):
+                self._write_pending()
+
+        return results
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return self._embed_with_cache(texts, self.underlying.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._text_key("query", text)
+        with self._lock:
+            vector = self._queries.get(key)
+            if vector is not None:
+                self._queries.move_to_end(key)
+                self.hits += 1
+                return list(vector)
+            self.misses += 1
+
+        vector = list(self.underlying.embed_query(text))
+        with self._lock:
+            self._queries[key] = vector
+            while len(self._queries) > self.query_cache_max:
+                self._queries.popitem(last=False)
+        return list(vector)
+
+    def stats(self) -> Dict[str, float]:
+        """Contadores de uso de la caché."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "stale": self.stale,
+            "entries": len(self._index),
+            "pending": len(self._pending),
+            "queries": len(self._queries),
+            "hit_ratio": (self.hits / total) if total else 0.0,
+        }
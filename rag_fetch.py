@@ -0,0 +1,197 @@
+# ============================================================
+# 🌐 rag_fetch.py — Descarga concurrente y condicional de documentos
+# ============================================================
+# Descarga los archivos fuente del RAG en paralelo sobre una sesión HTTP con pool de
+# conexiones. Guarda ETag/Last-Modified junto a los archivos y envía peticiones
+# condicionales: un archivo sin cambios vuelve como 304 y no se descarga ni se re-parsea.
+
+import os
+import json
+import time
+import random
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from telemetria import debug, error, span, warning
+
+
+FETCH_METADATA_FILE = ".fetch_metadata.json"
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
+# Estados posibles de una descarga
+DOWNLOADED = "downloaded"
+NOT_MODIFIED = "not_modified"
+MISSING = "missing"
+FAILED = "failed"
+STALE = "stale" # Falló la descarga pero hay copia local previa (modo offline)
+
+
+@dataclass
+class FetchResult:
+    name: str
+    local_path: Optional[str]
+    status: str
+    attempts: int = 0
+    error: Optional[str] = None
+
+    @property
+    def changed(self) -> bool:
+        """True si el archivo local es nuevo/distinto y hay que volver a parsearlo."""
+        return self.status == DOWNLOADED
+
+
+def create_pooled_session(pool_size: int = 8) -> requests.Session:
+    """Sesión HTTP con pool de conexiones reutilizable (keep-alive) para todas las descargas."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def backoff_delay(attempt: int, base: float = 0.5, cap: float = 8.0) -> float:
+    """Backoff exponencial con 'full jitter': espera aleatoria en [0, min(cap, base * 2^intento)]."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def load_fetch_metadata(download_dir: str) -> Dict[str, Dict[str, str]]:
+    path = os.path.join(download_dir, FETCH_METADATA_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        error(f"Metadatos de descarga ilegibles ({e}). Se descargará todo de nuevo.")
+        return {}
+
+
+def save_fetch_metadata(download_dir: str, metadata: Dict[str, Dict[str, str]]) -> None:
+    os.makedirs(download_dir, exist_ok=True)
+    path = os.path.join(download_dir, FETCH_METADATA_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(metadata, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def update_fetch_metadata(metadata: Dict[str, Dict[str, str]], name: str,
+                          result: FetchResult, meta: Dict[str, str]) -> bool:
+    """Aplica a metadata el resultado de una descarga. Retorna True si cambió algo."""
+    if (result.status == DOWNLOADED and not meta) or result.status == MISSING:
+        # Un 200 sin ETag/Last-Modified invalida los validadores de la copia anterior; un 404, la entrada
+        return metadata.pop(name, None) is not None
+    if meta and metadata.get(name) != meta:
+        metadata[name] = meta
+        return True
+    return False
+
+
+def fetch_file(session: requests.Session, url: str, local_path: str,
+               previous: Optional[Dict[str, str]] = None, timeout: int = 60,
+               max_retries: int = 3, backoff_base: float = 0.5, backoff_cap: float = 8.0,
+               name: Optional[str] = None) -> Tuple[FetchResult, Dict[str, str]]:
+    """
+    Descarga url en local_path con GET condicional (If-None-Match / If-Modified-Since).
+    Reintenta errores de red y 408/429/5xx con backoff exponencial con jitter; un 404 no se reintenta.
+    Retorna (FetchResult, metadatos nuevos del archivo).
+    """
+    name = name or os.path.basename(local_path)
+    previous = previous or {}
+    headers = {}
+    # Solo tiene sentido pedir 304 si todavía tenemos la copia local
+    if os.path.exists(local_path):
+        if previous.get("etag"):
+            headers["If-None-Match"] = previous["etag"]
+        if previous.get("last_modified"):
+            headers["If-Modified-Since"] = previous["last_modified"]
+
+    last_error = None
+    for attempt in range(max_retries):
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+                if resp.status_code == 304:
+                    return FetchResult(name, local_path, NOT_MODIFIED, attempt + 1), previous
+                if resp.status_code == 404:
+                    error(f"Archivo no encontrado (404): {url}. Se omite.")
+                    return FetchResult(name, None, MISSING, attempt + 1, "404"), {}
+                if resp.status_code in RETRYABLE_STATUS:
+                    raise requests.exceptions.HTTPError(f"HTTP {resp.status_code}", response=resp)
+                resp.raise_for_status()
+
+                # Escritura a un temporal + os.replace: nunca queda un archivo a medias
+                tmp_path = local_path + ".part"
+                with open(tmp_path, "wb") as f:
+                    for chunk in resp.iter_content(chunk_size=65536):
+                        if chunk:
+                            f.write(chunk)
+                os.replace(tmp_path, local_path)
+
+                meta = {}
+                if resp.headers.get("ETag"):
+                    meta["etag"] = resp.headers["ETag"]
+                if resp.headers.get("Last-Modified"):
+                    meta["last_modified"] = resp.headers["Last-Modified"]
+                debug(f"Descarga exitosa de {local_path}")
+                return FetchResult(name, local_path, DOWNLOADED, attempt + 1), meta
+
+        except requests.exceptions.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if status is not None and status not in RETRYABLE_STATUS:
+                error(f"Falló la descarga de {url} con HTTP {status}. No se reintenta.")
+                return FetchResult(name, None, FAILED, attempt + 1, str(e)), {}
+            last_error = e
+        except requests.exceptions.RequestException as e:
+            last_error = e
+
+        error(f"Falló la descarga de {url} (Intento {attempt + 1}/{max_retries}): {last_error}")
+        if attempt < max_retries - 1:
+            time.sleep(backoff_delay(attempt, backoff_base, backoff_cap))
+
+    if os.path.exists(local_path):
+        warning(f"Se usa la copia local existente de {name}.")
+        return FetchResult(name, local_path, STALE, max_retries, str(last_error)), previous
+    return FetchResult(name, None, FAILED, max_retries, str(last_error)), {}
+
+
+def fetch_documents(base_url: str, names: List[str], download_dir: str,
+                    session: Optional[requests.Session] = None, max_workers: int = 4,
+                    **fetch_kwargs) -> Dict[str, FetchResult]:
+    """
+    Descarga en paralelo base_url + nombre para cada nombre en names hacia download_dir.
+    Actualiza el archivo de metadatos (ETag/Last-Modified) al terminar.
+    Retorna {nombre: FetchResult}.
+    """
+    os.makedirs(download_dir, exist_ok=True)
+    own_session = session is None
+    session = session or create_pooled_session(pool_size=max_workers)
+    metadata = load_fetch_metadata(download_dir)
+    meta_lock = threading.Lock()
+    results: Dict[str, FetchResult] = {}
+
+    def _one(name: str) -> FetchResult:
+        with span("ingest.download", file=name):
+            result, meta = fetch_file(session, base_url + name, os.path.join(download_dir, name),
+                                      previous=metadata.get(name), name=name, **fetch_kwargs)
+        with meta_lock:
+            update_fetch_metadata(metadata, name, result, meta)
+        return result
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # Cada descarga corre en una copia del contexto: su span cuelga de la traza de quien llama
+            parent = contextvars.copy_context()
+            for result in pool.map(lambda name: parent.copy().run(_one, name), names):
+                results[result.name] = result
+    finally:
+        if own_session:
+            session.close()
+
+    save_fetch_metadata(download_dir, metadata)
+    return results
@@ -0,0 +1,148 @@
+# ============================================================
+# 🔀 rag_hybrid_retriever.py — Recuperación híbrida BM25 + densa
+# ============================================================
+# Combina un índice BM25 en proceso (construido sobre los mismos chunks de Chroma) con
+# la búsqueda densa de Chroma usando Reciprocal Rank Fusion (RRF). El número de chunks
+# que se envía al LLM se elige según la brecha de puntajes: una consulta clara manda 1-2
+# chunks en lugar de 5, lo que reduce tokens de prompt y latencia del LLM.
+
+import hashlib
+import math
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from utilidades_texto import tokenize
+
+
+def doc_key(doc: Document) -> str:
+    """
+    Identidad de un chunk: hash de (source, página, texto), igual al ID por contenido de la indexación.
+    No depende de Document.id porque no todas las versiones de langchain_chroma lo devuelven.
+    """
+    raw = f"{doc.metadata.get('source', '')}|{doc.metadata.get('page', '')}|{doc.page_content}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
+class BM25Index:
+    """BM25 (Okapi) en memoria con listas invertidas término -> [(doc, frecuencia)]."""
+
+    def __init__(self, documents: List[Document], ids: Optional[List[str]] = None,
+                 k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents = documents
+        self.ids = ids or [doc_key(d) for d in documents]
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._doc_len: List[int] = []
+
+        for i, doc in enumerate(documents):
+            terms = Counter(tokenize(doc.page_content))
+            self._doc_len.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self._postings.setdefault(term, []).append((i, tf))
+
+        n = len(documents)
+        self._avg_len = (sum(self._doc_len) / n) if n else 0.0
+        self._idf = {t: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5)) for t, p in self._postings.items()}
+
+    @classmethod
+    def from_chroma(cls, vectordb, batch_size: int = 1000, **kwargs) -> "BM25Index":
+        """Construye el índice leyendo todos los chunks (texto + metadata) de la colección Chroma."""
+        documents, ids = [], []
+        offset = 0
+        while True:
+            batch = vectordb.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            if not batch["ids"]:
+                break
+            for chunk_id, text, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+                documents.append(Document(page_content=text or "", metadata=metadata or {}, id=chunk_id))
+                ids.append(chunk_id)
+            offset += len(batch["ids"])
+        return cls(documents, ids=ids, **kwargs)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[Document, float]]:
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self._postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self._doc_len[i] / (self._avg_len or 1.0))
+                scores[i] = scores.get(i, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+        return [(self.documents[i], s) for i, s in best]
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], rrf_k: int = 60) -> Dict[str, float]:
+    """RRF: cada lista aporta 1 / (rrf_k + posición) a cada documento que contiene."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (rrf_k + rank)
+    return fused
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever híbrido: ordena por RRF (densa + BM25) y recorta adaptativamente.
+    Para el corte se usa un puntaje de confianza por chunk (promedio de la relevancia densa
+    y del BM25 normalizado por el máximo); se conservan los chunks, en orden RRF, cuya
+    confianza sea al menos keep_ratio veces la del primero (mínimo min_k, máximo max_k).
+    """
+
+    vectorstore: Any
+    bm25: Any
+    fetch_k: int = 10
+    min_k: int = 1
+    max_k: int = 5
+    rrf_k: int = 60
+    keep_ratio: float = 0.75
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun,
+                                k: Optional[int] = None, **kwargs) -> List[Document]:
+        max_k = k or self.max_k
+
+        dense = self.vectorstore.similarity_search_with_relevance_scores(query, k=self.fetch_k)
+        sparse = self.bm25.search(query, k=self.fetch_k) if self.bm25 is not None else []
+
+        docs: Dict[str, Document] = {}
+        dense_scores: Dict[str, float] = {}
+        sparse_scores: Dict[str, float] = {}
+        for doc, score in dense:
+            key = doc_key(doc)
+            docs.setdefault(key, doc)
+            dense_scores[key] = max(0.0, min(1.0, score))
+        top_sparse = sparse[0][1] if sparse else 0.0
+        for doc, score in sparse:
+            key = doc_key(doc)
+            docs.setdefault(key, doc)
+            sparse_scores[key] = score / top_sparse if top_sparse > 0 else 0.0
+
+        fused = reciprocal_rank_fusion([[doc_key(d) for d, _ in dense], [doc_key(d) for d, _ in sparse]],
+                                       rrf_k=self.rrf_k)
+        ordered = sorted(fused, key=fused.get, reverse=True)
+        if not ordered:
+            return []
+
+        # Corte adaptativo por brecha de confianza respecto al primer resultado
+        confidence = {key: (dense_scores.get(key, 0.0) + sparse_scores.get(key, 0.0)) / 2 for key in ordered}
+        top_confidence = confidence[ordered[0]]
+        selected = []
+        for key in ordered[:max_k]:
+            if len(selected) >= self.min_k and confidence[key] < self.keep_ratio * top_confidence:
+                break
+            selected.append(key)
+
+        # Copias: no se modifica la metadata de los documentos guardados en el índice BM25
+        return [Document(page_content=docs[key].page_content, id=key,
+                         metadata=dict(docs[key].metadata, rrf_score=round(fused[key], 6)))
+                for key in selected]
@@ -0,0 +1,139 @@
+# ============================================================
+# 🧵 rag_parallel_embed.py — Embeddings en varios procesos para ingestas grandes
+# ============================================================
+# Sin GPU, HuggingFaceEmbeddings codifica todos los chunks en un solo proceso y el resto de
+# los núcleos queda ocioso. ParallelEmbedder reparte los textos en lotes entre un pool de
+# procesos (cada uno con su propia instancia del modelo y sus propios hilos de cómputo):
+#   - tamaño de lote configurable (ECOMARKET_EMBED_BATCH);
+#   - los resultados se entregan en el mismo orden de entrada, a medida que terminan, para
+#     escribirlos en Chroma por lotes sin esperar al final;
+#   - como máximo max_pending lotes en vuelo: la memoria no crece con el tamaño del corpus.
+
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Deque, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from telemetria import debug
+
+
+EMBED_WORKERS = int(os.getenv("ECOMARKET_EMBED_WORKERS", "0")) # 0 o 1 = un solo proceso (modo normal)
+EMBED_BATCH_SIZE = int(os.getenv("ECOMARKET_EMBED_BATCH", "64")) # Textos por lote enviado a un worker
+EMBED_THREADS_PER_WORKER = int(os.getenv("ECOMARKET_EMBED_THREADS", "0")) # 0 = núcleos / workers
+
+_THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS")
+
+# Modelo del proceso worker (uno por proceso, creado en el initializer)
+_WORKER_MODEL = None
+
+
+class HuggingFaceEmbeddingsFactory:
+    """Crea HuggingFaceEmbeddings dentro de cada worker (el modelo no se serializa entre procesos)."""
+
+    def __init__(self, model_name: str, normalize: bool = True, device: str = "cpu"):
+        self.model_name = model_name
+        self.normalize = normalize
+        self.device = device
+
+    def __call__(self):
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(
+            model_name=self.model_name,
+            model_kwargs={'device': self.device},
+            encode_kwargs={'normalize_embeddings': self.normalize},
+        )
+
+
+def _init_worker(factory: Callable, threads: int) -> None:
+    global _WORKER_MODEL
+    # Cada worker usa solo su parte de los núcleos: sin esto N procesos x N hilos se pisan
+    if threads > 0:
+        for var in _THREAD_ENV_VARS:
+            os.environ[var] = str(threads)
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+    _WORKER_MODEL = factory()
+
+
+def _embed_batch(texts: List[str]) -> np.ndarray:
+    return np.asarray(_WORKER_MODEL.embed_documents(texts), dtype=np.float32)
+
+
+def default_workers() -> int:
+    return max(1, os.cpu_count() or 1)
+
+
+class ParallelEmbedder:
+    """
+    Pool de procesos que embebe textos por lotes. Uso:
+
+        with ParallelEmbedder(HuggingFaceEmbeddingsFactory("BAAI/bge-m3"), workers=16) as embedder:
+            for start, vectors in embedder.imap(textos):
+                ...  # vectors corresponde a textos[start:start + len(vectors)]
+
+    Los procesos se crean con 'spawn' (seguro con PyTorch) y cargan el modelo una sola vez.
+    """
+
+    def __init__(self, factory: Callable, workers: Optional[int] = None, batch_size: int = EMBED_BATCH_SIZE,
+                 threads_per_worker: Optional[int] = None, max_pending: Optional[int] = None):
+        self.factory = factory
+        self.workers = max(1, workers or default_workers())
+        self.batch_size = max(1, batch_size)
+        if threads_per_worker is None:
+            threads_per_worker = EMBED_THREADS_PER_WORKER or max(1, (os.cpu_count() or 1) // self.workers)
+        self.threads_per_worker = threads_per_worker
+        self.max_pending = max_pending or self.workers * 2
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.factory, self.threads_per_worker),
+            )
+            debug(f"Pool de embeddings iniciado con {self.workers} procesos "
+                  f"({self.threads_per_worker} hilos c/u, lotes de {self.batch_size}).")
+        return self._executor
+
+    def warm_up(self) -> None:
+        """Carga el modelo en todos los workers antes de medir o de empezar a escribir."""
+        pool = self._pool()
+        futures = [pool.submit(_embed_batch, ["calentamiento"]) for _ in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def imap(self, texts: Sequence[str]) -> Iterator[Tuple[int, np.ndarray]]:
+        """Genera (inicio, vectores) por lote, en el orden de 'texts'."""
+        pool = self._pool()
+        pending: Deque[Tuple[int, object]] = deque()
+        for start in range(0, len(texts), self.batch_size):
+            pending.append((start, pool.submit(_embed_batch, list(texts[start:start + self.batch_size]))))
+            if len(pending) >= self.max_pending:
+                first, future = pending.popleft()
+                yield first, future.result()
+        while pending:
+            first, future = pending.popleft()
+            yield first, future.result()
+
+    def embed_documents(self, texts: Sequence[str]) -> List[List[float]]:
+        parts = [vectors for _, vectors in self.imap(texts)]
+        return np.vstack(parts).tolist() if parts else []
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def __enter__(self) -> "ParallelEmbedder":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
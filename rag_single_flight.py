@@ -0,0 +1,136 @@
+# ============================================================
+# 🛬 rag_single_flight.py — Unificación de consultas RAG idénticas en curso
+# ============================================================
+# Ante un incidente (p. ej. un retraso de envíos) cientos de clientes preguntan lo mismo en
+# pocos segundos. Con SingleFlight, la primera llamada con una clave dada (la "líder") ejecuta
+# la recuperación y el LLM; las llamadas concurrentes con la misma clave ("seguidoras") esperan
+# ese mismo resultado en lugar de repetir el trabajo. Al terminar, la clave se libera: no es
+# una caché (de eso se encarga rag_answer_cache), solo evita trabajo duplicado simultáneo.
+#   - do(): hilos (una sesión de Streamlit por hilo);
+#   - ado(): corrutinas del mismo event loop. Cancelar a quien espera no cancela el cómputo.
+# Una seguidora espera como máximo wait_timeout segundos: si la líder quedó colgada, calcula
+# por su cuenta en lugar de quedar bloqueada junto con ella.
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from telemetria import REGISTRY, warning
+
+
+COALESCED_CALLS = REGISTRY.counter("ecomarket_rag_single_flight_total",
+                                   "Consultas RAG por rol en la unificación: leader ejecuta, follower reutiliza.",
+                                   ("role",))
+FOLLOWER_TIMEOUTS = REGISTRY.counter("ecomarket_rag_single_flight_timeouts_total",
+                                     "Seguidoras que dejaron de esperar a la líder y calcularon por su cuenta.")
+
+
+class _Call:
+    """Cómputo en curso de una clave (camino con hilos)."""
+
+    __slots__ = ("done", "result", "exc")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.exc: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Ejecuta una sola vez cada clave mientras esté en curso y comparte el resultado (o la excepción)."""
+
+    def __init__(self, name: str = "rag", wait_timeout: Optional[float] = None):
+        self.name = name
+        self.wait_timeout = wait_timeout # None = esperar a la líder sin límite
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._futures: Dict[tuple, asyncio.Future] = {} # (loop, clave) -> tarea en curso
+        self.leaders = 0
+        self.followers = 0
+        self.timeouts = 0
+
+    def _count(self, leader: bool) -> None:
+        # Se llama con self._lock tomado
+        if leader:
+            self.leaders += 1
+        else:
+            self.followers += 1
+        COALESCED_CALLS.inc(role="leader" if leader else "follower")
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            self._count(leader)
+
+        if not leader:
+            if not call.done.wait(self.wait_timeout):
+                self._timed_out(key)
+                return fn()
+            if call.exc is not None:
+                raise call.exc
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.exc = e
+            raise
+        finally:
+            # Se libera la clave antes de despertar: una llamada posterior calcula de nuevo
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+    async def ado(self, key: Hashable, afn: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        with self._lock:
+            future = self._futures.get(flight_key)
+            leader = future is None
+            if leader:
+                future = self._futures[flight_key] = asyncio.ensure_future(afn())
+                future.add_done_callback(lambda _: self._release(flight_key))
+            self._count(leader)
+        # shield: si la corrutina que espera se cancela, las demás siguen recibiendo el resultado
+        if leader:
+            return await asyncio.shield(future)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.wait_timeout)
+        except asyncio.TimeoutError:
+            self._timed_out(key)
+            return await afn()
+
+    def _timed_out(self, key: Hashable) -> None:
+        with self._lock:
+            self.timeouts += 1
+        FOLLOWER_TIMEOUTS.inc()
+        warning(f"Single-flight '{self.name}': la líder no respondió en {self.wait_timeout} s; "
+                f"la seguidora calcula por su cuenta.", key=str(key)[:200])
+
+    def _release(self, flight_key: tuple) -> None:
+        with self._lock:
+            self._futures.pop(flight_key, None)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls) + len(self._futures)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.leaders + self.followers
+        return {
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "timeouts": self.timeouts,
+            "in_flight": self.in_flight(),
+            "coalescing_ratio": (self.followers / total) if total else 0.0,
+        }
+
+    def reset(self) -> None:
+        with self._lock:
+            self.leaders = 0
+            self.followers = 0
+            self.timeouts = 0
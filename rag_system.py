@@ -1,36 +1,72 @@
 import os
-import requests
-import time
 import shutil # Importado para manejar la eliminación de directorios
 import json # Importamos JSON aquí para la carga y transformación de FAQ
-from typing import List, Dict, Any, Optional
+import time
+import hashlib # Hashes de contenido para la indexación incremental
+import threading # Registro de recursos compartidos entre sesiones
+from typing import List, Dict, Any, Iterator, Optional
+
+import numpy as np
 
-# Importamos la librería PyTorch para la detección de CUDA (Mejora la compatibilidad)
-try:
-    import torch
-    # Determinar el dispositivo: 'cuda' si está disponible, sino 'cpu'
-    DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
-except ImportError:
-    # Si PyTorch no está instalado, por defecto usamos 'cpu'
-    DEVICE = 'cpu'
-    print("ADVERTENCIA: PyTorch no está instalado. Usando 'cpu' por defecto para embeddings.")
+from telemetria import REGISTRY, STAGE_SECONDS, critical, debug, error, span, traced, warning
+from rag_embedding_cache import CachedEmbeddings
+from rag_parallel_embed import EMBED_BATCH_SIZE, EMBED_WORKERS, HuggingFaceEmbeddingsFactory, ParallelEmbedder
+from rag_answer_cache import SemanticAnswerCache
+from rag_single_flight import SingleFlight
+from utilidades_texto import normalize_text
+from faq_index import read_faq_items
+from rag_hybrid_retriever import BM25Index, HybridRetriever
+from streaming_ecomarket import RAG_ANSWER_TAG
+from rag_context import DEFAULT_TOKEN_BUDGET as CONTEXT_TOKEN_BUDGET, build_context
+from llm_gateway import LLM_DEADLINE
+from rag_fetch import (
+    create_pooled_session,
+    fetch_documents,
+    fetch_file,
+    load_fetch_metadata,
+    save_fetch_metadata,
+    update_fetch_metadata,
+)
 
+# --- IMPORTACIONES DIFERIDAS ---
+# torch, sentence-transformers, chromadb y los loaders de langchain_community tardan varios
+# segundos en importarse. Se importan recién cuando se necesitan (primer embedding, primera
+# apertura del índice, primer PDF), así importar este módulo (y el agente) es casi inmediato.
+from langchain_core.documents import Document
 
-# IMPORTS recomendados por la documentación actual de LangChain:
-from langchain_community.document_loaders.csv_loader import CSVLoader
-from langchain_community.document_loaders.pdf import PyPDFLoader
-# Ya no necesitamos JSONLoader
-# from langchain_community.document_loaders.json_loader import JSONLoader 
+_DEVICE: Optional[str] = None
 
-# Usamos HuggingFaceEmbeddings genérico
-from langchain_community.embeddings import HuggingFaceEmbeddings 
 
-# Importación esencial para la nueva sintaxis de LangChain
-from langchain_core.messages import HumanMessage
+def get_device() -> str:
+    """
+    Dispositivo para los embeddings: ECOMARKET_DEVICE si está definido; si no, 'cuda' cuando
+    PyTorch está instalado y detecta una GPU, 'cpu' en otro caso. Se calcula una sola vez.
+    """
+    global _DEVICE
+    if _DEVICE is None:
+        device = os.getenv("ECOMARKET_DEVICE")
+        if not device:
+            try:
+                import torch
+                device = 'cuda' if torch.cuda.is_available() else 'cpu'
+            except ImportError:
+                # Si PyTorch no está instalado, por defecto usamos 'cpu'
+                device = 'cpu'
+                warning("PyTorch no está instalado. Usando 'cpu' por defecto para embeddings.")
+        _DEVICE = device
+    return _DEVICE
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
-from langchain.schema import Document
+
+def __getattr__(name: str):
+    # Compatibilidad: rag_system.DEVICE sigue disponible, pero sin importar torch al cargar el módulo
+    if name == "DEVICE":
+        return get_device()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _chroma_class():
+    from langchain_chroma import Chroma
+    return Chroma
 
 
 # --- DIRECTORIO DONDE SE GUARDARÁN LOS DOCUMENTOS DESCARGADOS ---
@@ -40,8 +76,430 @@ DOWNLOAD_DIR = "documentos_rag"
 # Base raw URL (tu repo)
 GITHUB_RAW_URL = "https://raw.githubusercontent.com/semurillas/GenIA-20252-ICESI/main/Taller%202/Documentos/"
 
+# Modelo de embeddings usado para indexar y consultar
+EMBEDDING_MODEL_NAME = "BAAI/bge-m3"
+DEFAULT_PERSIST_DIRECTORY = "./chroma_db"
+DEFAULT_COLLECTION_NAME = "ecomarket_rag_data"
+
+# Caché persistente de embeddings (vacío en ECOMARKET_EMBED_CACHE_DIR la desactiva)
+EMBED_CACHE_DIR = os.getenv("ECOMARKET_EMBED_CACHE_DIR", "./embedding_cache")
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("ECOMARKET_EMBED_CACHE_MAX", "200000"))
+
+
+# --- REGISTRO DE RECURSOS COMPARTIDOS (NIVEL PROCESO) ---
+# El modelo de embeddings, el cliente Chroma y el retriever son costosos de crear
+# (varios GB en RAM y decenas de segundos). Se cargan una sola vez por proceso y
+# todas las sesiones de Streamlit los comparten; solo la memoria y el agente son por usuario.
+_REGISTRY_LOCK = threading.RLock()
+_SHARED_EMBEDDINGS: Dict[tuple, Any] = {}
+_EMBEDDING_FACTORIES: Dict[tuple, Any] = {} # Fábricas para los workers de ingesta paralela
+_SHARED_RAG: Dict[tuple, Dict[str, Any]] = {}
+_GENERATION = 0 # Se incrementa cada vez que se publica un índice nuevo
+
+
+def _rag_key(persist_directory: str, collection_name: str) -> tuple:
+    return (os.path.abspath(persist_directory), collection_name)
+
+
+def _next_generation() -> int:
+    global _GENERATION
+    _GENERATION += 1
+    return _GENERATION
+
+
+def get_embeddings(model_name: str = EMBEDDING_MODEL_NAME, normalize: bool = True):
+    """
+    Retorna la instancia compartida de HuggingFaceEmbeddings para (modelo, normalización).
+    La primera llamada carga el modelo; las siguientes reutilizan la misma instancia.
+    Si EMBED_CACHE_DIR está definido, el modelo queda envuelto en la caché de embeddings en disco.
+    """
+    key = (model_name, get_device(), normalize)
+    with _REGISTRY_LOCK:
+        embeddings = _SHARED_EMBEDDINGS.get(key)
+        if embeddings is None:
+            from langchain_community.embeddings import HuggingFaceEmbeddings
+            with span("ingest.load_embedding_model", model=model_name):
+                embeddings = HuggingFaceEmbeddings(
+                    model_name=model_name,
+                    model_kwargs={'device': key[1]}, # Usa 'cuda' si está disponible, sino 'cpu'
+                    encode_kwargs={'normalize_embeddings': normalize}
+                )
+            debug(f"Embeddings inicializados con {model_name} en dispositivo: {key[1]}.")
+            if EMBED_CACHE_DIR:
+                embeddings = CachedEmbeddings(embeddings, model_name=model_name, normalize=normalize,
+                                              cache_dir=EMBED_CACHE_DIR, max_entries=EMBED_CACHE_MAX_ENTRIES)
+            _SHARED_EMBEDDINGS[key] = embeddings
+        return embeddings
+
+
+def flush_embedding_caches() -> None:
+    """Persiste los vectores pendientes de las cachés de embeddings del proceso (fin de una ingesta)."""
+    with _REGISTRY_LOCK:
+        instances = list(_SHARED_EMBEDDINGS.values())
+    for embeddings in instances:
+        if isinstance(embeddings, CachedEmbeddings):
+            embeddings.flush()
+
+
+def register_embeddings(embeddings, model_name: str = EMBEDDING_MODEL_NAME, normalize: bool = True,
+                        factory=None) -> None:
+    """
+    Registra una instancia de embeddings propia para (modelo, normalización), que get_embeddings
+    retornará en lugar de cargar el modelo (p. ej. embeddings locales de prueba o de benchmark).
+    'factory' (serializable, sin argumentos) crea una instancia equivalente en cada worker de la
+    ingesta paralela.
+    """
+    with _REGISTRY_LOCK:
+        _SHARED_EMBEDDINGS[(model_name, get_device(), normalize)] = embeddings
+        if factory is not None:
+            _EMBEDDING_FACTORIES[(model_name, get_device(), normalize)] = factory
+
+
+def get_embedding_factory(model_name: str = EMBEDDING_MODEL_NAME, normalize: bool = True):
+    """Fábrica con la que cada worker de ParallelEmbedder crea su propio modelo."""
+    with _REGISTRY_LOCK:
+        factory = _EMBEDDING_FACTORIES.get((model_name, get_device(), normalize))
+    return factory or HuggingFaceEmbeddingsFactory(model_name, normalize=normalize, device=get_device())
+
+
+def create_parallel_embedder(workers: Optional[int] = None,
+                             batch_size: int = EMBED_BATCH_SIZE) -> Optional[ParallelEmbedder]:
+    """
+    Pool de embeddings para la ingesta (None si workers <= 1). Con GPU no se usa: un solo proceso
+    ya la aprovecha y varios modelos no caben en su memoria.
+    """
+    workers = EMBED_WORKERS if workers is None else workers
+    if workers <= 1:
+        return None
+    if get_device() == 'cuda':
+        debug("Ingesta paralela ignorada: los embeddings se calculan en GPU.")
+        return None
+    return ParallelEmbedder(get_embedding_factory(), workers=workers, batch_size=batch_size)
+
+
+def get_shared_rag_resources(persist_directory: str = DEFAULT_PERSIST_DIRECTORY,
+                             collection_name: str = DEFAULT_COLLECTION_NAME) -> Dict[str, Any]:
+    """
+    Retorna los recursos RAG compartidos (vectorstore, retriever, doc_count, generation).
+    Si aún no existen en el proceso, los construye/carga con build_or_load_chroma.
+    Un resultado fallido (retriever None) no se guarda, para reintentar en la próxima llamada.
+    Si otro proceso publicó un snapshot nuevo del índice (ver publish_index_snapshot), se abre
+    y se reemplaza el retriever sin reiniciar; mientras tanto se sigue respondiendo con el anterior.
+    """
+    key = _rag_key(persist_directory, collection_name)
+    resources = _SHARED_RAG.get(key)
+    if resources is not None:
+        directory = resolve_index_directory(persist_directory)
+        if resources.get("directory", directory) == directory:
+            return resources
+        return _hot_swap(key, directory, collection_name, resources)
+
+    with _REGISTRY_LOCK:
+        resources = _SHARED_RAG.get(key)
+        if resources is not None:
+            return resources
+
+        directory = resolve_index_directory(persist_directory)
+        result = build_or_load_chroma(persist_directory=directory, collection_name=collection_name)
+        if result.get("retriever") is not None:
+            result["generation"] = _next_generation()
+            result["directory"] = directory
+            _SHARED_RAG[key] = result
+        return result
+
+
+def invalidate_shared_rag_resources(persist_directory: Optional[str] = None,
+                                    collection_name: str = DEFAULT_COLLECTION_NAME,
+                                    drop_embeddings: bool = False) -> None:
+    """
+    Descarta los recursos RAG compartidos. Sin persist_directory descarta todas las colecciones.
+    La siguiente llamada a get_shared_rag_resources vuelve a abrir el índice.
+    Con drop_embeddings=True también se libera el modelo de embeddings.
+    """
+    with _REGISTRY_LOCK:
+        if persist_directory is None:
+            _SHARED_RAG.clear()
+        else:
+            _SHARED_RAG.pop(_rag_key(persist_directory, collection_name), None)
+        if drop_embeddings:
+            _SHARED_EMBEDDINGS.clear()
+            _EMBEDDING_FACTORIES.clear()
+    debug("Recursos RAG compartidos invalidados.")
+
+
+def reload_shared_rag_resources(docs: Optional[List[Document]] = None,
+                                persist_directory: str = DEFAULT_PERSIST_DIRECTORY,
+                                collection_name: str = DEFAULT_COLLECTION_NAME,
+                                force_rebuild: bool = True,
+                                incremental: bool = False,
+                                snapshot: bool = True) -> Dict[str, Any]:
+    """
+    Reconstruye (o reabre) el índice y publica los nuevos recursos para todas las sesiones.
+    Con incremental=True sincroniza solo los chunks cambiados en lugar de borrar todo; si no, con
+    force_rebuild=True se construye desde cero y con force_rebuild=False solo se reabre el índice vigente.
+    Con snapshot=True (por defecto) la reconstrucción se hace en un snapshot nuevo que se publica
+    solo si pasa la validación: el índice vigente sigue atendiendo durante todo el proceso.
+    Las sesiones existentes toman el nuevo retriever en su siguiente consulta.
+    """
+    key = _rag_key(persist_directory, collection_name)
+    if snapshot and (incremental or force_rebuild):
+        # incremental parte de una copia del snapshot vigente; force_rebuild construye uno vacío
+        return publish_index_snapshot(docs=docs, persist_directory=persist_directory,
+                                      collection_name=collection_name, seed_from_current=incremental)
+    if snapshot:
+        with _REGISTRY_LOCK:
+            _SHARED_RAG.pop(key, None)
+            _POINTER_CACHE.pop(persist_directory, None)
+        return get_shared_rag_resources(persist_directory, collection_name)
+
+    with _REGISTRY_LOCK:
+        _SHARED_RAG.pop(key, None)
+        result = build_or_load_chroma(docs=docs, persist_directory=persist_directory,
+                                      collection_name=collection_name,
+                                      force_rebuild=force_rebuild and not incremental,
+                                      incremental=incremental)
+        if result.get("retriever") is not None:
+            result["generation"] = _next_generation()
+            _SHARED_RAG[key] = result
+        return result
+
+
+# --- SNAPSHOTS VERSIONADOS DEL ÍNDICE ---
+# Una reconstrucción nunca toca el índice en uso: se escribe en <persist_directory>_snapshots/<versión>,
+# se valida (cantidad de documentos y una consulta de prueba) y se publica reemplazando de forma
+# atómica el archivo CURRENT (os.replace). Cada proceso revisa CURRENT como máximo cada
+# SNAPSHOT_POLL_SECONDS y cambia su retriever en caliente. Sin CURRENT se usa persist_directory tal cual.
+SNAPSHOT_POINTER = "CURRENT"
+SNAPSHOT_POLL_SECONDS = float(os.getenv("ECOMARKET_SNAPSHOT_POLL", "2"))
+SNAPSHOTS_TO_KEEP = int(os.getenv("ECOMARKET_SNAPSHOTS_KEEP", "3")) # Incluye el vigente
+SMOKE_QUERY = os.getenv("ECOMARKET_SMOKE_QUERY", "¿Cuál es la política de devoluciones?")
+
+_POINTER_CACHE: Dict[str, tuple] = {} # persist_directory -> (revisado_en, directorio resuelto)
+_SWAP_LOCKS: Dict[tuple, threading.Lock] = {}
+_FAILED_SWAPS: Dict[tuple, str] = {} # Último snapshot que no se pudo abrir por colección (no se reintenta)
+
+
+def snapshots_root(persist_directory: str) -> str:
+    return os.path.normpath(persist_directory) + "_snapshots"
+
+
+def current_snapshot(persist_directory: str) -> Optional[str]:
+    """Nombre del snapshot publicado (contenido de CURRENT) o None si no hay snapshots."""
+    try:
+        with open(os.path.join(snapshots_root(persist_directory), SNAPSHOT_POINTER), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def resolve_index_directory(persist_directory: str, max_age: float = SNAPSHOT_POLL_SECONDS) -> str:
+    """Directorio real del índice: el snapshot publicado o, sin snapshots, persist_directory."""
+    now = time.monotonic()
+    cached = _POINTER_CACHE.get(persist_directory)
+    if cached is not None and now - cached[0] < max_age:
+        return cached[1]
+    version = current_snapshot(persist_directory)
+    directory = os.path.join(snapshots_root(persist_directory), version) if version else persist_directory
+    _POINTER_CACHE[persist_directory] = (now, directory)
+    return directory
+
+
+def _hot_swap(key: tuple, directory: str, collection_name: str, current: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Abre el snapshot nuevo y lo publica en el registro. Un solo hilo lo abre; los demás siguen con el actual.
+    Solo abre (load_only): si el directorio falta o no pasa validate_index, se sigue con el índice
+    actual y ese snapshot no se vuelve a intentar hasta que CURRENT apunte a otro.
+    """
+    if _FAILED_SWAPS.get(key) == directory:
+        return current
+    with _REGISTRY_LOCK:
+        lock = _SWAP_LOCKS.setdefault(key, threading.Lock())
+    if not lock.acquire(blocking=False):
+        return current
+    try:
+        with span("index.hot_swap"):
+            if os.path.isdir(directory):
+                result = build_or_load_chroma(persist_directory=directory, collection_name=collection_name,
+                                              load_only=True)
+                problem = validate_index(result)
+            else:
+                result, problem = {}, "el directorio no existe"
+        if problem:
+            error(f"No se pudo abrir el snapshot {directory} ({problem}); se sigue usando {current.get('directory')}.")
+            _FAILED_SWAPS[key] = directory
+            return current
+        result["generation"] = _next_generation()
+        result["directory"] = directory
+        with _REGISTRY_LOCK:
+            _SHARED_RAG[key] = result
+        debug(f"Índice RAG cambiado en caliente a {directory} ({result.get('doc_count', 0)} documentos).")
+        return result
+    finally:
+        lock.release()
+
+
+def validate_index(result: Dict[str, Any], min_docs: int = 1, smoke_query: str = SMOKE_QUERY) -> Optional[str]:
+    """Retorna None si el índice es utilizable, o el motivo por el que no lo es."""
+    if result.get("retriever") is None:
+        return "la construcción no produjo un retriever"
+    if result.get("doc_count", 0) < min_docs:
+        return f"tiene {result.get('doc_count', 0)} documentos (mínimo {min_docs})"
+    try:
+        docs = result["retriever"].invoke(smoke_query)
+    except Exception as e:
+        return f"la consulta de prueba falló: {e}"
+    if not docs:
+        return "la consulta de prueba no devolvió documentos"
+    return None
+
+
+def _write_pointer(persist_directory: str, version: str) -> None:
+    path = os.path.join(snapshots_root(persist_directory), SNAPSHOT_POINTER)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path) # Atómico: los lectores ven la versión anterior o la nueva, nunca una a medias
+
+
+def gc_snapshots(persist_directory: str, keep: int = SNAPSHOTS_TO_KEEP) -> List[str]:
+    """
+    Borra los snapshots más antiguos y conserva los 'keep' más recientes (siempre el vigente).
+    Conservar al menos 2 deja a los procesos que aún no cambiaron de versión con su índice.
+    """
+    root = snapshots_root(persist_directory)
+    if not os.path.isdir(root):
+        return []
+    current = current_snapshot(persist_directory)
+    versions = sorted((d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d))), reverse=True)
+    removed = []
+    for version in versions[max(1, keep):]:
+        if version == current:
+            continue
+        shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+        removed.append(version)
+    if removed:
+        debug(f"Snapshots antiguos eliminados: {', '.join(removed)}.")
+    return removed
+
+
+def publish_index_snapshot(docs: Optional[List[Document]] = None,
+                           persist_directory: str = DEFAULT_PERSIST_DIRECTORY,
+                           collection_name: str = DEFAULT_COLLECTION_NAME,
+                           seed_from_current: bool = True,
+                           streaming: bool = False,
+                           embed_workers: Optional[int] = None,
+                           min_docs: int = 1,
+                           smoke_query: str = SMOKE_QUERY,
+                           keep: int = SNAPSHOTS_TO_KEEP) -> Dict[str, Any]:
+    """
+    Construye el índice en un snapshot nuevo, lo valida y lo publica de forma atómica.
+    Con seed_from_current=True el snapshot parte de una copia del snapshot publicado en CURRENT
+    (inmutable; nunca del directorio legado, que puede estar en uso) y solo se embeben los chunks
+    cambiados (modo incremental); si no, o si aún no hay snapshots, se construye desde cero.
+    Si la validación falla, el snapshot se descarta y el índice vigente no cambia.
+    Retorna el resultado de build_or_load_chroma con 'published', 'snapshot' y, si falló, 'error'.
+    """
+    root = snapshots_root(persist_directory)
+    os.makedirs(root, exist_ok=True)
+    version = time.strftime("%Y%m%d-%H%M%S") + f"-{os.urandom(3).hex()}" # Ordenable por fecha
+    target = os.path.join(root, version)
+    current = current_snapshot(persist_directory)
+    source = os.path.join(root, current) if current else None
+
+    with span("index.snapshot_build", snapshot=version):
+        if seed_from_current and source and os.path.isdir(source):
+            shutil.copytree(source, target)
+            debug(f"Snapshot {version} creado a partir de {source}.")
+        elif seed_from_current:
+            debug(f"Sin snapshot publicado para copiar: el snapshot {version} se construye desde cero.")
+        result = build_or_load_chroma(docs=docs, persist_directory=target, collection_name=collection_name,
+                                      incremental=seed_from_current and not streaming,
+                                      embed_workers=embed_workers, streaming=streaming)
+
+    problem = validate_index(result, min_docs=min_docs, smoke_query=smoke_query)
+    if problem:
+        error(f"Snapshot {version} descartado: {problem}. Se mantiene el índice vigente.")
+        shutil.rmtree(target, ignore_errors=True)
+        return dict(result, published=False, snapshot=version, error=problem)
+
+    _write_pointer(persist_directory, version)
+    _POINTER_CACHE.pop(persist_directory, None)
+    # Este proceso usa el snapshot nuevo de inmediato; los demás lo detectan al revisar CURRENT
+    result["generation"] = _next_generation()
+    result["directory"] = target
+    with _REGISTRY_LOCK:
+        _SHARED_RAG[_rag_key(persist_directory, collection_name)] = result
+    debug(f"Snapshot {version} publicado con {result.get('doc_count', 0)} documentos.")
+    gc_snapshots(persist_directory, keep=keep)
+    return dict(result, published=True, snapshot=version)
+
+
+# --- CALENTAMIENTO EN SEGUNDO PLANO ---
+# El modelo de embeddings y el índice se cargan en un hilo aparte: la interfaz y las herramientas
+# que no usan RAG responden desde el primer momento. rag_status() no toma _REGISTRY_LOCK
+# (retenido durante toda la carga), así que consultarlo nunca bloquea.
+RAG_IDLE = "idle"
+RAG_WARMING_UP = "warming_up"
+RAG_READY = "ready"
+RAG_FAILED = "failed"
+
+_WARMUP_LOCK = threading.Lock()
+_WARMUP_STATUS: Dict[tuple, str] = {}
+
+
+def _warm_up(persist_directory: str, collection_name: str) -> None:
+    key = _rag_key(persist_directory, collection_name)
+    status = RAG_FAILED
+    try:
+        with span("rag.warmup"):
+            result = get_shared_rag_resources(persist_directory=persist_directory, collection_name=collection_name)
+            if result.get("retriever") is not None:
+                get_answer_cache()
+                status = RAG_READY
+                debug(f"RAG listo en segundo plano ({result.get('doc_count', 0)} documentos).")
+            else:
+                error("El calentamiento del RAG terminó sin retriever.")
+    except Exception as e:
+        error(f"Falló el calentamiento del RAG: {e}")
+    with _WARMUP_LOCK:
+        _WARMUP_STATUS[key] = status
+
+
+def start_rag_warmup(persist_directory: str = DEFAULT_PERSIST_DIRECTORY,
+                     collection_name: str = DEFAULT_COLLECTION_NAME) -> str:
+    """
+    Inicia (una sola vez por índice) la carga del modelo de embeddings, Chroma, el retriever y la
+    caché de respuestas en un hilo daemon. Si un intento anterior falló, lo reintenta.
+    Retorna el estado vigente (ver rag_status).
+    """
+    key = _rag_key(persist_directory, collection_name)
+    with _WARMUP_LOCK:
+        if key in _SHARED_RAG:
+            _WARMUP_STATUS.setdefault(key, RAG_READY)
+        status = _WARMUP_STATUS.get(key)
+        if status in (RAG_WARMING_UP, RAG_READY):
+            return status
+        _WARMUP_STATUS[key] = RAG_WARMING_UP
+    threading.Thread(target=_warm_up, args=(persist_directory, collection_name),
+                     name="rag-warmup", daemon=True).start()
+    return RAG_WARMING_UP
+
+
+def rag_status(persist_directory: str = DEFAULT_PERSIST_DIRECTORY,
+               collection_name: str = DEFAULT_COLLECTION_NAME) -> str:
+    """Estado del RAG para el índice: 'idle', 'warming_up', 'ready' o 'failed'. Nunca bloquea."""
+    key = _rag_key(persist_directory, collection_name)
+    status = _WARMUP_STATUS.get(key)
+    if status is not None:
+        return status
+    return RAG_READY if key in _SHARED_RAG else RAG_IDLE
+
+# ------------------------------------------------------------------
+
 # --- FUNCIÓN DE TRANSFORMACIÓN PARA EL JSON DE FAQ ---
-def transform_faq_docs(raw_data: List[Dict[str, str]], source_file: str) -> List[Document]:
+def transform_faq_docs(raw_data: List[Dict[str, Any]], source_file: str) -> List[Document]:
     """Combina pregunta/respuesta en el contenido a partir de la lista de diccionarios JSON."""
     transformed_docs = []
     for data in raw_data:
@@ -57,260 +515,890 @@ def transform_faq_docs(raw_data: List[Dict[str, str]], source_file: str) -> List
                 page_content=new_content,
                 metadata={
                     'source': source_file,
-                    'type': 'FAQ'
+                    'type': 'FAQ',
+                    # Se conservan id/categoría/keywords (Chroma solo admite escalares en metadata)
+                    'faq_id': str(data.get("id", "")),
+                    'category': data.get("category", ""),
+                    'keywords': ", ".join(k for k in data.get("keywords", []) if isinstance(k, str)),
                 }
             )
             transformed_docs.append(new_doc)
         except Exception as e:
             # En caso de error en la estructura de un ítem, lo ignoramos y avisamos
-            print(f"ERROR al transformar ítem FAQ: {e}. Ítem: {data}")
+            error(f"Falló la transformación de un ítem FAQ: {e}. Ítem: {data}")
     return transformed_docs
 
 # --- FUNCIÓN DE CARGA CUSTOMIZADA PARA FAQ JSON ---
+@traced("ingest.load_faq")
 def load_faq_json_custom(file_path: str) -> List[Document]:
-    """Carga y transforma FAQ JSON usando Python nativo, asumiendo formato JSON Lines o múltiples objetos."""
+    """Carga y transforma FAQ JSON usando Python nativo (array JSON, JSON Lines o múltiples objetos)."""
     file_name = os.path.basename(file_path)
-    all_faq_items = []
     
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            
-            # 1. Intentamos leer línea por línea (JSON Lines), que es robusto para el error "Extra data".
-            for i, line in enumerate(f):
-                stripped_line = line.strip()
-                if not stripped_line:
-                    continue
-                
-                try:
-                    item = json.loads(stripped_line)
-                    # Si el archivo tiene un array de objetos FAQ por línea, extendemos la lista
-                    if isinstance(item, list):
-                        all_faq_items.extend(item)
-                    # Si es un objeto individual FAQ (JSON Lines), lo añadimos
-                    elif isinstance(item, dict):
-                        all_faq_items.append(item)
-                    
-                except json.JSONDecodeError:
-                    # Si falla, la línea no es JSON válido, la ignoramos.
-                    pass 
-        
-        # 2. Si la lectura línea por línea no arrojó resultados, intentamos una carga completa del archivo.
-        if not all_faq_items:
-             with open(file_path, 'r', encoding='utf-8') as f_full:
-                 f_content = f_full.read().strip()
-                 if f_content:
-                      # Intentamos cargar el contenido completo
-                      data_full = json.loads(f_content)
-                      if isinstance(data_full, list):
-                          all_faq_items.extend(data_full)
-                      elif isinstance(data_full, dict):
-                          all_faq_items.append(data_full)
+        all_faq_items = read_faq_items(file_path)
 
         if all_faq_items:
             transformed_docs = transform_faq_docs(all_faq_items, file_name)
             # Imprimimos el total de documentos de FAQ cargados (debería ser > 0)
-            print(f"DEBUG: {len(transformed_docs)} documentos cargados y transformados de {file_name}.")
+            debug(f"{len(transformed_docs)} documentos cargados y transformados de {file_name}.")
             return transformed_docs
         else:
-            print(f"ERROR: No se pudo extraer ningún dato JSON de {file_name}. ¿Archivo vacío o formato incorrecto?")
+            error(f"No se pudo extraer ningún dato JSON de {file_name}. ¿Archivo vacío o formato incorrecto?")
             return []
             
     except Exception as e:
-        print(f"ERROR CRÍTICO: Falló la carga manual de FAQ JSON en {file_name}: {e}")
+        critical(f"Falló la carga manual de FAQ JSON en {file_name}: {e}")
         return []
 # ------------------------------------------------------------------
 
 
+@traced("ingest.download")
 def download_file_from_github(raw_url: str, local_filename: str, timeout: int = 60) -> str:
     """
     Descarga un archivo remoto. Retorna el nombre del archivo local (con ruta) si es exitoso, o None si falla.
+    Usa GET condicional: si el archivo no cambió en el servidor se conserva la copia local.
     """
     if not os.path.exists(DOWNLOAD_DIR):
         os.makedirs(DOWNLOAD_DIR)
-        print(f"DEBUG: Carpeta de descarga '{DOWNLOAD_DIR}' creada.")
+        debug(f"Carpeta de descarga '{DOWNLOAD_DIR}' creada.")
 
     local_path = os.path.join(DOWNLOAD_DIR, local_filename)
     
-    print(f"DEBUG: Intentando descargar: {raw_url} a {local_path}")
+    debug(f"Intentando descargar: {raw_url} a {local_path}")
     corrected = raw_url.replace("/refs/heads/main/", "/main/")
-    
-    max_retries = 3
-    for attempt in range(max_retries):
-        try:
-            resp = requests.get(corrected, stream=True, timeout=timeout)
-            resp.raise_for_status() # Lanza HTTPError si el código de estado es 4xx o 5xx
-            with open(local_path, "wb") as f:
-                for chunk in resp.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-            print(f"DEBUG: Descarga exitosa de {local_path}")
-            return local_path
-        except requests.exceptions.RequestException as e:
-            print(f"ERROR: Falló la descarga de {raw_url} (Intento {attempt + 1}/{max_retries}): {e}")
-            if hasattr(resp, 'status_code') and resp.status_code == 404:
-                 print("ERROR: Archivo no encontrado (404). Se omite.")
-                 return None
-            if attempt < max_retries - 1:
-                time.sleep(2)
-            else:
-                return None
-    return None
+
+    metadata = load_fetch_metadata(DOWNLOAD_DIR)
+    with create_pooled_session(pool_size=1) as session:
+        result, meta = fetch_file(session, corrected, local_path, previous=metadata.get(local_filename),
+                                  timeout=timeout, name=local_filename)
+    if update_fetch_metadata(metadata, local_filename, result, meta):
+        save_fetch_metadata(DOWNLOAD_DIR, metadata)
+    return result.local_path
+
+
+# --- CACHÉ DE DOCUMENTOS PARSEADOS ---
+# Cuando un archivo vuelve como 304 se reutilizan sus Documents ya parseados en lugar de re-leer el PDF.
+PARSED_CACHE_DIR = os.path.join(DOWNLOAD_DIR, ".parsed")
+
+
+def _parsed_cache_path(local_name: str) -> str:
+    return os.path.join(PARSED_CACHE_DIR, local_name + ".json")
+
+
+def _load_parsed_docs(local_name: str) -> Optional[List[Document]]:
+    path = _parsed_cache_path(local_name)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            items = json.load(f)
+        return [Document(page_content=item["page_content"], metadata=item["metadata"]) for item in items]
+    except Exception as e:
+        error(f"Caché de parseo ilegible para {local_name}: {e}")
+        return None
+
+
+def _save_parsed_docs(local_name: str, docs: List[Document]) -> None:
+    os.makedirs(PARSED_CACHE_DIR, exist_ok=True)
+    path = _parsed_cache_path(local_name)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump([{"page_content": d.page_content, "metadata": d.metadata} for d in docs], f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+@traced("ingest.load_pdf")
+def _load_pdf(file_path: str) -> List[Document]:
+    from langchain_community.document_loaders.pdf import PyPDFLoader
+    return PyPDFLoader(file_path=file_path).load()
 
 
-def load_remote_documents(base_url: str = GITHUB_RAW_URL) -> List[Document]:
+# Archivos fuente del RAG y su función de carga
+REMOTE_SOURCES = [
+    ("Politica_de_Devoluciones_EcoMarket.pdf", _load_pdf),
+    ("Terminos_y_Condiciones_Generales_de_Venta_EcoMarket.pdf", _load_pdf),
+    ("Manual_de_Uso_Productos_Ecologicos.pdf", _load_pdf),
+    # JSON de FAQ con lógica customizada (para evitar dependencias)
+    ("faq_ecomarket.json", load_faq_json_custom),
+]
+
+
+def load_remote_documents(base_url: str = GITHUB_RAW_URL, max_workers: int = 4,
+                          session=None) -> List[Document]:
     """
     Descarga y carga los documentos definidos en el repositorio.
+    Las descargas se hacen en paralelo y de forma condicional (ETag/Last-Modified);
+    los archivos sin cambios (304) reutilizan los Documents parseados en la ejecución anterior.
     Retorna lista de Document (langchain.schema.Document)
     """
     docs: List[Document] = []
-    
-    # Definición de archivos a cargar con Loader de LangChain
-    files_to_load_lc = [
-        ("Politica_de_Devoluciones_EcoMarket.pdf", "Politica_de_Devoluciones_EcoMarket.pdf", PyPDFLoader, {}),
-        ("Terminos_y_Condiciones_Generales_de_Venta_EcoMarket.pdf", "Terminos_y_Condiciones_Generales_de_Venta_EcoMarket.pdf", PyPDFLoader, {}),
-        ("Manual_de_Uso_Productos_Ecologicos.pdf", "Manual_de_Uso_Productos_Ecologicos.pdf", PyPDFLoader, {}),
-    ]
-    
-    # Archivos a cargar con lógica customizada (para evitar dependencias)
-    files_to_load_custom = [
-        ("faq_ecomarket.json", "faq_ecomarket.json", load_faq_json_custom),
-    ]
-
-    # 1. Cargar documentos con LangChain Loaders
-    for remote_name, local_name, Loader, loader_args in files_to_load_lc:
-        downloaded_path = download_file_from_github(base_url + remote_name, local_name)
-        
-        if downloaded_path:
+    base_url = base_url.replace("/refs/heads/main/", "/main/")
+
+    with span("ingest.download_all", files=len(REMOTE_SOURCES)):
+        results = fetch_documents(base_url, [name for name, _ in REMOTE_SOURCES], DOWNLOAD_DIR,
+                                  session=session, max_workers=max_workers)
+
+    for local_name, loader_func in REMOTE_SOURCES:
+        result = results.get(local_name)
+        if result is None or not result.local_path:
+            continue
+
+        loaded_docs = None if result.changed else _load_parsed_docs(local_name)
+        if loaded_docs is not None:
+            debug(f"{local_name} sin cambios ({result.status}); {len(loaded_docs)} documentos desde caché.")
+            PARSED_CACHE_HITS.inc()
+        else:
             try:
-                loader = Loader(file_path=downloaded_path, **loader_args)
-                loaded_docs = loader.load()
-                docs.extend(loaded_docs)
-                print(f"DEBUG: {len(loaded_docs)} documentos cargados de {local_name}.")
+                loaded_docs = loader_func(result.local_path)
             except Exception as e:
-                print(f"ERROR: Falló la carga de {local_name} con {Loader.__name__}: {e}")
-                
-    # 2. Cargar documentos con lógica Customizada (JSON FAQ)
-    for remote_name, local_name, custom_loader_func in files_to_load_custom:
-        downloaded_path = download_file_from_github(base_url + remote_name, local_name)
-        
-        if downloaded_path:
-            loaded_docs = custom_loader_func(downloaded_path)
-            docs.extend(loaded_docs)
+                error(f"Falló la carga de {local_name} con {loader_func.__name__}: {e}")
+                continue
+            debug(f"{len(loaded_docs)} documentos cargados de {local_name}.")
+            if loaded_docs:
+                _save_parsed_docs(local_name, loaded_docs)
+        docs.extend(loaded_docs)
                 
     return docs
 
 
+# --- MÉTRICAS DE INGESTA Y CONSULTA ---
+PARSED_CACHE_HITS = REGISTRY.counter("ecomarket_parsed_cache_hits_total",
+                                     "Archivos sin cambios cuyos Documents se tomaron de la caché de parseo.")
+INGEST_CHUNKS = REGISTRY.counter("ecomarket_ingest_chunks_total",
+                                 "Chunks procesados por la indexación, por operación.", ("op",))
+RAG_QUERIES = REGISTRY.counter("ecomarket_rag_queries_total",
+                               "Consultas al RAG, por resultado.", ("outcome",))
+
+
+# --- RETRIEVER (HÍBRIDO BM25 + DENSO) ---
+HYBRID_RETRIEVAL = os.getenv("ECOMARKET_HYBRID_RETRIEVAL", "1") != "0"
+RETRIEVER_MAX_K = 5
+
+
+@traced("index.make_retriever")
+def make_retriever(vectordb):
+    """
+    Retriever híbrido (BM25 + denso con RRF y k adaptativo) sobre la colección.
+    El índice BM25 se construye con los mismos chunks guardados en Chroma.
+    Si falla (o está deshabilitado) se usa el retriever denso de siempre.
+    """
+    if HYBRID_RETRIEVAL:
+        try:
+            bm25 = BM25Index.from_chroma(vectordb)
+            debug(f"Índice BM25 construido con {len(bm25)} chunks.")
+            return HybridRetriever(vectorstore=vectordb, bm25=bm25, max_k=RETRIEVER_MAX_K)
+        except Exception as e:
+            error(f"No se pudo construir el índice BM25 ({e}). Se usa solo búsqueda densa.")
+    return vectordb.as_retriever(search_kwargs={"k": RETRIEVER_MAX_K})
+
+
+# --- INDEXACIÓN INCREMENTAL (MANIFIESTO DE HASHES) ---
+MANIFEST_FILENAME = "index_manifest.json"
+CHROMA_BATCH_SIZE = 256 # Tamaño de lote para upsert/delete en Chroma
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def split_documents(docs: List[Document]) -> List[Document]:
+    """
+    Aplica el split selectivo: los PDFs se dividen en chunks y el JSON transformado (FAQ) se mantiene entero.
+    """
+    docs_to_split = []
+    docs_no_split = []
+
+    for doc in docs:
+        source = doc.metadata.get('source', '')
+        # Separamos PDFs para división; el JSON transformado no necesita división.
+        if source.lower().endswith(('.pdf')): 
+            docs_to_split.append(doc)
+        else:
+            docs_no_split.append(doc)
+
+    debug(f"Documentos largos (PDFs) a dividir: {len(docs_to_split)}")
+    debug(f"Documentos estructurados (JSON) sin dividir: {len(docs_no_split)}")
+
+    # Segmentación de Texto solo para los documentos largos
+    # add_start_index permite luego fusionar chunks vecinos en el orden real del documento
+    with span("ingest.split", documents=len(docs_to_split)) as s:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, add_start_index=True)
+        pdf_chunks = splitter.split_documents(docs_to_split)
+        s.set(chunks=len(pdf_chunks))
+
+    # Unificación de los Chunks Finales
+    return docs_no_split + pdf_chunks
+
+
+def chunk_ids_for(chunks: List[Document]) -> List[str]:
+    """
+    IDs deterministas por contenido: hash de (source, página, texto). Un chunk que no cambia
+    conserva su ID entre ejecuciones; los textos repetidos dentro de una fuente se numeran.
+    """
+    ids = []
+    seen: Dict[str, int] = {}
+    for chunk in chunks:
+        base = _sha256(f"{chunk.metadata.get('source', '')}|{chunk.metadata.get('page', '')}|{chunk.page_content}")[:32]
+        n = seen.get(base, 0)
+        seen[base] = n + 1
+        ids.append(base if n == 0 else f"{base}-{n}")
+    return ids
+
+
+def _load_manifest(persist_directory: str) -> Dict[str, Any]:
+    path = os.path.join(persist_directory, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        error(f"Manifiesto de índice ilegible ({e}). Se reindexará todo.")
+        return {}
+
+
+def _save_manifest(persist_directory: str, manifest: Dict[str, Any]) -> None:
+    os.makedirs(persist_directory, exist_ok=True)
+    path = os.path.join(persist_directory, MANIFEST_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path) # Escritura atómica: nunca queda un manifiesto a medias
+
+
+def manifest_version(manifest: Dict[str, Any]) -> str:
+    """Huella corta del contenido indexado; cambia cuando cambia cualquier chunk."""
+    files = manifest.get("files", {})
+    return _sha256(json.dumps({k: v.get("sha256") for k, v in sorted(files.items())}))[:16]
+
+
+def _upsert_parallel(vectordb, chunks: List[Document], ids: List[str], embedder: ParallelEmbedder) -> None:
+    """
+    Embebe los chunks en el pool de procesos y los escribe en Chroma en lotes de CHROMA_BATCH_SIZE
+    a medida que llegan los vectores (en orden), sin esperar a que termine todo el corpus.
+    """
+    collection = vectordb._collection
+    written = 0
+    ready: List[np.ndarray] = []
+    for start, vectors in embedder.imap([c.page_content for c in chunks]):
+        ready.append(vectors)
+        end = start + len(vectors)
+        if end - written < CHROMA_BATCH_SIZE and end < len(chunks):
+            continue
+        batch = chunks[written:end]
+        collection.upsert(
+            ids=ids[written:end],
+            embeddings=np.vstack(ready).tolist(),
+            metadatas=[c.metadata for c in batch],
+            documents=[c.page_content for c in batch],
+        )
+        written = end
+        ready = []
+
+
+def sync_chroma_incremental(vectordb, docs: List[Document], persist_directory: str,
+                            embedder: Optional[ParallelEmbedder] = None) -> Dict[str, int]:
+    """
+    Sincroniza la colección con los documentos usando el manifiesto de hashes:
+    solo se embeben los chunks nuevos o modificados, y se borran los de contenido eliminado.
+    Con 'embedder' los embeddings se calculan en su pool de procesos (ingesta paralela).
+    Retorna contadores {added, deleted, unchanged, doc_count, index_version}.
+    """
+    manifest = _load_manifest(persist_directory)
+    old_files: Dict[str, Any] = manifest.get("files", {})
+
+    # Sin manifiesto no sabemos qué IDs tiene la colección: la vaciamos para no dejar huérfanos.
+    if not old_files:
+        existing_ids = vectordb.get(include=[])["ids"]
+        for i in range(0, len(existing_ids), CHROMA_BATCH_SIZE):
+            vectordb.delete(ids=existing_ids[i:i + CHROMA_BATCH_SIZE])
+
+    # Agrupar documentos por fuente (preservando el orden)
+    by_source: Dict[str, List[Document]] = {}
+    for doc in docs:
+        by_source.setdefault(doc.metadata.get('source', ''), []).append(doc)
+
+    new_files: Dict[str, Any] = {}
+    to_add: List[Document] = []
+    to_add_ids: List[str] = []
+    to_delete: List[str] = []
+    unchanged = 0
+
+    for source, source_docs in by_source.items():
+        file_hash = _sha256("\x00".join(d.page_content for d in source_docs))
+        previous = old_files.get(source)
+
+        # Fuente sin cambios: no hace falta ni dividirla
+        if previous and previous.get("sha256") == file_hash:
+            new_files[source] = previous
+            unchanged += len(previous.get("chunks", []))
+            continue
+
+        chunks = split_documents(source_docs)
+        ids = chunk_ids_for(chunks)
+        old_ids = set(previous.get("chunks", [])) if previous else set()
+        new_ids = set(ids)
+
+        for chunk, chunk_id in zip(chunks, ids):
+            if chunk_id in old_ids:
+                unchanged += 1
+            else:
+                to_add.append(chunk)
+                to_add_ids.append(chunk_id)
+        to_delete.extend(old_ids - new_ids)
+        new_files[source] = {"sha256": file_hash, "chunks": ids}
+
+    # Fuentes que ya no existen: se eliminan todos sus chunks
+    for source, previous in old_files.items():
+        if source not in by_source:
+            to_delete.extend(previous.get("chunks", []))
+
+    with span("ingest.delete", chunks=len(to_delete)):
+        for i in range(0, len(to_delete), CHROMA_BATCH_SIZE):
+            vectordb.delete(ids=to_delete[i:i + CHROMA_BATCH_SIZE])
+    # Embeddings + escritura en Chroma (equivale a Chroma.from_documents, por lotes)
+    with span("ingest.embed_upsert", chunks=len(to_add), workers=embedder.workers if embedder else 1):
+        if embedder is not None and to_add:
+            _upsert_parallel(vectordb, to_add, to_add_ids, embedder)
+        else:
+            for i in range(0, len(to_add), CHROMA_BATCH_SIZE):
+                # add_documents hace upsert en Chroma cuando se pasan IDs explícitos
+                vectordb.add_documents(documents=to_add[i:i + CHROMA_BATCH_SIZE], ids=to_add_ids[i:i + CHROMA_BATCH_SIZE])
+    INGEST_CHUNKS.inc(len(to_add), op="added")
+    INGEST_CHUNKS.inc(len(to_delete), op="deleted")
+    INGEST_CHUNKS.inc(unchanged, op="unchanged")
+
+    new_manifest = {"embedding_model": EMBEDDING_MODEL_NAME, "files": new_files}
+    _save_manifest(persist_directory, new_manifest)
+    doc_count = sum(len(f.get("chunks", [])) for f in new_files.values())
+    debug(f"Indexación incremental: {len(to_add)} chunks nuevos/modificados, "
+          f"{len(to_delete)} eliminados, {unchanged} sin cambios.")
+    return {"added": len(to_add), "deleted": len(to_delete), "unchanged": unchanged,
+            "doc_count": doc_count, "index_version": manifest_version(new_manifest)}
+# ------------------------------------------------------------------
+
+
+# --- INGESTA EN STREAMING (MEMORIA ACOTADA Y REANUDABLE) ---
+# En lugar de cargar todos los Documents y todos los chunks a la vez, cada archivo se procesa como
+# un flujo: páginas (PyPDFLoader.lazy_load) -> chunks -> lotes de tamaño fijo embebidos y escritos
+# en Chroma. Tras cada lote se guarda un checkpoint; una ingesta interrumpida continúa desde el
+# último lote escrito. El resultado es el mismo manifiesto (y los mismos IDs) que el modo incremental.
+CHECKPOINT_FILENAME = "ingest_checkpoint.json"
+STREAM_BATCH_SIZE = int(os.getenv("ECOMARKET_STREAM_BATCH", str(CHROMA_BATCH_SIZE)))
+
+
+def _source_key(path: str) -> str:
+    """Valor de metadata['source'] que produce el loader del archivo (ver REMOTE_SOURCES)."""
+    return os.path.basename(path) if path.lower().endswith(".json") else path
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_source_documents(path: str) -> Iterator[Document]:
+    """Documents de un archivo fuente, de a uno: páginas de un PDF o ítems de la FAQ JSON."""
+    if path.lower().endswith(".pdf"):
+        from langchain_community.document_loaders.pdf import PyPDFLoader
+        yield from PyPDFLoader(file_path=path).lazy_load()
+    elif path.lower().endswith(".json"):
+        yield from load_faq_json_custom(path)
+    else:
+        warning(f"Archivo sin loader para la ingesta en streaming: {path}")
+
+
+def iter_chunks(docs: Iterator[Document], splitter=None) -> Iterator[Document]:
+    """Split selectivo en flujo (mismo criterio que split_documents): PDFs en chunks, FAQ entera."""
+    if splitter is None:
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, add_start_index=True)
+    for doc in docs:
+        if doc.metadata.get('source', '').lower().endswith('.pdf'):
+            yield from splitter.split_documents([doc])
+        else:
+            yield doc
+
+
+def _chunk_id(chunk: Document, seen: Dict[str, int]) -> str:
+    # Mismo esquema que chunk_ids_for, calculado chunk a chunk dentro de una fuente
+    base = _sha256(f"{chunk.metadata.get('source', '')}|{chunk.metadata.get('page', '')}|{chunk.page_content}")[:32]
+    n = seen.get(base, 0)
+    seen[base] = n + 1
+    return base if n == 0 else f"{base}-{n}"
+
+
+def _load_checkpoint(persist_directory: str) -> Dict[str, Any]:
+    path = os.path.join(persist_directory, CHECKPOINT_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        error(f"Checkpoint de ingesta ilegible ({e}). Se empieza desde cero.")
+        return {}
+
+
+def _save_checkpoint(persist_directory: str, checkpoint: Dict[str, Any]) -> None:
+    path = os.path.join(persist_directory, CHECKPOINT_FILENAME)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _write_batch(vectordb, chunks: List[Document], ids: List[str], embedder: Optional[ParallelEmbedder]) -> None:
+    with span("ingest.embed_upsert", chunks=len(chunks), workers=embedder.workers if embedder else 1):
+        if embedder is not None:
+            _upsert_parallel(vectordb, chunks, ids, embedder)
+        else:
+            vectordb.add_documents(documents=chunks, ids=ids)
+    INGEST_CHUNKS.inc(len(chunks), op="added")
+
+
+def stream_ingest(paths: List[str], persist_directory: str = DEFAULT_PERSIST_DIRECTORY,
+                  collection_name: str = DEFAULT_COLLECTION_NAME, batch_size: int = STREAM_BATCH_SIZE,
+                  embed_workers: Optional[int] = None, resume: bool = True) -> Dict[str, Any]:
+    """
+    Indexa los archivos de 'paths' (PDF o FAQ JSON) con memoria acotada: en memoria solo hay una
+    página y un lote de a lo sumo batch_size chunks. Un archivo sin cambios (mismo hash de bytes)
+    se salta sin leerlo, y los chunks que ya estaban en el índice no se vuelven a embeber.
+    Con resume=True retoma el checkpoint de una ingesta interrumpida; los chunks que esa ingesta ya
+    había escrito se informan aparte en 'resumed' (no se vuelven a contar como added/unchanged).
+    Retorna contadores {added, deleted, unchanged, resumed, skipped_files, doc_count, index_version}.
+    """
+    os.makedirs(persist_directory, exist_ok=True)
+    vectordb = _chroma_class()(persist_directory=persist_directory, collection_name=collection_name,
+                               embedding_function=get_embeddings())
+    old_files: Dict[str, Any] = _load_manifest(persist_directory).get("files", {})
+    checkpoint = _load_checkpoint(persist_directory) if resume else {}
+    done: Dict[str, Any] = checkpoint.get("files", {}) # Fuentes terminadas en esta ingesta
+    progress: Dict[str, Any] = checkpoint.get("progress", {}) # Fuente a medio escribir
+    if done or progress:
+        debug(f"Reanudando ingesta: {len(done)} archivos completos, {len(progress)} a medias.")
+
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, add_start_index=True)
+    stats = {"added": 0, "deleted": 0, "unchanged": 0, "resumed": 0, "skipped_files": 0}
+    embedder = create_parallel_embedder(embed_workers)
+    try:
+        for path in paths:
+            key = _source_key(path)
+            file_sha = _file_sha256(path)
+            previous = done.get(key) or old_files.get(key)
+            if previous and previous.get("file_sha256") == file_sha and key not in progress:
+                done[key] = previous
+                stats["skipped_files"] += 1
+                if old_files.get(key, {}).get("file_sha256") == file_sha:
+                    stats["unchanged"] += len(previous.get("chunks", []))
+                else:
+                    stats["resumed"] += len(previous.get("chunks", [])) # Terminado antes de la interrupción
+                continue
+
+            partial = progress.get(key, {})
+            already_written = partial.get("written", 0) if partial.get("file_sha256") == file_sha else 0
+            stats["resumed"] += already_written
+            old_ids = set(old_files.get(key, {}).get("chunks", []))
+            content_hash = hashlib.sha256()
+            ids: List[str] = []
+            seen: Dict[str, int] = {}
+            batch: List[Document] = []
+            batch_ids: List[str] = []
+
+            def flush() -> None:
+                if batch:
+                    _write_batch(vectordb, batch, batch_ids, embedder)
+                    stats["added"] += len(batch)
+                    batch.clear()
+                    batch_ids.clear()
+                progress[key] = {"file_sha256": file_sha, "written": len(ids)}
+                _save_checkpoint(persist_directory, {"files": done, "progress": progress})
+
+            with span("ingest.stream_file", source=key):
+                first = True
+                for page in iter_source_documents(path):
+                    # Mismo hash de contenido que sync_chroma_incremental ("\x00".join de las páginas)
+                    if not first:
+                        content_hash.update(b"\x00")
+                    content_hash.update(page.page_content.encode("utf-8"))
+                    first = False
+                    for chunk in iter_chunks(iter([page]), splitter):
+                        chunk_id = _chunk_id(chunk, seen)
+                        ids.append(chunk_id)
+                        if len(ids) <= already_written:
+                            continue # Ya escrito antes de la interrupción
+                        if chunk_id in old_ids:
+                            stats["unchanged"] += 1
+                            continue
+                        batch.append(chunk)
+                        batch_ids.append(chunk_id)
+                        if len(batch) >= batch_size:
+                            flush()
+                flush()
+
+            stale = list(old_ids - set(ids))
+            for i in range(0, len(stale), CHROMA_BATCH_SIZE):
+                vectordb.delete(ids=stale[i:i + CHROMA_BATCH_SIZE])
+            stats["deleted"] += len(stale)
+            done[key] = {"sha256": content_hash.hexdigest(), "file_sha256": file_sha, "chunks": ids}
+            progress.pop(key, None)
+            _save_checkpoint(persist_directory, {"files": done, "progress": progress})
+            debug(f"Ingesta en streaming de {key}: {len(ids)} chunks.")
+    finally:
+        if embedder is not None:
+            embedder.close()
+        flush_embedding_caches()
+
+    # Fuentes que ya no están en la lista: se eliminan sus chunks
+    for key, previous in old_files.items():
+        if key not in done:
+            stale = previous.get("chunks", [])
+            for i in range(0, len(stale), CHROMA_BATCH_SIZE):
+                vectordb.delete(ids=stale[i:i + CHROMA_BATCH_SIZE])
+            stats["deleted"] += len(stale)
+
+    manifest = {"embedding_model": EMBEDDING_MODEL_NAME, "files": done}
+    _save_manifest(persist_directory, manifest)
+    checkpoint_path = os.path.join(persist_directory, CHECKPOINT_FILENAME)
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path) # Ingesta completa: ya no hay nada que reanudar
+    INGEST_CHUNKS.inc(stats["deleted"], op="deleted")
+    INGEST_CHUNKS.inc(stats["unchanged"], op="unchanged")
+    stats["doc_count"] = sum(len(f.get("chunks", [])) for f in done.values())
+    stats["index_version"] = manifest_version(manifest)
+    debug(f"Ingesta en streaming terminada: {stats['added']} chunks nuevos, {stats['deleted']} eliminados, "
+          f"{stats['unchanged']} sin cambios, {stats['resumed']} ya escritos antes de reanudar "
+          f"({stats['skipped_files']} archivos sin cambios).")
+    return stats
+
+
+def download_remote_sources(base_url: str = GITHUB_RAW_URL, max_workers: int = 4, session=None) -> List[str]:
+    """Descarga (condicional) los archivos de REMOTE_SOURCES y retorna sus rutas locales, sin parsearlos."""
+    base_url = base_url.replace("/refs/heads/main/", "/main/")
+    with span("ingest.download_all", files=len(REMOTE_SOURCES)):
+        results = fetch_documents(base_url, [name for name, _ in REMOTE_SOURCES], DOWNLOAD_DIR,
+                                  session=session, max_workers=max_workers)
+    return [r.local_path for r in (results.get(name) for name, _ in REMOTE_SOURCES) if r is not None and r.local_path]
+
+
+def _sync_with_workers(vectordb, docs: List[Document], persist_directory: str,
+                       embed_workers: Optional[int]) -> Dict[str, int]:
+    embedder = create_parallel_embedder(embed_workers)
+    try:
+        if embedder is None:
+            return sync_chroma_incremental(vectordb, docs, persist_directory)
+        with embedder:
+            return sync_chroma_incremental(vectordb, docs, persist_directory, embedder=embedder)
+    finally:
+        flush_embedding_caches()
+
+
+@traced("ingest.build_or_load_chroma")
 def build_or_load_chroma(docs: Optional[List[Document]] = None,
-                         persist_directory: str = "./chroma_db",
-                         collection_name: str = "ecomarket_rag_data",
+                         persist_directory: str = DEFAULT_PERSIST_DIRECTORY,
+                         collection_name: str = DEFAULT_COLLECTION_NAME,
                          openai_api_key: Optional[str] = None,
-                         force_rebuild: bool = False) -> Dict[str, Any]:
+                         force_rebuild: bool = False,
+                         incremental: bool = False,
+                         embed_workers: Optional[int] = None,
+                         streaming: bool = False,
+                         load_only: bool = False) -> Dict[str, Any]:
     """
     Si persist_directory ya contiene la colección, la reutiliza.
     Si force_rebuild es True, elimina el directorio y recrea la base de datos.
-    Devuelve dict con keys: vectorstore, retriever, doc_count
+    Si incremental es True, sincroniza la colección con los documentos actuales usando el
+    manifiesto de hashes (solo embebe chunks nuevos/modificados y borra los eliminados).
+    embed_workers > 1 reparte los embeddings de la ingesta entre procesos (por defecto
+    ECOMARKET_EMBED_WORKERS; ver rag_parallel_embed.py).
+    Si streaming es True (y no se pasan docs), descarga los archivos y los indexa con stream_ingest:
+    memoria acotada, sin re-embeber lo que no cambió y reanudable si se interrumpe.
+    Con load_only=True solo abre una colección existente y no vacía: nunca descarga ni reconstruye
+    (camino de atención, p. ej. el cambio en caliente de snapshot).
+    Devuelve dict con keys: vectorstore, retriever, doc_count, index_version
     """
+    if load_only:
+        force_rebuild = incremental = streaming = False
+        if not os.path.isdir(persist_directory):
+            error(f"No existe el índice {persist_directory} (load_only: no se reconstruye).")
+            return {"vectorstore": None, "retriever": None, "doc_count": 0}
 
     if force_rebuild and os.path.exists(persist_directory):
         try:
             shutil.rmtree(persist_directory)
-            print(f"DEBUG: Directorio de ChromaDB borrado forzadamente: {persist_directory}")
+            debug(f"Directorio de ChromaDB borrado forzadamente: {persist_directory}")
         except Exception as e:
-            print(f"ERROR: No se pudo borrar el directorio de ChromaDB: {e}")
+            error(f"No se pudo borrar el directorio de ChromaDB: {e}")
         
-    # --- INICIALIZACIÓN DE EMBEDDINGS (BGE-M3 con manejo de dispositivo) ---
+    # --- INICIALIZACIÓN DE EMBEDDINGS (BGE-M3 compartido a nivel de proceso) ---
     try:
-        embeddings = HuggingFaceEmbeddings(
-            model_name="BAAI/bge-m3", 
-            model_kwargs={'device': DEVICE}, # Usa 'cuda' si está disponible, sino 'cpu'
-            encode_kwargs={'normalize_embeddings': True}
-        )
-        print(f"DEBUG: Embeddings inicializados con BAAI/bge-m3 en dispositivo: {DEVICE}.")
+        embeddings = get_embeddings()
     except Exception as e:
-        print(f"ERROR: Falló la inicialización de HuggingFaceEmbeddings. ¿Tiene instalado 'sentence-transformers'? Detalle: {e}")
+        error(f"Falló la inicialización de HuggingFaceEmbeddings. ¿Tiene instalado 'sentence-transformers'? Detalle: {e}")
         return {"vectorstore": None, "retriever": None, "doc_count": 0}
     # -----------------------------------------------
 
     doc_count = 0
+
+    # 0a. Ingesta en streaming desde los archivos descargados
+    if streaming and docs is None:
+        try:
+            paths = download_remote_sources()
+            if not paths:
+                critical("No se pudo descargar ningún documento remoto. Retornando doc_count=0.")
+                return {"vectorstore": None, "retriever": None, "doc_count": 0}
+            stats = stream_ingest(paths, persist_directory, collection_name, embed_workers=embed_workers)
+            vectordb = _chroma_class()(persist_directory=persist_directory, collection_name=collection_name, embedding_function=embeddings)
+            retriever = make_retriever(vectordb)
+            return {"vectorstore": vectordb, "retriever": retriever, "doc_count": stats["doc_count"],
+                    "index_version": stats["index_version"], "sync_stats": stats}
+        except Exception as e:
+            critical(f"Falló la ingesta en streaming (se reanudará desde el checkpoint): {e}")
+            return {"vectorstore": None, "retriever": None, "doc_count": 0}
+
+    # 0b. Modo incremental: abrir (o crear) la colección y sincronizarla por hashes
+    if incremental:
+        if docs is None:
+            docs = load_remote_documents()
+        if not docs:
+            critical("No se pudo cargar ningún documento remoto. Retornando doc_count=0.")
+            return {"vectorstore": None, "retriever": None, "doc_count": 0}
+        try:
+            vectordb = _chroma_class()(persist_directory=persist_directory, collection_name=collection_name, embedding_function=embeddings)
+            stats = _sync_with_workers(vectordb, docs, persist_directory, embed_workers)
+            retriever = make_retriever(vectordb)
+            return {"vectorstore": vectordb, "retriever": retriever, "doc_count": stats["doc_count"],
+                    "index_version": stats["index_version"], "sync_stats": stats}
+        except Exception as e:
+            critical(f"Falló la indexación incremental de ChromaDB: {e}")
+            return {"vectorstore": None, "retriever": None, "doc_count": 0}
     
     # 1. Intentar cargar ChromaDB existente
     if os.path.exists(persist_directory) and not force_rebuild:
         try:
-            vectordb = Chroma(persist_directory=persist_directory, collection_name=collection_name, embedding_function=embeddings)
+            vectordb = _chroma_class()(persist_directory=persist_directory, collection_name=collection_name, embedding_function=embeddings)
             doc_count = vectordb._collection.count()
             
             if doc_count > 0:
-                print(f"DEBUG: ChromaDB existente cargada con {doc_count} documentos.")
-                retriever = vectordb.as_retriever(search_kwargs={"k": 5})
-                return {"vectorstore": vectordb, "retriever": retriever, "doc_count": doc_count}
+                debug(f"ChromaDB existente cargada con {doc_count} documentos.")
+                retriever = make_retriever(vectordb)
+                index_version = manifest_version(_load_manifest(persist_directory)) if os.path.exists(
+                    os.path.join(persist_directory, MANIFEST_FILENAME)) else f"count-{doc_count}"
+                return {"vectorstore": vectordb, "retriever": retriever, "doc_count": doc_count,
+                        "index_version": index_version}
             else:
-                print("DEBUG: ChromaDB existente encontrada pero vacía. Procediendo a recrear.")
+                debug("ChromaDB existente encontrada pero vacía. Procediendo a recrear.")
         except Exception as e:
-            print(f"ERROR: Falló la carga de ChromaDB existente: {e}. Procediendo a recrear.")
+            error(f"Falló la carga de ChromaDB existente: {e}. Procediendo a recrear.")
+
+    if load_only:
+        error(f"El índice {persist_directory} está vacío o no se pudo abrir (load_only: no se reconstruye).")
+        return {"vectorstore": None, "retriever": None, "doc_count": 0}
 
     # 2. Crear/Poblar la base de datos
     if docs is None:
         docs = load_remote_documents() 
 
     if not docs:
-        print("ERROR CRÍTICO: No se pudo cargar ningún documento remoto. Retornando doc_count=0.")
+        critical("No se pudo cargar ningún documento remoto. Retornando doc_count=0.")
         return {"vectorstore": None, "retriever": None, "doc_count": 0}
         
-    # --- LÓGICA DE SPLIT SELECTIVO ---
-    docs_to_split = []
-    docs_no_split = []
-
-    for doc in docs:
-        source = doc.metadata.get('source', '')
-        # Separamos PDFs para división; el JSON transformado no necesita división.
-        if source.lower().endswith(('.pdf')): 
-            docs_to_split.append(doc)
-        else:
-            docs_no_split.append(doc)
-
-    print(f"DEBUG: Documentos largos (PDFs) a dividir: {len(docs_to_split)}")
-    print(f"DEBUG: Documentos estructurados (JSON) sin dividir: {len(docs_no_split)}")
-
-    # 3. Segmentación de Texto solo para los documentos largos
-    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-    pdf_chunks = splitter.split_documents(docs_to_split)
-    
-    # 4. Unificación de los Chunks Finales
-    chunks = docs_no_split + pdf_chunks
+    # 3. Split selectivo (PDFs en chunks, FAQ entera)
+    chunks = split_documents(docs)
     
     if not chunks:
-        print("ERROR CRÍTICO: Los documentos cargados no produjeron chunks. Retornando doc_count=0.")
+        critical("Los documentos cargados no produjeron chunks. Retornando doc_count=0.")
         return {"vectorstore": None, "retriever": None, "doc_count": 0}
 
-    # Creación y persistencia
+    # Creación y persistencia (con IDs por contenido para que el modo incremental pueda continuar luego)
     try:
-        vectordb = Chroma.from_documents(documents=chunks, embedding=embeddings, collection_name=collection_name, persist_directory=persist_directory)
-        doc_count = len(chunks)
-        print(f"DEBUG: ChromaDB creada y persistida con {doc_count} chunks.")
-        retriever = vectordb.as_retriever(search_kwargs={"k": 5})
-        return {"vectorstore": vectordb, "retriever": retriever, "doc_count": doc_count}
+        vectordb = _chroma_class()(persist_directory=persist_directory, collection_name=collection_name, embedding_function=embeddings)
+        stats = _sync_with_workers(vectordb, docs, persist_directory, embed_workers)
+        doc_count = stats["doc_count"]
+        debug(f"ChromaDB creada y persistida con {doc_count} chunks.")
+        retriever = make_retriever(vectordb)
+        return {"vectorstore": vectordb, "retriever": retriever, "doc_count": doc_count,
+                "index_version": stats["index_version"]}
     except Exception as e:
-        print(f"ERROR CRÍTICO: Falló la creación de ChromaDB: {e}")
+        critical(f"Falló la creación de ChromaDB: {e}")
         return {"vectorstore": None, "retriever": None, "doc_count": 0}
 
 
-def consultar_conocimiento_rag(query: str, retriever, llm, top_k: int = 3) -> str:
+# --- CACHÉ SEMÁNTICA DE RESPUESTAS (COMPARTIDA POR EL PROCESO) ---
+ANSWER_CACHE_ENABLED = os.getenv("ECOMARKET_ANSWER_CACHE", "1") != "0"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ECOMARKET_ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_TTL = float(os.getenv("ECOMARKET_ANSWER_CACHE_TTL", str(6 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ECOMARKET_ANSWER_CACHE_MAX", "2000"))
+ANSWER_CACHE_PATH = os.getenv("ECOMARKET_ANSWER_CACHE_PATH") or None # Sin ruta, solo en memoria
+
+# Consultas idénticas simultáneas (mismo texto normalizado y misma versión del índice) comparten
+# una sola recuperación + llamada al LLM. "0" en ECOMARKET_SINGLE_FLIGHT lo desactiva.
+# Las seguidoras esperan a la líder como máximo el plazo del gateway del LLM más un margen
+# para la recuperación (ECOMARKET_SINGLE_FLIGHT_MARGIN); después calculan por su cuenta.
+SINGLE_FLIGHT_ENABLED = os.getenv("ECOMARKET_SINGLE_FLIGHT", "1") != "0"
+SINGLE_FLIGHT_MARGIN = float(os.getenv("ECOMARKET_SINGLE_FLIGHT_MARGIN", "15"))
+RAG_FLIGHTS = SingleFlight("rag", wait_timeout=LLM_DEADLINE + SINGLE_FLIGHT_MARGIN)
+
+_ANSWER_CACHE: Optional[SemanticAnswerCache] = None
+
+# Prefijos de las respuestas de error/no-disponible, que nunca se guardan en caché
+_NON_CACHEABLE_PREFIXES = ("RAG no disponible", "Error", "No se encontraron")
+
+
+def get_answer_cache() -> Optional[SemanticAnswerCache]:
+    """Retorna la caché semántica de respuestas del proceso (None si está deshabilitada)."""
+    global _ANSWER_CACHE
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    with _REGISTRY_LOCK:
+        if _ANSWER_CACHE is None:
+            _ANSWER_CACHE = SemanticAnswerCache(
+                get_embeddings(),
+                threshold=ANSWER_CACHE_THRESHOLD,
+                ttl_seconds=ANSWER_CACHE_TTL,
+                max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                persist_path=ANSWER_CACHE_PATH,
+            )
+        return _ANSWER_CACHE
+
+
+@traced("rag.query")
+def consultar_conocimiento_rag(query: str, retriever, llm, top_k: int = RETRIEVER_MAX_K,
+                               answer_cache: Optional[SemanticAnswerCache] = None,
+                               index_version: Optional[str] = None,
+                               callbacks=None) -> str:
     """
     Recupera docs relevantes y pregunta al LLM para obtener respuesta con contexto.
     Utiliza la sintaxis moderna de LangChain (.invoke()).
+    top_k es el máximo de chunks de contexto (el retriever híbrido puede usar menos).
+    Si se pasa answer_cache, una consulta parecida a otra ya respondida (con el mismo
+    index_version) se responde desde la caché sin llamar al retriever ni al LLM.
+    callbacks se propaga a la llamada del LLM (marcada con RAG_ANSWER_TAG) para transmitir tokens.
+    Llamadas concurrentes con la misma consulta normalizada e index_version esperan la respuesta
+    de la primera (RAG_FLIGHTS); solo esa transmite tokens a sus callbacks.
+    """
+    compute = lambda: _consultar_con_cache(query, retriever, llm, top_k, answer_cache, index_version, callbacks)
+    if not SINGLE_FLIGHT_ENABLED or retriever is None:
+        return compute()
+    return RAG_FLIGHTS.do(_flight_key(query, retriever, top_k, index_version), compute)
+
+
+def _flight_key(query: str, retriever, top_k: int, index_version: Optional[str]) -> tuple:
+    # Sin versión de índice se usa la identidad del retriever: dos índices distintos nunca se mezclan
+    return (normalize_text(query), index_version if index_version is not None else id(retriever), top_k)
+
+
+def _consultar_con_cache(query: str, retriever, llm, top_k: int,
+                         answer_cache: Optional[SemanticAnswerCache], index_version: Optional[str],
+                         callbacks=None) -> str:
+    if answer_cache is None or retriever is None:
+        return _responder_con_rag(query, retriever, llm, top_k, callbacks=callbacks)
+    try:
+        return answer_cache.get_or_compute(
+            query,
+            lambda: _responder_con_rag(query, retriever, llm, top_k, callbacks=callbacks),
+            index_version=index_version,
+            should_store=_is_cacheable_answer,
+        )
+    except Exception as e:
+        # Un fallo de la caché nunca debe impedir responder
+        error(f"Falló la caché semántica de respuestas: {e}")
+        return _responder_con_rag(query, retriever, llm, top_k, callbacks=callbacks)
+
+
+def consultar_conocimiento_rag_stream(query: str, retriever, llm, top_k: int = RETRIEVER_MAX_K,
+                                      answer_cache: Optional[SemanticAnswerCache] = None,
+                                      index_version: Optional[str] = None) -> Iterator[str]:
+    """
+    Versión en streaming de consultar_conocimiento_rag: genera los fragmentos de la respuesta
+    a medida que el LLM los produce. Un acierto de la caché se entrega en un solo fragmento.
     """
+    vector = None
+    if answer_cache is not None and retriever is not None:
+        try:
+            vector = answer_cache.embed(query)
+            cached = answer_cache.lookup(query, index_version=index_version, vector=vector)
+            if cached is not None:
+                yield cached
+                return
+        except Exception as e:
+            error(f"Falló la caché semántica de respuestas: {e}")
+            vector = None
+
+    prompt, fallo = _preparar_prompt_rag(query, retriever, top_k)
+    if fallo:
+        yield fallo
+        return
+
+    parts: List[str] = []
+    inicio = time.perf_counter()
+    try:
+        for chunk in llm.stream(prompt, config={"tags": [RAG_ANSWER_TAG]}):
+            text = chunk.content if hasattr(chunk, 'content') else str(chunk)
+            if text:
+                parts.append(text)
+                yield text
+    except Exception as e:
+        RAG_QUERIES.inc(outcome="llm_error")
+        yield f"Error crítico al invocar el LLM durante RAG: {e}"
+        return
+    finally:
+        # Un generador puede quedar suspendido entre fragmentos: se mide de punta a punta sin span activo
+        STAGE_SECONDS.observe(time.perf_counter() - inicio, stage="rag.llm_stream")
+
+    answer = "".join(parts)
+    if vector is not None and _is_cacheable_answer(answer):
+        answer_cache.store(query, answer, index_version=index_version, vector=vector)
+
+
+def _is_cacheable_answer(answer: str) -> bool:
+    return not answer.startswith(_NON_CACHEABLE_PREFIXES)
+
+
+def _preparar_prompt_rag(query: str, retriever, top_k: int = RETRIEVER_MAX_K,
+                         context_token_budget: int = CONTEXT_TOKEN_BUDGET):
+    """Recupera y arma el prompt. Retorna (prompt, None) o (None, mensaje de error)."""
     if retriever is None:
-        return "RAG no disponible (retriever es None). El conocimiento base no fue cargado."
+        return None, "RAG no disponible (retriever es None). El conocimiento base no fue cargado."
 
     try:
-        docs = retriever.invoke(query)
+        with span("rag.retrieve", k=top_k) as s:
+            docs = retriever.invoke(query, k=top_k)
+            s.set(docs=len(docs))
     except Exception as e:
-        return f"Error en la invocación del retriever: {e}"
-    
+        RAG_QUERIES.inc(outcome="retriever_error")
+        return None, f"Error en la invocación del retriever: {e}"
+    return _armar_prompt_rag(query, docs, context_token_budget)
+
+
+async def _apreparar_prompt_rag(query: str, retriever, top_k: int = RETRIEVER_MAX_K,
+                                context_token_budget: int = CONTEXT_TOKEN_BUDGET):
+    """Versión async de _preparar_prompt_rag (retriever.ainvoke)."""
+    if retriever is None:
+        return None, "RAG no disponible (retriever es None). El conocimiento base no fue cargado."
+
+    try:
+        with span("rag.retrieve", k=top_k) as s:
+            docs = await retriever.ainvoke(query, k=top_k)
+            s.set(docs=len(docs))
+    except Exception as e:
+        RAG_QUERIES.inc(outcome="retriever_error")
+        return None, f"Error en la invocación del retriever: {e}"
+    return _armar_prompt_rag(query, docs, context_token_budget)
+
+
+@traced("rag.prompt")
+def _armar_prompt_rag(query: str, docs: List[Document], context_token_budget: int = CONTEXT_TOKEN_BUDGET):
     if not docs:
-        return "No se encontraron documentos relevantes en la base de conocimiento para la consulta."
+        RAG_QUERIES.inc(outcome="no_docs")
+        return None, "No se encontraron documentos relevantes en la base de conocimiento para la consulta."
         
-    contexto = "\n\n".join([f"Source: {d.metadata.get('source','unknown')}\n{d.page_content}" for d in docs])
+    # Fusión de chunks vecinos, deduplicación y empaquetado hasta el presupuesto de tokens
+    contexto = build_context(docs, token_budget=context_token_budget)
     
     prompt = f"""Instrucción: Eres un asistente de servicio al cliente de EcoMarket. Responde a la pregunta del usuario utilizando únicamente el contexto proporcionado.
 
@@ -325,15 +1413,79 @@ def consultar_conocimiento_rag(query: str, retriever, llm, top_k: int = 3) -> st
     Pregunta: {query}
 
     Respuesta:"""
+    return prompt, None
+
+
+def _responder_con_rag(query: str, retriever, llm, top_k: int = RETRIEVER_MAX_K,
+                       context_token_budget: int = CONTEXT_TOKEN_BUDGET, callbacks=None) -> str:
+    prompt, fallo = _preparar_prompt_rag(query, retriever, top_k, context_token_budget)
+    if fallo:
+        return fallo
     
     try:
-        response_message = llm.invoke(prompt)
-        
-        if response_message and hasattr(response_message, 'content'):
-            return response_message.content
-        else:
-            return str(response_message)
-            
+        # La etiqueta permite a los callbacks de streaming distinguir esta llamada de la del agente
+        with span("rag.llm"):
+            response_message = llm.invoke(prompt, config={"callbacks": callbacks, "tags": [RAG_ANSWER_TAG]})
+        RAG_QUERIES.inc(outcome="answered")
+        return _contenido_respuesta(response_message)
+
+    except Exception as e:
+        RAG_QUERIES.inc(outcome="llm_error")
+        return f"Error crítico al invocar el LLM durante RAG: {e}"
+
+
+def _contenido_respuesta(response_message) -> str:
+    if response_message and hasattr(response_message, 'content'):
+        return response_message.content
+    return str(response_message)
+
+
+async def _aresponder_con_rag(query: str, retriever, llm, top_k: int = RETRIEVER_MAX_K,
+                              context_token_budget: int = CONTEXT_TOKEN_BUDGET, callbacks=None) -> str:
+    prompt, fallo = await _apreparar_prompt_rag(query, retriever, top_k, context_token_budget)
+    if fallo:
+        return fallo
+
+    try:
+        with span("rag.llm"):
+            response_message = await llm.ainvoke(prompt, config={"callbacks": callbacks, "tags": [RAG_ANSWER_TAG]})
+        RAG_QUERIES.inc(outcome="answered")
+        return _contenido_respuesta(response_message)
     except Exception as e:
+        RAG_QUERIES.inc(outcome="llm_error")
         return f"Error crítico al invocar el LLM durante RAG: {e}"
+
+
+@traced("rag.query")
+async def aconsultar_conocimiento_rag(query: str, retriever, llm, top_k: int = RETRIEVER_MAX_K,
+                                      answer_cache: Optional[SemanticAnswerCache] = None,
+                                      index_version: Optional[str] = None,
+                                      callbacks=None) -> str:
+    """
+    Versión async de consultar_conocimiento_rag (retriever.ainvoke + llm.ainvoke): mientras espera
+    al LLM no bloquea un hilo, así un solo event loop atiende muchas conversaciones a la vez.
+    Las consultas idénticas concurrentes del mismo event loop se unifican igual que en la versión sync.
+    """
+    acompute = lambda: _aconsultar_con_cache(query, retriever, llm, top_k, answer_cache, index_version, callbacks)
+    if not SINGLE_FLIGHT_ENABLED or retriever is None:
+        return await acompute()
+    return await RAG_FLIGHTS.ado(_flight_key(query, retriever, top_k, index_version), acompute)
+
+
+async def _aconsultar_con_cache(query: str, retriever, llm, top_k: int,
+                                answer_cache: Optional[SemanticAnswerCache], index_version: Optional[str],
+                                callbacks=None) -> str:
+    if answer_cache is None or retriever is None:
+        return await _aresponder_con_rag(query, retriever, llm, top_k, callbacks=callbacks)
+    try:
+        return await answer_cache.aget_or_compute(
+            query,
+            lambda: _aresponder_con_rag(query, retriever, llm, top_k, callbacks=callbacks),
+            index_version=index_version,
+            should_store=_is_cacheable_answer,
+        )
+    except Exception as e:
+        # Un fallo de la caché nunca debe impedir responder
+        error(f"Falló la caché semántica de respuestas: {e}")
+        return await _aresponder_con_rag(query, retriever, llm, top_k, callbacks=callbacks)
 # Fin de rag_system.py
\ No newline at end of file
@@ -0,0 +1,345 @@
+# ============================================================
+# 🗄️ repositorio_pedidos.py — Repositorio de pedidos indexado
+# ============================================================
+# Reemplaza los recorridos lineales sobre PEDIDOS_DB por un repositorio con índices
+# secundarios por cliente (nro_id) y por estado. Las fechas de entrega se parsean una
+# sola vez al cargar. Dos backends con la misma interfaz:
+#   - InMemoryOrderRepository: diccionarios + listas ordenadas (ideal para miles de pedidos);
+#   - SQLiteOrderRepository: tabla con índices (millones de pedidos sin cargarlos en RAM).
+
+import os
+import csv
+import json
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from telemetria import debug, error
+from utilidades_texto import normalize_text
+
+
+DELIVERED_STATUS = "entregado" # Un pedido cuenta como entregado si su estado normalizado lo contiene
+ORDERS_BACKEND = os.getenv("ECOMARKET_ORDERS_BACKEND", "memory") # "memory" o "sqlite"
+ORDERS_CSV_PATH = os.getenv("ECOMARKET_ORDERS_CSV", "") # p. ej. documentos_rag/pedidos_ecomarket.csv
+ORDERS_DB_PATH = os.getenv("ECOMARKET_ORDERS_DB", "pedidos_ecomarket.sqlite3")
+SQLITE_MAX_PARAMS = 900 # Parámetros por consulta IN (...) (límite por defecto de SQLite: 999)
+
+
+@dataclass
+class Order:
+    id_pedido: str
+    status: str
+    date: str # Fecha de entrega tal como viene en la fuente ('' si no hay)
+    productos: List[str]
+    nro_id: Optional[str]
+    nombre_cliente: str
+    delivery_date: Optional[date] = None # Parseada una sola vez al cargar
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def status_norm(self) -> str:
+        return normalize_text(self.status)
+
+    @property
+    def delivered(self) -> bool:
+        return DELIVERED_STATUS in self.status_norm
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Mismo formato que las entradas de PEDIDOS_DB."""
+        return dict(self.extra, status=self.status, date=self.date, productos=list(self.productos),
+                    nro_id=self.nro_id, nombre_cliente=self.nombre_cliente)
+
+
+def parse_date(value: Optional[str]) -> Optional[date]:
+    try:
+        return date.fromisoformat(value.strip()) if value else None
+    except ValueError:
+        return None
+
+
+def make_order(id_pedido: str, info: Dict[str, Any]) -> Order:
+    extra = {k: v for k, v in info.items() if k not in ("status", "date", "productos", "nro_id", "nombre_cliente")}
+    return Order(
+        id_pedido=id_pedido.strip().upper(),
+        status=info.get("status", ""),
+        date=info.get("date", "") or "",
+        productos=list(info.get("productos", [])),
+        nro_id=info.get("nro_id") or None,
+        nombre_cliente=info.get("nombre_cliente", ""),
+        delivery_date=parse_date(info.get("date")),
+        extra=extra,
+    )
+
+
+# -------- Fuentes de datos --------
+def orders_from_dict(db: Dict[str, Dict[str, Any]]) -> Iterator[Order]:
+    """Pedidos desde un diccionario con el formato de PEDIDOS_DB."""
+    for id_pedido, info in db.items():
+        yield make_order(id_pedido, info)
+
+
+def orders_from_csv(path: str) -> Iterator[Order]:
+    """
+    Pedidos desde pedidos_ecomarket.csv (se lee fila a fila, sin cargar el archivo completo).
+    Columnas: pedido_id, cliente, productos, estado, fecha_estimada_entrega, ... y nro_id opcional.
+    Los IDs numéricos se convierten al formato P-XXXX.
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            raw_id = (row.get("pedido_id") or "").strip()
+            if not raw_id:
+                continue
+            id_pedido = raw_id if raw_id.upper().startswith("P-") else f"P-{raw_id}"
+            info = {
+                "status": row.get("estado", ""),
+                "date": row.get("fecha_entrega") or row.get("fecha_estimada_entrega") or "",
+                "productos": [p.strip() for p in (row.get("productos") or "").split(",") if p.strip()],
+                "nro_id": (row.get("nro_id") or "").strip() or None,
+                "nombre_cliente": row.get("cliente", ""),
+            }
+            for key in ("fecha_pedido", "fecha_estimada_entrega", "retrasado", "tracking", "direccion_entrega", "ciudad"):
+                if row.get(key) not in (None, ""):
+                    info[key] = row[key]
+            yield make_order(id_pedido, info)
+
+
+# -------- Interfaz común --------
+class OrderRepository:
+    """Interfaz del repositorio de pedidos."""
+
+    def get(self, id_pedido: str) -> Optional[Order]:
+        raise NotImplementedError
+
+    def by_customer(self, nro_id: str) -> List[Order]:
+        raise NotImplementedError
+
+    def by_status(self, status: str) -> List[Order]:
+        raise NotImplementedError
+
+    def latest_delivered(self, nro_id: str) -> Optional[Order]:
+        """Pedido entregado más reciente del cliente (consulta indexada, no recorre todos los pedidos)."""
+        raise NotImplementedError
+
+    def get_many(self, ids: Iterable[str]) -> Dict[str, Order]:
+        """Pedidos por ID (solo los encontrados), con una búsqueda por ID distinto."""
+        found = {}
+        for id_pedido in set(ids):
+            order = self.get(id_pedido)
+            if order is not None:
+                found[id_pedido] = order
+        return found
+
+    def latest_delivered_many(self, nro_ids: Iterable[str]) -> Dict[str, Order]:
+        """Último pedido entregado de cada cliente (solo los que tienen uno), una búsqueda por cliente."""
+        found = {}
+        for nro_id in set(nro_ids):
+            order = self.latest_delivered(nro_id)
+            if order is not None:
+                found[nro_id] = order
+        return found
+
+    def add_many(self, orders: Iterable[Order]) -> int:
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+
+class InMemoryOrderRepository(OrderRepository):
+    def __init__(self, orders: Iterable[Order] = ()):
+        self._lock = threading.Lock()
+        self._orders: Dict[str, Order] = {}
+        self._by_customer: Dict[str, List[str]] = {}
+        self._by_status: Dict[str, List[str]] = {}
+        self._latest_delivered: Dict[str, str] = {}
+        self.add_many(orders)
+
+    def add_many(self, orders: Iterable[Order]) -> int:
+        n = 0
+        with self._lock:
+            for order in orders:
+                if order.id_pedido in self._orders:
+                    self._remove_locked(order.id_pedido)
+                self._orders[order.id_pedido] = order
+                if order.nro_id:
+                    self._by_customer.setdefault(order.nro_id, []).append(order.id_pedido)
+                    if order.delivered and order.delivery_date is not None:
+                        current = self._orders.get(self._latest_delivered.get(order.nro_id, ""))
+                        if current is None or order.delivery_date > current.delivery_date:
+                            self._latest_delivered[order.nro_id] = order.id_pedido
+                self._by_status.setdefault(order.status_norm, []).append(order.id_pedido)
+                n += 1
+        return n
+
+    def _remove_locked(self, id_pedido: str) -> None:
+        old = self._orders.pop(id_pedido)
+        if old.nro_id:
+            self._by_customer[old.nro_id].remove(id_pedido)
+            if self._latest_delivered.get(old.nro_id) == id_pedido:
+                del self._latest_delivered[old.nro_id]
+                candidates = [self._orders[i] for i in self._by_customer[old.nro_id]
+                              if self._orders[i].delivered and self._orders[i].delivery_date is not None]
+                if candidates:
+                    self._latest_delivered[old.nro_id] = max(candidates, key=lambda o: o.delivery_date).id_pedido
+        self._by_status[old.status_norm].remove(id_pedido)
+
+    def get(self, id_pedido: str) -> Optional[Order]:
+        return self._orders.get(id_pedido.strip().upper())
+
+    def by_customer(self, nro_id: str) -> List[Order]:
+        return [self._orders[i] for i in self._by_customer.get(nro_id, [])]
+
+    def by_status(self, status: str) -> List[Order]:
+        return [self._orders[i] for i in self._by_status.get(normalize_text(status), [])]
+
+    def latest_delivered(self, nro_id: str) -> Optional[Order]:
+        id_pedido = self._latest_delivered.get(nro_id)
+        return self._orders.get(id_pedido) if id_pedido else None
+
+    def get_many(self, ids: Iterable[str]) -> Dict[str, Order]:
+        orders = self._orders
+        return {i: orders[i] for i in {i.strip().upper() for i in ids} if i in orders}
+
+    def latest_delivered_many(self, nro_ids: Iterable[str]) -> Dict[str, Order]:
+        orders, latest = self._orders, self._latest_delivered
+        return {n: orders[latest[n]] for n in set(nro_ids) if n in latest}
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+
+class SQLiteOrderRepository(OrderRepository):
+    """
+    Backend SQLite. Índices: (nro_id, delivered, delivery_ordinal) para el último entregado
+    de un cliente y (status_norm) para filtros por estado.
+    """
+
+    def __init__(self, path: str = ":memory:", orders: Iterable[Order] = ()):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS orders (
+                id_pedido TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                status_norm TEXT NOT NULL,
+                date TEXT NOT NULL,
+                delivery_ordinal INTEGER,
+                delivered INTEGER NOT NULL,
+                nro_id TEXT,
+                nombre_cliente TEXT NOT NULL,
+                productos TEXT NOT NULL,
+                extra TEXT NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_customer "
+                           "ON orders (nro_id, delivered, delivery_ordinal)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status_norm)")
+        self._conn.commit()
+        self.add_many(orders)
+
+    @staticmethod
+    def _to_row(order: Order) -> tuple:
+        return (order.id_pedido, order.status, order.status_norm, order.date,
+                order.delivery_date.toordinal() if order.delivery_date else None,
+                int(order.delivered), order.nro_id, order.nombre_cliente,
+                json.dumps(order.productos, ensure_ascii=False), json.dumps(order.extra, ensure_ascii=False))
+
+    @staticmethod
+    def _from_row(row: tuple) -> Order:
+        id_pedido, status, _, date_str, ordinal, _, nro_id, nombre, productos, extra = row
+        return Order(id_pedido=id_pedido, status=status, date=date_str, productos=json.loads(productos),
+                     nro_id=nro_id, nombre_cliente=nombre,
+                     delivery_date=date.fromordinal(ordinal) if ordinal else None, extra=json.loads(extra))
+
+    def add_many(self, orders: Iterable[Order], batch_size: int = 10_000) -> int:
+        n = 0
+        batch = []
+        with self._lock:
+            for order in orders:
+                batch.append(self._to_row(order))
+                if len(batch) >= batch_size:
+                    self._conn.executemany("INSERT OR REPLACE INTO orders VALUES (?,?,?,?,?,?,?,?,?,?)", batch)
+                    n += len(batch)
+                    batch = []
+            if batch:
+                self._conn.executemany("INSERT OR REPLACE INTO orders VALUES (?,?,?,?,?,?,?,?,?,?)", batch)
+                n += len(batch)
+            self._conn.commit()
+        return n
+
+    def _query(self, sql: str, params: tuple) -> List[Order]:
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [self._from_row(r) for r in rows]
+
+    def get(self, id_pedido: str) -> Optional[Order]:
+        rows = self._query("SELECT * FROM orders WHERE id_pedido = ?", (id_pedido.strip().upper(),))
+        return rows[0] if rows else None
+
+    def by_customer(self, nro_id: str) -> List[Order]:
+        return self._query("SELECT * FROM orders WHERE nro_id = ?", (nro_id,))
+
+    def by_status(self, status: str) -> List[Order]:
+        return self._query("SELECT * FROM orders WHERE status_norm = ?", (normalize_text(status),))
+
+    def get_many(self, ids: Iterable[str]) -> Dict[str, Order]:
+        unique = sorted({i.strip().upper() for i in ids})
+        found: Dict[str, Order] = {}
+        for start in range(0, len(unique), SQLITE_MAX_PARAMS):
+            batch = unique[start:start + SQLITE_MAX_PARAMS]
+            marks = ",".join("?" * len(batch))
+            for order in self._query(f"SELECT * FROM orders WHERE id_pedido IN ({marks})", tuple(batch)):
+                found[order.id_pedido] = order
+        return found
+
+    def latest_delivered_many(self, nro_ids: Iterable[str]) -> Dict[str, Order]:
+        unique = sorted(set(nro_ids))
+        found: Dict[str, Order] = {}
+        for start in range(0, len(unique), SQLITE_MAX_PARAMS):
+            batch = unique[start:start + SQLITE_MAX_PARAMS]
+            marks = ",".join("?" * len(batch))
+            # Filas ordenadas por fecha: la última vista de cada cliente es su entrega más reciente
+            for order in self._query(
+                f"SELECT * FROM orders WHERE nro_id IN ({marks}) AND delivered = 1 AND delivery_ordinal IS NOT NULL "
+                "ORDER BY delivery_ordinal", tuple(batch)):
+                found[order.nro_id] = order
+        return found
+
+    def latest_delivered(self, nro_id: str) -> Optional[Order]:
+        rows = self._query(
+            "SELECT * FROM orders WHERE nro_id = ? AND delivered = 1 AND delivery_ordinal IS NOT NULL "
+            "ORDER BY delivery_ordinal DESC LIMIT 1",
+            (nro_id,),
+        )
+        return rows[0] if rows else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+
+def build_order_repository(seed: Optional[Dict[str, Dict[str, Any]]] = None, backend: str = ORDERS_BACKEND,
+                           csv_path: str = ORDERS_CSV_PATH, db_path: str = ORDERS_DB_PATH) -> OrderRepository:
+    """
+    Construye el repositorio configurado: pedidos del CSV (si se indica) y de 'seed' (formato PEDIDOS_DB). Con backend "sqlite" y una base ya poblada, no se vuelve a cargar nada.
+    """
+    if backend == "sqlite":
+        repo: OrderRepository = SQLiteOrderRepository(db_path)
+        if len(repo) > 0:
+            debug(f"Repositorio SQLite de pedidos cargado desde {db_path} ({len(repo)} pedidos).")
+            return repo
+    else:
+        repo = InMemoryOrderRepository()
+
+    if csv_path:
+        try:
+            repo.add_many(orders_from_csv(csv_path))
+        except OSError as e:
+            error(f"No se pudieron cargar los pedidos desde {csv_path}: {e}")
+    # El seed se carga al final: ante IDs repetidos prevalece (el CSV no trae nro_id)
+    if seed:
+        repo.add_many(orders_from_dict(seed))
+    debug(f"Repositorio de pedidos ({backend}) con {len(repo)} pedidos.")
+    return repo
@@ -0,0 +1,389 @@
+# ============================================================
+# 🌐 servicio_chat.py — Servicio HTTP de chat sin interfaz
+# ============================================================
+# Alternativa headless a app_ecomarket.py para correr varios procesos detrás de un balanceador.
+# - Cada sesión tiene su propio agente y EcomarketMemory, guardados en un almacén LRU con TTL
+#   y tamaño máximo (la memoria del proceso no crece sin límite).
+# - Embeddings, Chroma, retriever, FAQ y el cliente del LLM se comparten entre sesiones.
+# - Contrapresión: como máximo MAX_IN_FLIGHT turnos a la vez y MAX_QUEUE esperando; el resto
+#   recibe 503 con Retry-After en lugar de acumular hilos bloqueados.
+#
+# Uso: python servicio_chat.py --port 8080
+#   POST   /chat                {"session_id": opcional, "message": "..."}
+#   DELETE /sessions/<id>
+#   GET    /health | /metrics (JSON) | /metrics/prometheus (texto de exposición de Prometheus)
+
+import os
+import re
+import json
+import time
+import uuid
+import argparse
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from telemetria import debug, error, metrics_snapshot, render_prometheus
+
+
+MAX_SESSIONS = int(os.getenv("ECOMARKET_MAX_SESSIONS", "1000"))
+SESSION_TTL_SECONDS = float(os.getenv("ECOMARKET_SESSION_TTL", "1800")) # 30 min sin actividad
+MAX_IN_FLIGHT = int(os.getenv("ECOMARKET_MAX_IN_FLIGHT", "8")) # Turnos procesándose a la vez
+MAX_QUEUE = int(os.getenv("ECOMARKET_MAX_QUEUE", "32")) # Turnos esperando un lugar
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("ECOMARKET_QUEUE_TIMEOUT", "5"))
+SWEEP_INTERVAL_SECONDS = 60
+MAX_BODY_BYTES = 64 * 1024
+MAX_MESSAGE_CHARS = 4000
+
+_SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+
+class Overloaded(Exception):
+    """No hay capacidad para atender el turno ahora (se responde 503 con Retry-After)."""
+
+
+class SessionBusy(Exception):
+    """La sesión ya tiene un turno en curso (los turnos de una sesión se atienden en orden)."""
+
+
+@dataclass
+class Session:
+    id: str
+    agent: Any
+    created_at: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+    turns: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class SessionStore:
+    """
+    Sesiones en un OrderedDict en orden de uso (LRU). Al crear una sesión nueva se descartan
+    primero las vencidas (TTL) y luego las menos usadas hasta respetar max_sessions;
+    nunca se descarta una sesión con un turno en curso.
+    """
+
+    def __init__(self, factory: Callable[[], Any], max_sessions: int = MAX_SESSIONS,
+                 ttl_seconds: float = SESSION_TTL_SECONDS):
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def get_or_create(self, session_id: Optional[str] = None) -> Tuple[Session, bool]:
+        """Retorna (sesión, es_nueva). Un id desconocido o vencido crea una sesión nueva con ese id."""
+        now = time.time()
+        with self._lock:
+            session = self._sessions.get(session_id) if session_id else None
+            if session is not None and now - session.last_used <= self.ttl_seconds:
+                session.last_used = now
+                self._sessions.move_to_end(session.id)
+                return session, False
+            if session is not None:
+                del self._sessions[session.id]
+                self.expired += 1
+            self._make_room_locked(now)
+
+        # El agente se construye fuera del lock (los recursos pesados ya están compartidos)
+        session = Session(id=session_id or uuid.uuid4().hex, agent=self.factory())
+        with self._lock:
+            existing = self._sessions.get(session.id)
+            if existing is not None: # Otra petición creó la misma sesión mientras tanto
+                return existing, False
+            self._sessions[session.id] = session
+            self.created += 1
+        return session, True
+
+    def _make_room_locked(self, now: float) -> None:
+        for sid in [sid for sid, s in self._sessions.items()
+                    if now - s.last_used > self.ttl_seconds and not s.lock.locked()]:
+            del self._sessions[sid]
+            self.expired += 1
+        while len(self._sessions) >= self.max_sessions:
+            victim = next((sid for sid, s in self._sessions.items() if not s.lock.locked()), None)
+            if victim is None:
+                raise Overloaded("Todas las sesiones tienen turnos en curso.")
+            del self._sessions[victim]
+            self.evicted += 1
+
+    def remove(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def sweep(self) -> int:
+        """Descarta las sesiones vencidas. Retorna cuántas se descartaron."""
+        with self._lock:
+            before = self.expired
+            now = time.time()
+            for sid in [sid for sid, s in self._sessions.items()
+                        if now - s.last_used > self.ttl_seconds and not s.lock.locked()]:
+                del self._sessions[sid]
+                self.expired += 1
+            return self.expired - before
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl_seconds,
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+
+class ChatService:
+    """Atiende turnos de chat con límite de concurrencia y de cola."""
+
+    def __init__(self, agent_factory: Callable[[], Any], max_sessions: int = MAX_SESSIONS,
+                 ttl_seconds: float = SESSION_TTL_SECONDS, max_in_flight: int = MAX_IN_FLIGHT,
+                 max_queue: int = MAX_QUEUE, queue_timeout: float = QUEUE_TIMEOUT_SECONDS):
+        self.sessions = SessionStore(agent_factory, max_sessions=max_sessions, ttl_seconds=ttl_seconds)
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._state_lock = threading.Lock()
+        self._waiting = 0
+        self._in_flight = 0
+        self.served = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def _acquire_slot(self) -> None:
+        with self._state_lock:
+            if self._waiting >= self.max_queue:
+                self.rejected += 1
+                raise Overloaded("La cola de turnos está llena.")
+            self._waiting += 1
+        acquired = self._slots.acquire(timeout=self.queue_timeout)
+        with self._state_lock:
+            self._waiting -= 1
+            if not acquired:
+                self.rejected += 1
+                raise Overloaded("Tiempo de espera agotado en la cola de turnos.")
+            self._in_flight += 1
+
+    def _release_slot(self) -> None:
+        with self._state_lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def chat(self, message: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        self._acquire_slot()
+        try:
+            session, is_new = self.sessions.get_or_create(session_id)
+            if not session.lock.acquire(timeout=self.queue_timeout):
+                raise SessionBusy(f"La sesión {session.id} tiene un turno en curso.")
+            try:
+                start = time.perf_counter()
+                result = session.agent.invoke({"input": message})
+                session.turns += 1
+                session.last_used = time.time()
+            finally:
+                session.lock.release()
+        except (Overloaded, SessionBusy):
+            raise
+        except Exception:
+            with self._state_lock:
+                self.failed += 1
+            raise
+        finally:
+            self._release_slot()
+
+        with self._state_lock:
+            self.served += 1
+        output = result.get("output", str(result)) if isinstance(result, dict) else str(result)
+        return {
+            "session_id": session.id,
+            "new_session": is_new,
+            "output": output,
+            "route": result.get("route") if isinstance(result, dict) else None,
+            "elapsed_ms": round((time.perf_counter() - start) * 1000, 1),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._state_lock:
+            state = {
+                "in_flight": self._in_flight,
+                "waiting": self._waiting,
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "served": self.served,
+                "rejected": self.rejected,
+                "failed": self.failed,
+            }
+        state.update(self.sessions.stats())
+        return state
+
+
+# -------- HTTP --------
+def make_handler(service: ChatService, extra_metrics: Optional[Callable[[], Dict[str, Any]]] = None):
+    class ChatHandler(BaseHTTPRequestHandler):
+        server_version = "EcoMarketChat/1.0"
+
+        def _send(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_text(self, status: int, text: str, content_type: str) -> None:
+            body = text.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self) -> Optional[Dict[str, Any]]:
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                self._send(400, {"error": "Content-Length inválido."})
+                return None
+            if length > MAX_BODY_BYTES:
+                self._send(413, {"error": "Cuerpo demasiado grande."})
+                return None
+            try:
+                data = json.loads(self.rfile.read(length) or b"{}")
+            except (ValueError, UnicodeDecodeError):
+                self._send(400, {"error": "JSON inválido."})
+                return None
+            if not isinstance(data, dict):
+                self._send(400, {"error": "Se esperaba un objeto JSON."})
+                return None
+            return data
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/chat":
+                self._send(404, {"error": "Ruta no encontrada."})
+                return
+            data = self._read_json()
+            if data is None:
+                return
+            message = str(data.get("message") or "").strip()
+            session_id = data.get("session_id")
+            if not message or len(message) > MAX_MESSAGE_CHARS:
+                self._send(400, {"error": f"'message' es obligatorio (máximo {MAX_MESSAGE_CHARS} caracteres)."})
+                return
+            if session_id is not None and not _SESSION_ID_PATTERN.match(str(session_id)):
+                self._send(400, {"error": "'session_id' inválido."})
+                return
+            try:
+                self._send(200, service.chat(message, session_id=session_id))
+            except Overloaded as e:
+                self._send(503, {"error": str(e)}, {"Retry-After": "1"})
+            except SessionBusy as e:
+                self._send(429, {"error": str(e)}, {"Retry-After": "1"})
+            except Exception as e:
+                error(f"Falló el turno de chat: {e}")
+                self._send(500, {"error": "Error interno al procesar el turno."})
+
+        def do_DELETE(self):
+            parts = self.path.strip("/").split("/")
+            if len(parts) != 2 or parts[0] != "sessions":
+                self._send(404, {"error": "Ruta no encontrada."})
+                return
+            self._send(200 if service.sessions.remove(parts[1]) else 404, {"session_id": parts[1]})
+
+        def do_GET(self):
+            path = self.path.rstrip("/")
+            if path == "/health":
+                self._send(200, {"status": "ok", **service.stats()})
+            elif path == "/metrics":
+                metrics = {"service": service.stats(), "telemetry": metrics_snapshot()}
+                if extra_metrics is not None:
+                    metrics.update(extra_metrics())
+                self._send(200, metrics)
+            elif path == "/metrics/prometheus":
+                self._send_text(200, render_prometheus(), "text/plain; version=0.0.4; charset=utf-8")
+            else:
+                self._send(404, {"error": "Ruta no encontrada."})
+
+        def log_message(self, format: str, *args) -> None:
+            debug(f"{self.address_string()} - {format % args}", client=self.address_string())
+
+    return ChatHandler
+
+
+def create_service(openai_api_key: str, persist_dir: str = "./chroma_db", **kwargs) -> ChatService:
+    """
+    Carga una vez los recursos compartidos (índice RAG, FAQ y cliente del LLM) y crea el servicio.
+    Cada sesión nueva solo construye su memoria y su ejecutor de agente. Con ECOMARKET_RAG_WARMUP
+    en "background" el índice se carga en segundo plano y el servicio atiende desde el inicio.
+    """
+    from agente_ecomarket import RAG_WARMUP_MODE, create_llm, initialize_ecomarket_agent
+    from faq_index import get_faq_index
+    from rag_system import get_shared_rag_resources, start_rag_warmup
+
+    if RAG_WARMUP_MODE == "background":
+        start_rag_warmup(persist_directory=persist_dir)
+    else:
+        get_shared_rag_resources(persist_directory=persist_dir)
+    get_faq_index()
+    llm = create_llm(openai_api_key)
+    return ChatService(lambda: initialize_ecomarket_agent(openai_api_key, persist_dir, llm=llm), **kwargs)
+
+
+def _sweeper(service: ChatService, interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        removed = service.sessions.sweep()
+        if removed:
+            debug(f"{removed} sesiones vencidas descartadas.", removed=removed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Servicio HTTP de chat de EcoMarket (sin interfaz).")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8080")))
+    parser.add_argument("--persist-dir", default="./chroma_db")
+    args = parser.parse_args()
+
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+
+    from agente_ecomarket import TURN_STATS
+    from llm_gateway import get_llm_gateway
+    from rag_system import RAG_FLIGHTS, rag_status
+
+    service = create_service(os.getenv("OPENAI_API_KEY"), persist_dir=args.persist_dir)
+    threading.Thread(target=_sweeper, args=(service, SWEEP_INTERVAL_SECONDS), daemon=True).start()
+
+    def extra_metrics() -> Dict[str, Any]:
+        return {"turns": TURN_STATS.snapshot(), "rag": rag_status(args.persist_dir),
+                "single_flight": RAG_FLIGHTS.stats(), "llm_gateway": get_llm_gateway().stats()}
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service, extra_metrics))
+    server.daemon_threads = True
+    debug(f"Servicio de chat escuchando en http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
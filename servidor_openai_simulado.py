@@ -0,0 +1,209 @@
+# ============================================================
+# 🧪 servidor_openai_simulado.py — Servidor local compatible con la API de OpenAI
+# ============================================================
+# Responde POST /v1/chat/completions (normal y en streaming SSE) con texto determinista y
+# permite inyectar los problemas que el gateway del LLM debe absorber:
+#   - --latency-ms: demora de cada respuesta;
+#   - --fail-first N: las primeras N solicitudes reciben 429 con Retry-After;
+#   - --error-rate p: fracción de solicitudes que fallan con 429 o 503 al azar;
+#   - --rpm N: límite propio de solicitudes por minuto (429 al excederlo).
+# GET /stats informa solicitudes, errores inyectados y la concurrencia máxima observada.
+#
+# Uso: python servidor_openai_simulado.py --port 8099 --error-rate 0.2
+#      ECOMARKET_LLM_BASE_URL=http://localhost:8099/v1 OPENAI_API_KEY=sk-local streamlit run app_ecomarket.py
+
+import json
+import time
+import random
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, Optional, Tuple
+
+
+class StubState:
+    """Configuración y contadores compartidos por los hilos del servidor."""
+
+    def __init__(self, latency: float = 0.0, fail_first: int = 0, error_rate: float = 0.0,
+                 rpm: int = 0, seed: Optional[int] = None):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.error_rate = error_rate
+        self.rpm = rpm
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent: Deque[float] = deque()
+        self.requests = 0
+        self.completed = 0
+        self.injected = {"429": 0, "503": 0}
+        self.active = 0
+        self.max_active = 0
+
+    def admit(self) -> Optional[int]:
+        """Registra la solicitud y retorna el código de error a inyectar (None = responder)."""
+        with self._lock:
+            now = time.monotonic()
+            self.requests += 1
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            status = None
+            if self.requests <= self.fail_first:
+                status = 429
+            elif self.rpm and len(self._recent) >= self.rpm:
+                status = 429
+            elif self.error_rate and self._rng.random() < self.error_rate:
+                status = self._rng.choice((429, 503))
+            if status is not None:
+                self.injected[str(status)] += 1
+                return status
+            self._recent.append(now)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            return None
+
+    def done(self) -> None:
+        with self._lock:
+            self.active -= 1
+            self.completed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"requests": self.requests, "completed": self.completed, "injected": dict(self.injected),
+                    "active": self.active, "max_active": self.max_active}
+
+
+def _respuesta(body: Dict[str, Any]) -> Tuple[str, int]:
+    """Texto de la respuesta y tokens (aprox. 4 caracteres por token) del prompt."""
+    prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []) if isinstance(m, dict))
+    return "Respuesta simulada de EcoMarket.", max(1, len(prompt) // 4)
+
+
+def make_handler(state: StubState):
+    class StubHandler(BaseHTTPRequestHandler):
+        server_version = "EcoMarketOpenAIStub/1.0"
+        protocol_version = "HTTP/1.1" # Keep-alive: permite comprobar el pool de conexiones del cliente
+
+        def log_message(self, format, *args):
+            pass
+
+        def handle(self):
+            try:
+                super().handle()
+            except (ConnectionResetError, BrokenPipeError):
+                pass # El cliente cerró una conexión keep-alive
+
+        def _send(self, status: int, payload: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip("/") == "/stats":
+                self._send(200, state.stats())
+            else:
+                self._send(404, {"error": {"message": "Ruta no encontrada."}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b"{}"
+            if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+                self._send(404, {"error": {"message": "Ruta no encontrada."}})
+                return
+            try:
+                body = json.loads(raw)
+            except ValueError:
+                self._send(400, {"error": {"message": "JSON inválido.", "type": "invalid_request_error"}})
+                return
+
+            status = state.admit()
+            if status is not None:
+                kind = "rate_limit_exceeded" if status == 429 else "server_error"
+                self._send(status, {"error": {"message": f"Error simulado {status}.", "type": kind}},
+                           {"Retry-After": "0.1"} if status == 429 else None)
+                return
+            try:
+                if state.latency:
+                    time.sleep(state.latency)
+                texto, prompt_tokens = _respuesta(body)
+                if body.get("stream"):
+                    self._stream(body, texto)
+                else:
+                    completion_tokens = max(1, len(texto) // 4)
+                    self._send(200, {
+                        "id": f"chatcmpl-{state.requests}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": body.get("model", "stub"),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": texto}}],
+                        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                  "total_tokens": prompt_tokens + completion_tokens},
+                    })
+            finally:
+                state.done()
+
+        def _stream(self, body: Dict[str, Any], texto: str) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            base = {"id": f"chatcmpl-{state.requests}", "object": "chat.completion.chunk",
+                    "created": int(time.time()), "model": body.get("model", "stub")}
+            partes = [{"role": "assistant", "content": ""}] + [{"content": w + " "} for w in texto.split()]
+            for delta in partes:
+                self._chunk(dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+            self._chunk(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._write_chunk(b"")
+
+        def _chunk(self, payload: Dict[str, Any]) -> None:
+            self._write_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        def _write_chunk(self, data: bytes) -> None:
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+    return StubHandler
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, **options) -> Tuple[ThreadingHTTPServer, StubState, str]:
+    """Arranca el servidor en un hilo. Retorna (servidor, estado, base_url para el cliente OpenAI)."""
+    state = StubState(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Servidor local compatible con OpenAI para probar el gateway del LLM.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=200.0)
+    parser.add_argument("--fail-first", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    state = StubState(latency=args.latency_ms / 1000, fail_first=args.fail_first,
+                      error_rate=args.error_rate, rpm=args.rpm, seed=args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(state))
+    server.daemon_threads = True
+    print(f"DEBUG: Servidor OpenAI simulado en http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
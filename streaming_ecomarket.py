@@ -0,0 +1,114 @@
+# ============================================================
+# 📡 streaming_ecomarket.py — Streaming de tokens del agente a la UI
+# ============================================================
+# El agente corre en un hilo de trabajo; un callback de LangChain pone en una cola los
+# tokens de la respuesta final (del agente o del LLM del RAG) y los pasos de herramientas.
+# El hilo de la UI consume la cola y pinta a medida que llegan, sin esperar al final.
+
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+# Etiqueta que rag_system pone en la llamada al LLM del RAG: sus tokens son respuesta final
+RAG_ANSWER_TAG = "rag_answer"
+# En el formato ReAct, lo que sigue a este marcador es la respuesta para el usuario
+FINAL_ANSWER_MARKER = "Final Answer:"
+
+_DONE = object()
+
+
+class TokenQueueHandler(BaseCallbackHandler):
+    """
+    Callback que publica eventos en una cola:
+    - {"type": "token", "text": ...}  fragmentos de la respuesta visible;
+    - {"type": "tool", "name": ...}   inicio de una herramienta;
+    - {"type": "tool_end"}            fin de la herramienta.
+    De las llamadas del agente solo se transmite el texto después de "Final Answer:";
+    las llamadas marcadas con RAG_ANSWER_TAG se transmiten completas.
+    """
+
+    def __init__(self, events: "queue.Queue"):
+        self.events = events
+        self._rag_runs = set()
+        self._buffers: Dict[UUID, str] = {}
+        self._final_started = set()
+
+    def _start(self, run_id: UUID, tags: Optional[List[str]]) -> None:
+        if tags and RAG_ANSWER_TAG in tags:
+            self._rag_runs.add(run_id)
+        else:
+            self._buffers[run_id] = ""
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID,
+                     tags: Optional[List[str]] = None, **kwargs: Any) -> None:
+        self._start(run_id, tags)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            tags: Optional[List[str]] = None, **kwargs: Any) -> None:
+        self._start(run_id, tags)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        if not token:
+            return
+        if run_id in self._rag_runs or run_id in self._final_started:
+            self.events.put({"type": "token", "text": token})
+            return
+
+        # Agente: se acumula hasta ver el marcador de respuesta final
+        buffer = self._buffers.get(run_id, "") + token
+        self._buffers[run_id] = buffer
+        pos = buffer.find(FINAL_ANSWER_MARKER)
+        if pos >= 0:
+            self._final_started.add(run_id)
+            rest = buffer[pos + len(FINAL_ANSWER_MARKER):].lstrip()
+            if rest:
+                self.events.put({"type": "token", "text": rest})
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._rag_runs.discard(run_id)
+        self._buffers.pop(run_id, None)
+        self._final_started.discard(run_id)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
+        name = (serialized or {}).get("name") or kwargs.get("name") or "herramienta"
+        self.events.put({"type": "tool", "name": name})
+
+    def on_tool_end(self, output: Any, **kwargs: Any) -> None:
+        self.events.put({"type": "tool_end"})
+
+
+def stream_agent_events(invoke: Callable[..., Dict[str, Any]], inputs: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """
+    Ejecuta invoke(inputs, config={"callbacks": [...]}) en un hilo y genera los eventos a medida
+    que llegan. El último evento es {"type": "final", "output": ...} con la respuesta completa.
+    Las excepciones del agente se re-lanzan en el hilo que consume el generador.
+    """
+    events: "queue.Queue" = queue.Queue()
+    handler = TokenQueueHandler(events)
+    outcome: Dict[str, Any] = {}
+
+    def _worker():
+        try:
+            outcome["result"] = invoke(inputs, config={"callbacks": [handler]})
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            events.put(_DONE)
+
+    threading.Thread(target=_worker, daemon=True).start()
+
+    while True:
+        event = events.get()
+        if event is _DONE:
+            break
+        yield event
+
+    if "error" in outcome:
+        raise outcome["error"]
+    result = outcome.get("result")
+    output = result.get("output", str(result)) if isinstance(result, dict) else str(result)
+    yield {"type": "final", "output": output}
@@ -0,0 +1,336 @@
+# ============================================================
+# 📈 telemetria.py — Trazas por etapa y métricas del proceso
+# ============================================================
+# Capa liviana de instrumentación, sin dependencias externas:
+#   - span("etapa"): mide una etapa (descarga, parseo, split, embeddings, retriever, LLM,
+#     herramientas del agente...) y la registra en el histograma ecomarket_stage_seconds;
+#   - contadores e histogramas con etiquetas, exportables en formato de texto de Prometheus
+#     (render_prometheus) o como diccionario (snapshot);
+#   - debug()/error(): reemplazan los print("DEBUG: ...") y, con ECOMARKET_LOG_FORMAT=json,
+#     escriben una línea JSON por evento con el trace/span activo.
+# Con ECOMARKET_TELEMETRY=0, span() retorna un objeto vacío compartido (sin reloj ni locks).
+
+import os
+import sys
+import json
+import time
+import random
+import bisect
+import inspect
+import functools
+import threading
+import contextvars
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+TELEMETRY_ENABLED = os.getenv("ECOMARKET_TELEMETRY", "1") != "0"
+LOG_FORMAT = os.getenv("ECOMARKET_LOG_FORMAT", "text").lower() # "text" (DEBUG: ...) o "json"
+
+# Límites en segundos: cubren desde una búsqueda en memoria hasta una ingesta completa
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_LEVEL_PREFIX = {"debug": "DEBUG", "info": "INFO", "warning": "ADVERTENCIA", "error": "ERROR",
+                 "critical": "ERROR CRÍTICO"}
+
+
+def set_enabled(enabled: bool) -> None:
+    """Activa o desactiva los spans en tiempo de ejecución (los contadores explícitos siguen)."""
+    global TELEMETRY_ENABLED
+    TELEMETRY_ENABLED = enabled
+
+
+def set_log_format(fmt: str) -> None:
+    global LOG_FORMAT
+    LOG_FORMAT = fmt.lower()
+
+
+# --- MÉTRICAS ---
+def _label_key(labelnames: Tuple[str, ...], labels: Dict[str, Any]) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+def _format_labels(labelnames: Tuple[str, ...], key: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(labelnames, key)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Contador monótono con etiquetas."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1.0, **labels) -> None:
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {",".join(k) or "_": v for k, v in self._values.items()}
+
+
+class Histogram:
+    """Histograma acumulativo con etiquetas (buckets fijos, como en Prometheus)."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Por etiqueta: [conteos por bucket (+Inf al final), suma, cantidad]
+        self._series: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = _label_key(self.labelnames, labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, (list(s[0]), s[1], s[2])) for k, s in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            acumulado = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                acumulado += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {acumulado}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {",".join(k) or "_": {"count": s[2], "sum_s": round(s[1], 6),
+                                         "avg_ms": round(1000 * s[1] / s[2], 3) if s[2] else 0.0}
+                    for k, s in self._series.items()}
+
+
+class MetricsRegistry:
+    """Registro de métricas del proceso; counter()/histogram() retornan la existente si ya se creó."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"La métrica '{name}' ya existe con otro tipo ({metric.kind}).")
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def render_prometheus(self) -> str:
+        """Todas las métricas en el formato de texto de exposición de Prometheus (0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.snapshot() for m in metrics}
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram("ecomarket_stage_seconds", "Duración de cada etapa instrumentada.", ("stage",))
+STAGE_ERRORS = REGISTRY.counter("ecomarket_stage_errors_total", "Etapas que terminaron con una excepción.", ("stage",))
+
+
+def render_prometheus() -> str:
+    return REGISTRY.render_prometheus()
+
+
+def metrics_snapshot() -> Dict[str, Any]:
+    return REGISTRY.snapshot()
+
+
+# --- LOGS ESTRUCTURADOS ---
+_CURRENT_SPAN: contextvars.ContextVar = contextvars.ContextVar("ecomarket_span", default=None)
+_WRITE_LOCK = threading.Lock()
+
+
+def _emit_json(record: Dict[str, Any]) -> None:
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _WRITE_LOCK:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+
+def log(level: str, message: str, **fields) -> None:
+    """
+    Evento de log. En formato "text" imprime "DEBUG: mensaje" (o ERROR, ADVERTENCIA...) como hasta
+    ahora; en "json" emite una línea con timestamp, nivel, mensaje, campos y trace/span activo.
+    """
+    if LOG_FORMAT != "json":
+        print(f"{_LEVEL_PREFIX.get(level, level.upper())}: {message}")
+        return
+    record = {"ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"), "level": level,
+              "msg": message}
+    current = _CURRENT_SPAN.get()
+    if current is not None:
+        record["trace_id"] = current.trace_id
+        record["span_id"] = current.span_id
+        record["span"] = current.name
+    record.update(fields)
+    _emit_json(record)
+
+
+def debug(message: str, **fields) -> None:
+    log("debug", message, **fields)
+
+
+def warning(message: str, **fields) -> None:
+    log("warning", message, **fields)
+
+
+def error(message: str, **fields) -> None:
+    log("error", message, **fields)
+
+
+def critical(message: str, **fields) -> None:
+    log("critical", message, **fields)
+
+
+# --- SPANS ---
+class Span:
+    """Etapa medida: al salir registra su duración (y si falló) y, con logs JSON, emite el evento."""
+
+    __slots__ = ("name", "attrs", "trace_id", "span_id", "parent_id", "start", "duration", "_token")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.duration = 0.0
+
+    def set(self, **attrs) -> None:
+        """Agrega atributos al span (p. ej. cantidades conocidas al final de la etapa)."""
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        parent = _CURRENT_SPAN.get()
+        self.trace_id = parent.trace_id if parent is not None else f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent is not None else None
+        self.span_id = f"{random.getrandbits(32):08x}"
+        self._token = _CURRENT_SPAN.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.duration = time.perf_counter() - self.start
+        _CURRENT_SPAN.reset(self._token)
+        STAGE_SECONDS.observe(self.duration, stage=self.name)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(stage=self.name)
+        if LOG_FORMAT == "json":
+            record = {"ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"), "level": "info",
+                      "event": "span", "span": self.name, "duration_ms": round(self.duration * 1000, 3),
+                      "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id}
+            if exc_type is not None:
+                record["error"] = f"{exc_type.__name__}: {exc}"
+            record.update(self.attrs)
+            _emit_json(record)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+    duration = 0.0
+
+    def set(self, **attrs) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attrs):
+    """Context manager que mide la etapa 'name' (un objeto vacío si la telemetría está desactivada)."""
+    if not TELEMETRY_ENABLED:
+        return _NOOP_SPAN
+    return Span(name, attrs)
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorador: ejecuta la función (sincrónica o async) dentro de span(name)."""
+
+    def decorator(func: Callable) -> Callable:
+        stage = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not TELEMETRY_ENABLED:
+                    return await func(*args, **kwargs)
+                with Span(stage, {}):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TELEMETRY_ENABLED:
+                return func(*args, **kwargs)
+            with Span(stage, {}):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
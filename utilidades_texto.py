@@ -0,0 +1,40 @@
+# ============================================================
+# 🔤 utilidades_texto.py — Normalización de texto compartida
+# ============================================================
+# Módulo liviano (sin dependencias pesadas) para que agente, RAG y herramientas
+# normalicen el texto exactamente igual.
+
+import re
+import unicodedata
+from typing import List
+
+
+def normalize_text(txt: str) -> str:
+    """Minúsculas, sin tildes, sin signos de puntuación y con espacios simples."""
+    txt = txt.strip().lower()
+    txt = ''.join(c for c in unicodedata.normalize('NFD', txt) if unicodedata.category(c) != 'Mn')
+    txt = re.sub(r'[^a-z0-9\s]', ' ', txt)
+    return re.sub(r'\s+', ' ', txt).strip()
+
+
+# Palabras vacías: no aportan para decidir qué documento o FAQ responde la consulta
+STOPWORDS = {
+    "a", "al", "como", "con", "cual", "cuales", "de", "del", "el", "en", "es", "esta", "este",
+    "fue", "hay", "la", "las", "lo", "los", "me", "mi", "mis", "para", "por", "puedo", "que",
+    "se", "si", "su", "sus", "tengo", "tienen", "tu", "un", "una", "y", "yo", "hola", "quiero",
+    "saber", "favor", "gracias", "buenas", "buenos", "dias", "tardes", "noches", "o",
+}
+
+
+def _stem(token: str) -> str:
+    """Stemming mínimo de plurales (devoluciones -> devolucion, productos -> producto)."""
+    if len(token) > 5 and token.endswith("es"):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Términos normalizados, sin palabras vacías y con plurales simplificados."""
+    return [_stem(t) for t in normalize_text(text).split() if t not in STOPWORDS]